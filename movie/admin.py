@@ -1,16 +1,27 @@
 from django.contrib import admin
-from .models import Movie
+from django.contrib.admin.views.main import ChangeList
+from .models import Genre, Movie, Review
+
+class MovieChangeList(ChangeList):
+    def get_queryset(self, request, exclude_parameters=None):
+        # Only the columns list_display renders; never the embedding vectors
+        return super().get_queryset(request, exclude_parameters).for_admin_list()
+
 
 @admin.register(Movie)
 class MovieAdmin(admin.ModelAdmin):
-    list_display = ('title', 'genre', 'year', 'has_embedding', 'embedding_age')
-    list_filter = ('genre', 'year', 'embedding_updated_at')
+    list_display = ('title', 'genre', 'year', 'rating_avg', 'rating_count', 'has_embedding', 'embedding_age')
+    list_filter = ('genres', 'year', 'embedding_updated_at')
     search_fields = ('title', 'description')
     readonly_fields = ('embedding_updated_at', 'embedding_display')
     
+    def get_changelist(self, request, **kwargs):
+        return MovieChangeList
+    
     def has_embedding(self, obj):
-        return obj.embedding is not None
+        return obj.embedding_stored
     has_embedding.boolean = True
+    has_embedding.admin_order_field = 'embedding_stored'
     has_embedding.short_description = 'Has Embedding'
     
     def embedding_age(self, obj):
@@ -29,7 +40,23 @@ class MovieAdmin(admin.ModelAdmin):
     embedding_age.short_description = 'Embedding Age'
     
     def embedding_display(self, obj):
-        if not obj.embedding:
+        if obj.embedding is None or len(obj.embedding) == 0:
             return 'No embedding stored'
-        return f'Vector with {len(obj.embedding)} dimensions'
-    embedding_display.short_description = 'Embedding'
\ No newline at end of file
+        return f'Vector with {len(obj.embedding)} dimensions ({obj.embedding.dtype.name}, {obj.embedding.nbytes} bytes)'
+    embedding_display.short_description = 'Embedding'
+
+
+@admin.register(Genre)
+class GenreAdmin(admin.ModelAdmin):
+    list_display = ('name',)
+    search_fields = ('name',)
+
+
+@admin.register(Review)
+class ReviewAdmin(admin.ModelAdmin):
+    list_display = ('movie', 'user', 'rating', 'created_at')
+    list_filter = ('rating',)
+    search_fields = ('movie__title', 'user__username')
+    # Selecting from every movie and user would load them all into the form
+    raw_id_fields = ('movie', 'user')
+    list_select_related = ('movie', 'user')
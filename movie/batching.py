@@ -0,0 +1,174 @@
+"""
+Helpers shared by the long-running management commands that call external
+APIs in bulk: chunking, token-bucket rate limiting, deciding which API
+errors to retry, resumable checkpoints and a local cache of paid-for API
+responses.
+"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from itertools import islice
+
+import openai
+
+
+def chunked(iterable, size):
+    """Yield lists of at most `size` items from any iterable"""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket: `rate` tokens per minute, bursting up to
+    `capacity`. acquire() blocks until enough tokens are available.
+
+    Used with a cost of 1 per call for requests-per-minute limits, or with an
+    estimated token count for tokens-per-minute limits. A rate of 0 or None
+    disables limiting.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate or 0
+        self.capacity = capacity or self.rate
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate / 60.0)
+        self._updated_at = now
+
+    def acquire(self, tokens=1):
+        if self.rate <= 0:
+            return
+        # A single request larger than the bucket can never fit; let it through
+        # once the bucket is full instead of blocking forever
+        tokens = min(tokens, self.capacity)
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                wait = (tokens - self._tokens) * 60.0 / self.rate
+            time.sleep(wait)
+
+
+def is_transient_api_error(error):
+    """
+    Whether an OpenAI API error may succeed when retried: rate limits,
+    timeouts, connection failures and 5xx responses. Errors the request
+    itself causes (authentication, invalid or rejected prompts, ...) fail
+    the same way every time, so retrying them only costs time.
+    """
+    if isinstance(error, (openai.RateLimitError, openai.APIConnectionError)):
+        # APIConnectionError includes APITimeoutError
+        return True
+    return isinstance(error, openai.APIStatusError) and error.status_code >= 500
+
+
+class Checkpoint:
+    """
+    Set of already-processed ids persisted to a JSON file, so an interrupted
+    run can resume where it stopped. Every save is an atomic rename, so a
+    crash never leaves a truncated file behind.
+    """
+
+    def __init__(self, path, signature=None):
+        self.path = path
+        # Describes the run (command options); a checkpoint written by a
+        # differently configured run is ignored
+        self.signature = signature
+        self.done = set()
+        self._lock = threading.Lock()
+
+    def load(self):
+        if not self.path or not os.path.exists(self.path):
+            return self.done
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return self.done
+        if data.get('signature') == self.signature:
+            self.done = set(data.get('done', []))
+        return self.done
+
+    def mark_done(self, ids):
+        with self._lock:
+            self.done.update(ids)
+            self._save()
+
+    def _save(self):
+        if not self.path:
+            return
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.checkpoint-', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump({'signature': self.signature, 'done': sorted(self.done)}, f)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def clear(self):
+        self.done = set()
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class ResponseCache:
+    """
+    Local cache of API responses keyed by request, kept in an append-only
+    JSON-lines file, so rerunning a command doesn't pay for the same request
+    twice. Each entry is flushed as soon as it is added; a line torn by a
+    crash is skipped on load.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(*parts):
+        """Stable key for a request made of JSON-serializable parts"""
+        payload = json.dumps(parts, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def load(self):
+        if not self.path or not os.path.exists(self.path):
+            return self
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                    self._entries[entry['key']] = entry['value']
+                except (ValueError, KeyError, TypeError):
+                    continue
+        return self
+
+    def get(self, key, default=None):
+        return self._entries.get(key, default)
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            if not self.path:
+                return
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps({'key': key, 'value': value}, ensure_ascii=False) + '\n')
@@ -0,0 +1,62 @@
+"""
+Catalog version stamps: opaque values that change whenever the data of a
+namespace is written ('movie' for movies, genres and similar movies,
+'news' for news). Anything derived from that data (statistics charts,
+cached pages and fragments) is cached under a key that includes the stamp,
+so a write invalidates it without having to know which cache entries exist.
+
+Model saves and deletes bump the stamps through signals (see movie.signals
+and news.signals). Bulk writes (bulk_create / bulk_update / queryset.update)
+skip signals, so code doing them must call bump_catalog_version() itself.
+
+The stamps live in the database (CatalogVersion), not in the cache: with a
+per-process cache (CACHE_BACKEND=locmem) a stamp kept there would only be
+bumped in the process that made the write, and a management command would
+never invalidate what the web workers cached. Reading them costs one
+primary-key query per request. A bump is part of the writing transaction,
+so other processes see the new stamp exactly when they can see the new
+data, and a rolled-back write leaves the stamp alone.
+"""
+import time
+
+from django.db import IntegrityError, transaction
+
+NAMESPACES = ('movie', 'news')
+
+
+def _new_version():
+    # Time-based rather than a counter, so a stamp never comes back after
+    # its row is deleted (or a test transaction is rolled back)
+    return time.time_ns()
+
+
+def get_catalog_versions(namespaces):
+    """Stamps of several namespaces as strings, in order, with one query when all exist"""
+    from .models import CatalogVersion
+
+    for namespace in namespaces:
+        if namespace not in NAMESPACES:
+            raise KeyError(namespace)
+    found = dict(CatalogVersion.objects.filter(namespace__in=namespaces).values_list('namespace', 'version'))
+    for namespace in namespaces:
+        if namespace not in found:
+            # First use: start a version. Another process may create it at
+            # the same time; then its value is used.
+            try:
+                with transaction.atomic():
+                    found[namespace] = CatalogVersion.objects.create(namespace=namespace, version=_new_version()).version
+            except IntegrityError:
+                found[namespace] = CatalogVersion.objects.values_list('version', flat=True).get(namespace=namespace)
+    return [str(found[namespace]) for namespace in namespaces]
+
+
+def get_catalog_version(namespace='movie'):
+    return get_catalog_versions([namespace])[0]
+
+
+def bump_catalog_version(namespace='movie'):
+    from .models import CatalogVersion
+
+    if namespace not in NAMESPACES:
+        raise KeyError(namespace)
+    CatalogVersion.objects.update_or_create(namespace=namespace, defaults={'version': _new_version()})
@@ -0,0 +1,93 @@
+"""
+HTTP downloads for the import commands: retries with exponential backoff,
+and a thread-local requests.Session per worker so connections are reused.
+"""
+import logging
+import os
+import tempfile
+import threading
+import time
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+# Responses worth retrying; anything else (e.g. 404) fails immediately
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+# Bytes written per iteration when streaming a download to disk
+STREAM_CHUNK_SIZE = 64 * 1024
+
+_local = threading.local()
+
+
+def get_session():
+    """requests.Session owned by the calling thread (Sessions aren't thread-safe)"""
+    session = getattr(_local, 'session', None)
+    if session is None:
+        session = _local.session = requests.Session()
+    return session
+
+
+def _with_retries(download, url, retries, backoff):
+    """
+    Call download() until it succeeds. Connection errors, timeouts and
+    RETRY_STATUS_CODES are retried up to `retries` attempts in total, waiting
+    backoff, 2*backoff, ... seconds in between. The last error is raised.
+    """
+    for attempt in range(1, retries + 1):
+        try:
+            return download(last_attempt=attempt == retries)
+        except (requests.ConnectionError, requests.Timeout, requests.HTTPError, requests.exceptions.ChunkedEncodingError) as e:
+            retryable = not isinstance(e, requests.HTTPError) or e.response is None or e.response.status_code in RETRY_STATUS_CODES
+            if not retryable or attempt == retries:
+                raise
+            delay = backoff * 2 ** (attempt - 1)
+            logger.warning(f"Download of {url} failed ({str(e)}), retrying in {delay}s")
+            time.sleep(delay)
+
+
+def _check_status(response, url, last_attempt):
+    if response.status_code in RETRY_STATUS_CODES and not last_attempt:
+        raise requests.HTTPError(f"{response.status_code} for {url}", response=response)
+    response.raise_for_status()
+
+
+def fetch_bytes(url, timeout=5, retries=3, backoff=0.5, session=None):
+    """GET `url` and return the response body, retrying transient failures"""
+    session = session or get_session()
+
+    def download(last_attempt):
+        response = session.get(url, timeout=timeout)
+        _check_status(response, url, last_attempt)
+        return response.content
+
+    return _with_retries(download, url, retries, backoff)
+
+
+def stream_to_file(url, path, timeout=30, retries=3, backoff=0.5, session=None):
+    """
+    Download `url` to `path` in STREAM_CHUNK_SIZE pieces, never holding the
+    whole body in memory. The data goes to a temporary file next to `path`
+    that is renamed into place once complete, so `path` is never partial.
+    Transient failures are retried like fetch_bytes.
+    """
+    session = session or get_session()
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+
+    def download(last_attempt):
+        with session.get(url, timeout=timeout, stream=True) as response:
+            _check_status(response, url, last_attempt)
+            fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.download-')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    for chunk in response.iter_content(chunk_size=STREAM_CHUNK_SIZE):
+                        f.write(chunk)
+                os.replace(tmp_path, path)
+            except BaseException:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+        return path
+
+    return _with_retries(download, url, retries, backoff)
@@ -0,0 +1,21 @@
+"""
+Embedding settings shared by the commands that compute movie embeddings and
+the views that embed user prompts, so both always use the same model.
+"""
+import hashlib
+
+EMBEDDING_MODEL = "text-embedding-3-small"
+EMBEDDING_DIMENSIONS = 1536
+
+
+def estimate_tokens(text):
+    """Rough token count (about 4 characters per token) used for rate limiting"""
+    return max(1, len(text) // 4)
+
+
+def embedding_content_hash(text, model=EMBEDDING_MODEL):
+    """
+    Fingerprint of exactly what was embedded (model + text). A movie whose
+    stored hash differs from the hash of its current description is stale.
+    """
+    return hashlib.sha256(f'{model}\n{text}'.encode('utf-8')).hexdigest()
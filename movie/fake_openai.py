@@ -0,0 +1,129 @@
+"""
+Offline stand-in for the OpenAI client, for benchmarking and testing the
+management commands without network access or API costs.
+
+Only the parts of the client API the commands use are implemented. Results
+are deterministic: the same input always produces the same output.
+
+Fake image generations return `fake://` URLs that fake_stream_to_file
+"downloads" by drawing a placeholder PNG locally.
+"""
+import hashlib
+import os
+import tempfile
+import time
+from types import SimpleNamespace
+
+import numpy as np
+from PIL import Image
+
+from .embeddings import EMBEDDING_DIMENSIONS, estimate_tokens
+
+
+def fake_embedding(text, dimensions=EMBEDDING_DIMENSIONS):
+    """Unit-length pseudo-random vector seeded by the text"""
+    seed = int.from_bytes(hashlib.sha256(text.encode('utf-8')).digest()[:8], 'little')
+    vector = np.random.default_rng(seed).standard_normal(dimensions).astype(np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+class _FakeEmbeddings:
+    def __init__(self, client):
+        self._client = client
+
+    def create(self, input, model, **kwargs):
+        texts = [input] if isinstance(input, str) else list(input)
+        self._client._simulate_latency()
+        self._client.calls['embeddings'] += 1
+        return SimpleNamespace(
+            model=model,
+            data=[
+                SimpleNamespace(index=i, embedding=fake_embedding(text, self._client.dimensions).tolist())
+                for i, text in enumerate(texts)
+            ],
+            usage=SimpleNamespace(total_tokens=sum(estimate_tokens(text) for text in texts)),
+        )
+
+
+class _FakeChatCompletions:
+    def __init__(self, client):
+        self._client = client
+
+    def create(self, model, messages, max_tokens=None, **kwargs):
+        self._client._simulate_latency()
+        self._client.calls['chat'] += 1
+        prompt = messages[-1]['content']
+        # Echo the last line of the prompt (the movie details) so results
+        # are recognizable, plus a digest so different prompts differ
+        subject = prompt.strip().splitlines()[-1] if prompt.strip() else ''
+        digest = hashlib.sha256(prompt.encode('utf-8')).hexdigest()[:12]
+        content = f"Fake description for {subject} [{digest}]"
+        if max_tokens:
+            content = content[:max_tokens * 4]
+        return SimpleNamespace(
+            model=model,
+            choices=[SimpleNamespace(index=0, message=SimpleNamespace(role='assistant', content=content), finish_reason='stop')],
+            usage=SimpleNamespace(
+                prompt_tokens=estimate_tokens(prompt),
+                completion_tokens=estimate_tokens(content),
+                total_tokens=estimate_tokens(prompt) + estimate_tokens(content),
+            ),
+        )
+
+
+class _FakeImages:
+    def __init__(self, client):
+        self._client = client
+
+    def generate(self, prompt, model=None, size='256x256', n=1, **kwargs):
+        self._client._simulate_latency()
+        self._client.calls['images'] += 1
+        digest = hashlib.sha256(prompt.encode('utf-8')).hexdigest()[:16]
+        return SimpleNamespace(
+            created=int(time.time()),
+            data=[SimpleNamespace(url=f'fake://images/{digest}-{i}.png?size={size}') for i in range(n)],
+        )
+
+
+def fake_stream_to_file(url, path, **kwargs):
+    """
+    Stand-in for movie.downloads.stream_to_file for `fake://` URLs: writes a
+    solid-colour PNG (colour taken from the URL) atomically to `path`
+    """
+    digest = hashlib.sha256(url.encode('utf-8')).digest()
+    size = 256
+    if 'size=' in url:
+        size = int(url.rsplit('size=', 1)[1].split('x')[0])
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.download-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            Image.new('RGB', (size, size), tuple(digest[:3])).save(f, 'PNG')
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return path
+
+
+class FakeOpenAI:
+    """
+    Drop-in replacement for `openai.OpenAI` in the management commands.
+
+    `latency` (seconds) is slept on every call to mimic network round-trips,
+    which makes concurrency and rate-limit settings measurable offline.
+    """
+
+    def __init__(self, latency=0.0, dimensions=EMBEDDING_DIMENSIONS):
+        self.latency = latency
+        self.dimensions = dimensions
+        self.calls = {'embeddings': 0, 'chat': 0, 'images': 0}
+        self.embeddings = _FakeEmbeddings(self)
+        self.chat = SimpleNamespace(completions=_FakeChatCompletions(self))
+        self.images = _FakeImages(self)
+
+    def _simulate_latency(self):
+        if self.latency:
+            time.sleep(self.latency)
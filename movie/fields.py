@@ -0,0 +1,60 @@
+import base64
+
+import numpy as np
+from django.db import models
+
+
+class VectorField(models.BinaryField):
+    """
+    Stores a 1D numeric vector (e.g. an embedding) as raw little-endian bytes.
+
+    Values are read back as read-only NumPy arrays created with np.frombuffer,
+    so no JSON parsing or copying happens when a row is loaded. Lists, tuples
+    and arrays are accepted on assignment and converted to `dtype` on save.
+    float32 is the default; float16 halves the size again at some precision cost.
+    """
+    description = "Binary vector of floats"
+
+    def __init__(self, *args, dtype='float32', **kwargs):
+        self.dtype = np.dtype(dtype).newbyteorder('<')
+        super().__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        if self.dtype != np.dtype('<f4'):
+            kwargs['dtype'] = self.dtype.name
+        return name, path, args, kwargs
+
+    def decode(self, value):
+        """Bytes (or memoryview) from the database -> NumPy array without copying"""
+        if value is None:
+            return None
+        return np.frombuffer(value, dtype=self.dtype)
+
+    def encode(self, value):
+        """Any array-like -> bytes in this field's dtype"""
+        if value is None:
+            return None
+        if isinstance(value, (bytes, bytearray, memoryview)):
+            return bytes(value)
+        return np.asarray(value, dtype=self.dtype).tobytes()
+
+    def from_db_value(self, value, expression, connection):
+        return self.decode(value)
+
+    def to_python(self, value):
+        if value is None or isinstance(value, np.ndarray):
+            return value
+        if isinstance(value, str):
+            # Serialized form produced by value_to_string()
+            value = base64.b64decode(value.encode('ascii'))
+        if isinstance(value, (bytes, bytearray, memoryview)):
+            return self.decode(value)
+        return np.asarray(value, dtype=self.dtype)
+
+    def get_db_prep_value(self, value, connection, prepared=False):
+        return super().get_db_prep_value(self.encode(value), connection, prepared)
+
+    def value_to_string(self, obj):
+        value = self.encode(self.value_from_object(obj))
+        return None if value is None else base64.b64encode(value).decode('ascii')
@@ -0,0 +1,88 @@
+"""
+Image availability flags and metadata.
+
+Movie.image_ok records whether the movie's image file exists, so templates
+can choose between the poster and the default image without touching the
+filesystem while rendering. Movie.image_width, image_height and
+image_format record the file's size and format for the same reason (e.g.
+<img width/height> attributes). They are set whenever a movie is saved
+(see Movie.save). `manage.py refresh_image_flags` rechecks every movie, for
+files added or removed behind the application's back.
+"""
+from collections import namedtuple
+
+from django.core.exceptions import SuspiciousFileOperation
+from django.db import transaction
+from PIL import ExifTags, Image
+
+from .batching import chunked
+from .catalog import bump_catalog_version
+
+# Folder for poster files, relative to MEDIA_ROOT (as stored in Movie.image)
+IMAGES_FOLDER = 'movie/images'
+# Shown for movies without an image file
+DEFAULT_IMAGE_NAME = f'{IMAGES_FOLDER}/default.jpg'
+# Movie fields kept in step with the image file
+IMAGE_STATE_FIELDS = ['image_ok', 'image_width', 'image_height', 'image_format']
+
+# Values of IMAGE_STATE_FIELDS for one file
+ImageState = namedtuple('ImageState', IMAGE_STATE_FIELDS)
+MISSING_IMAGE = ImageState(False, None, None, '')
+# EXIF orientations that swap width and height
+ROTATED_ORIENTATIONS = {5, 6, 7, 8}
+
+
+def image_state(storage, name):
+    """
+    ImageState of the file `name` in `storage`. Only the image header is
+    read. A file that exists but isn't a readable image is ok but has no
+    size or format.
+    """
+    if not name:
+        return MISSING_IMAGE
+    try:
+        if not storage.exists(name):
+            return MISSING_IMAGE
+    except (OSError, ValueError, SuspiciousFileOperation):
+        return MISSING_IMAGE
+    try:
+        with storage.open(name, 'rb') as f, Image.open(f) as image:
+            width, height = image.size
+            # Sizes are as displayed: these EXIF orientations rotate by 90 degrees
+            if image.getexif().get(ExifTags.Base.Orientation, 1) in ROTATED_ORIENTATIONS:
+                width, height = height, width
+            return ImageState(True, width, height, (image.format or '').lower())
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return ImageState(True, None, None, '')
+
+
+def refresh_image_flags(queryset=None, batch_size=500):
+    """
+    Recheck the image of every movie in `queryset` and store the changed
+    flags and metadata. Each distinct file is checked once. Returns
+    (checked, changed).
+    """
+    from .models import Movie
+
+    if queryset is None:
+        queryset = Movie.objects.all()
+    storage = Movie._meta.get_field('image').storage
+
+    states = {}
+    changed = []
+    checked = 0
+    rows = queryset.values_list('id', 'image', *IMAGE_STATE_FIELDS).iterator(chunk_size=batch_size)
+    for movie_id, name, *current in rows:
+        checked += 1
+        if name not in states:
+            states[name] = image_state(storage, name)
+        if tuple(current) != states[name]:
+            changed.append(Movie(id=movie_id, **states[name]._asdict()))
+
+    for chunk in chunked(changed, batch_size):
+        with transaction.atomic():
+            Movie.objects.bulk_update(chunk, IMAGE_STATE_FIELDS)
+    if changed:
+        # bulk_update skips signals
+        bump_catalog_version()
+    return checked, len(changed)
@@ -0,0 +1,137 @@
+"""
+Content fingerprints for poster images, used to find duplicate posters.
+
+fingerprint() reads one file and returns its sha256, its difference hash
+(dHash) and its size and format (lowercase, e.g. 'png'). Two files with the
+same sha256 are byte-for-byte identical. Two files whose dHashes differ in only a few bits
+usually show the same picture, even after it was resized, recompressed or
+saved in another format (a poster and a smaller JPEG copy of it).
+
+A dHash only encodes brightness gradients, so unrelated images can share
+one: every flat or nearly flat image hashes to (almost) all zeros. Such
+low-detail hashes (see is_low_detail) are never matched by distance, and
+group_duplicates() only compares hashes of files with the same key (the
+movie the file was matched to), so a near-match can't move a poster from
+one movie to another.
+
+The dHash shrinks the image to a (HASH_SIZE + 1) x HASH_SIZE grayscale grid
+and records whether each pixel is brighter than its right-hand neighbour,
+giving a HASH_SIZE * HASH_SIZE bit integer.
+
+fingerprint() touches only the filesystem and Pillow (no Django state), so
+it can run in worker processes. group_duplicates() then clusters the
+results without comparing every pair of images.
+"""
+import hashlib
+from collections import defaultdict, namedtuple
+
+from PIL import Image, ImageOps
+
+HASH_SIZE = 8
+HASH_BITS = HASH_SIZE * HASH_SIZE
+# dHashes at most this many bits apart are treated as the same picture
+DEFAULT_MAX_DISTANCE = 4
+# Hashes with fewer set (or unset) bits than this carry too little detail
+# to be compared by distance
+MIN_DETAIL_BITS = 8
+# Bytes read per iteration while hashing a file
+READ_CHUNK_SIZE = 64 * 1024
+
+ImageFingerprint = namedtuple('ImageFingerprint', ['path', 'sha256', 'dhash', 'width', 'height', 'format'])
+
+
+def dhash(image, hash_size=HASH_SIZE):
+    """Difference hash of a PIL image as an int of hash_size**2 bits"""
+    small = image.convert('L').resize((hash_size + 1, hash_size), Image.LANCZOS)
+    pixels = list(small.getdata())
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+def fingerprint(path):
+    """
+    ImageFingerprint of the image file at `path`. Width and height are as
+    displayed, after applying any EXIF orientation. Raises OSError (or
+    PIL.UnidentifiedImageError, a subclass) for unreadable files.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(READ_CHUNK_SIZE), b''):
+            digest.update(chunk)
+
+    with Image.open(path) as image:
+        image_format = (image.format or '').lower()
+        image = ImageOps.exif_transpose(image)
+        return ImageFingerprint(path, digest.hexdigest(), dhash(image), image.width, image.height, image_format)
+
+
+def hamming(a, b):
+    """Number of differing bits between two hashes"""
+    return (a ^ b).bit_count()
+
+
+def is_low_detail(hash_value):
+    """Whether a dHash is (nearly) all zeros or all ones, as for flat images"""
+    bits = hash_value.bit_count()
+    return bits < MIN_DETAIL_BITS or HASH_BITS - bits < MIN_DETAIL_BITS
+
+
+def group_duplicates(fingerprints, max_distance=DEFAULT_MAX_DISTANCE, key=None):
+    """
+    Cluster fingerprints showing the same picture. Returns a list of groups,
+    each a list of fingerprints in input order. Two fingerprints are grouped
+    (transitively) when they have:
+
+    * the same sha256, whatever their key; or
+    * dHashes at most `max_distance` bits apart, neither of them low
+      detail, and the same key(fingerprint), which must not be None. Without
+      `key` every fingerprint has the same key.
+
+    Candidate pairs come from splitting each hash into max_distance + 1
+    bands: two hashes within max_distance bits must agree on at least one
+    whole band, so only images sharing a band are compared.
+    """
+    fingerprints = list(fingerprints)
+    parent = list(range(len(fingerprints)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    def union(i, j):
+        i, j = find(i), find(j)
+        if i != j:
+            parent[max(i, j)] = min(i, j)
+
+    by_sha = {}
+    for i, fp in enumerate(fingerprints):
+        union(i, by_sha.setdefault(fp.sha256, i))
+
+    keys = [key(fp) if key else True for fp in fingerprints]
+    if max_distance >= 0:
+        bands = min(max_distance + 1, HASH_BITS)
+        band_edges = [HASH_BITS * b // bands for b in range(bands + 1)]
+        buckets = defaultdict(list)
+        for i, fp in enumerate(fingerprints):
+            if keys[i] is None or is_low_detail(fp.dhash):
+                continue
+            for b in range(bands):
+                width = band_edges[b + 1] - band_edges[b]
+                band = (fp.dhash >> band_edges[b]) & ((1 << width) - 1)
+                buckets[keys[i], b, band].append(i)
+        for members in buckets.values():
+            for x, i in enumerate(members):
+                for j in members[x + 1:]:
+                    if find(i) != find(j) and hamming(fingerprints[i].dhash, fingerprints[j].dhash) <= max_distance:
+                        union(i, j)
+
+    groups = defaultdict(list)
+    for i, fp in enumerate(fingerprints):
+        groups[find(i)].append(fp)
+    return [groups[root] for root in sorted(groups)]
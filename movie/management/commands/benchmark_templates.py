@@ -0,0 +1,180 @@
+import re
+import time
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.management.base import BaseCommand
+from django.core.paginator import Paginator
+from django.template import Context, Engine, RequestContext
+from django.template.backends.django import get_installed_libraries
+from django.test import RequestFactory
+from movie.image_files import DEFAULT_IMAGE_NAME
+from movie.models import Movie
+
+# The star-rating markup home.html used before the star_rating tag: nested
+# {% with %}/{% if %} blocks faking a rating from the movie id, re-evaluated
+# for every card
+LEGACY_STAR_RATING = """
+{% with id_mod=movie.id|add:0|divisibleby:5 %}
+  {% if id_mod %}
+    {% with rating=5.0 %}
+      {% for i in '12345' %}<i class="bi bi-star-fill"></i>{% endfor %}
+      <small class="ms-1 text-muted">{{ rating|floatformat:1 }}</small>
+    {% endwith %}
+  {% else %}
+    {% with id_mod=movie.id|add:0|divisibleby:4 %}
+      {% if id_mod %}
+        {% with rating=4.5 %}
+          {% for i in '1234' %}<i class="bi bi-star-fill"></i>{% endfor %}
+          <i class="bi bi-star-half"></i>
+          <small class="ms-1 text-muted">{{ rating|floatformat:1 }}</small>
+        {% endwith %}
+      {% else %}
+        {% with id_mod=movie.id|add:0|divisibleby:3 %}
+          {% if id_mod %}
+            {% with rating=4.0 %}
+              {% for i in '1234' %}<i class="bi bi-star-fill"></i>{% endfor %}
+              <i class="bi bi-star"></i>
+              <small class="ms-1 text-muted">{{ rating|floatformat:1 }}</small>
+            {% endwith %}
+          {% else %}
+            {% with id_mod=movie.id|add:0|divisibleby:2 %}
+              {% if id_mod %}
+                {% with rating=3.5 %}
+                  {% for i in '123' %}<i class="bi bi-star-fill"></i>{% endfor %}
+                  <i class="bi bi-star-half"></i>
+                  <i class="bi bi-star"></i>
+                  <small class="ms-1 text-muted">{{ rating|floatformat:1 }}</small>
+                {% endwith %}
+              {% else %}
+                {% with rating=3.0 %}
+                  {% for i in '123' %}<i class="bi bi-star-fill"></i>{% endfor %}
+                  {% for i in '45' %}<i class="bi bi-star"></i>{% endfor %}
+                  <small class="ms-1 text-muted">{{ rating|floatformat:1 }}</small>
+                {% endwith %}
+              {% endif %}
+            {% endwith %}
+          {% endif %}
+        {% endwith %}
+      {% endif %}
+    {% endwith %}
+  {% endif %}
+{% endwith %}
+"""
+STAR_RATING_TAG = '{% star_rating movie.rating_avg %}'
+
+
+def legacy_rating(movie_id):
+    """The rating LEGACY_STAR_RATING shows for a movie id"""
+    for divisor, rating in ((5, 5.0), (4, 4.5), (3, 4.0), (2, 3.5)):
+        if movie_id % divisor == 0:
+            return rating
+    return 3.0
+
+class Command(BaseCommand):
+    help = ("Measure template loading and rendering: the previous setup (templates parsed on every "
+            "request, star ratings as nested template blocks) against the current one (cached "
+            "loader, star_rating tag). Needs no database.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=200,
+                            help='Renders timed per measurement')
+        parser.add_argument('--movies', type=int, default=12,
+                            help='Movie cards on the rendered home page')
+
+    def make_engine(self, cached):
+        options = settings.TEMPLATES[0]
+        loaders = list(settings.BASE_TEMPLATE_LOADERS)
+        return Engine(
+            dirs=options['DIRS'],
+            context_processors=options['OPTIONS']['context_processors'],
+            loaders=[('django.template.loaders.cached.Loader', loaders)] if cached else loaders,
+            libraries=get_installed_libraries(),
+        )
+
+    def time_per_call(self, function, iterations):
+        function()  # Warm-up: imports, URL resolver, first cache fill
+        start = time.perf_counter()
+        for _ in range(iterations):
+            function()
+        return (time.perf_counter() - start) / iterations
+
+    def report(self, label, before, after):
+        self.stdout.write(
+            f"{label:<34} before {before * 1000:8.3f} ms   after {after * 1000:8.3f} ms   "
+            f"({before / after:.1f}x faster)"
+        )
+
+    def handle(self, *args, **options):
+        iterations = max(1, options['iterations'])
+        uncached_engine = self.make_engine(cached=False)
+        cached_engine = self.make_engine(cached=True)
+
+        # In-memory movies shaped like Movie.objects.for_listing() rows
+        movies = []
+        for movie_id in range(1, options['movies'] + 1):
+            movie = Movie(
+                id=movie_id, title=f'Movie {movie_id}', year=2000 + movie_id % 25, genre='Drama',
+                image=DEFAULT_IMAGE_NAME, image_ok=True, image_width=600, image_height=419,
+                # Same stars as the legacy markup, so both render the same thing
+                rating_avg=legacy_rating(movie_id), rating_count=1,
+            )
+            movie.description_excerpt = 'A short description of the movie. ' * 3
+            movies.append(movie)
+
+        # Star markup alone, both templates compiled once
+        legacy_stars = cached_engine.from_string(LEGACY_STAR_RATING)
+        tag_stars = cached_engine.from_string('{% load rating_tags %}' + STAR_RATING_TAG)
+        contexts = [Context({'movie': movie}) for movie in movies]
+        mismatches = [
+            movie.id for movie, context in zip(movies, contexts)
+            if self.normalize(legacy_stars.render(context)) != self.normalize(tag_stars.render(context))
+        ]
+        if mismatches:
+            self.stderr.write(self.style.WARNING(f"Star markup differs for movie ids {mismatches}"))
+
+        def render_all(template):
+            return lambda: [template.render(context) for context in contexts]
+
+        self.stdout.write(f"{iterations} iterations, {len(movies)} movie cards")
+        self.report(
+            f"star ratings ({len(movies)} cards)",
+            self.time_per_call(render_all(legacy_stars), iterations),
+            self.time_per_call(render_all(tag_stars), iterations),
+        )
+
+        # Loading (finding and parsing) home.html and base.html
+        self.report(
+            "load home.html",
+            self.time_per_call(lambda: uncached_engine.get_template('home.html'), iterations),
+            self.time_per_call(lambda: cached_engine.get_template('home.html'), iterations),
+        )
+
+        # A whole anonymous home page request: load + render
+        request = RequestFactory().get('/')
+        request.user = AnonymousUser()
+        context = {
+            'movies': Paginator(movies, len(movies)).page(1),
+            'available_genres': ['Action', 'Comedy', 'Drama'],
+            'current_sort': 'default',
+        }
+        home_source = cached_engine.get_template('home.html').source
+        if STAR_RATING_TAG not in home_source:
+            self.stderr.write(self.style.WARNING("home.html no longer uses the star_rating tag; the 'before' page is approximate"))
+        legacy_home_source = home_source.replace(STAR_RATING_TAG, LEGACY_STAR_RATING)
+
+        def render_before():
+            # Parsed on every request, as with the previous loaders
+            return uncached_engine.from_string(legacy_home_source).render(RequestContext(request, context))
+
+        def render_after():
+            return cached_engine.get_template('home.html').render(RequestContext(request, context))
+
+        self.report(
+            "render home page",
+            self.time_per_call(render_before, iterations),
+            self.time_per_call(render_after, iterations),
+        )
+
+    @staticmethod
+    def normalize(html):
+        return re.sub(r'\s+', '', html)
@@ -1,12 +1,17 @@
 import os
-import numpy as np
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import BooleanField, ExpressionWrapper, Q
 from django.utils import timezone
+from movie.batching import Checkpoint, TokenBucket, chunked, is_transient_api_error
+from movie.embeddings import EMBEDDING_MODEL, embedding_content_hash, estimate_tokens
+from movie.fake_openai import FakeOpenAI
 from movie.models import Movie
 from openai import OpenAI
 from dotenv import load_dotenv
 import logging
-import time
 
 logger = logging.getLogger(__name__)
 
@@ -19,8 +24,42 @@ class Command(BaseCommand):
             action='store_true',
             help='Force recomputation of embeddings even if they already exist',
         )
+        parser.add_argument(
+            '--missing-only',
+            action='store_true',
+            help='Only embed movies without an embedding, ignoring changed descriptions',
+        )
+        parser.add_argument(
+            '--stamp-existing',
+            action='store_true',
+            help='Record content hashes for existing embeddings that have none, assuming they are current, without calling the API',
+        )
+        parser.add_argument('--batch-size', type=int, default=100,
+                            help='Number of descriptions sent in each embeddings API call')
+        parser.add_argument('--workers', type=int, default=4,
+                            help='Maximum number of concurrent API calls')
+        parser.add_argument('--rpm', type=int, default=500,
+                            help='Maximum API requests per minute (0 disables the limit)')
+        parser.add_argument('--tpm', type=int, default=1000000,
+                            help='Maximum estimated input tokens per minute (0 disables the limit)')
+        parser.add_argument('--write-chunk', type=int, default=500,
+                            help='Number of movies saved per bulk_update')
+        parser.add_argument('--retries', type=int, default=3,
+                            help='Attempts per batch before giving up on it')
+        parser.add_argument('--checkpoint', type=str, default='.compute_embeddings.checkpoint.json',
+                            help='File that records finished movies so an interrupted run can resume')
+        parser.add_argument('--restart', action='store_true',
+                            help='Ignore any existing checkpoint and start from scratch')
+        parser.add_argument('--fake', action='store_true',
+                            help='Use a local fake OpenAI client (no network, no cost) for benchmarking')
+        parser.add_argument('--fake-latency', type=float, default=0.2,
+                            help='Simulated seconds per API call when using --fake')
+
+    def get_client(self, options):
+        if options['fake']:
+            self.stdout.write(f"Using fake OpenAI client ({options['fake_latency']}s per call)")
+            return FakeOpenAI(latency=options['fake_latency'])
 
-    def handle(self, *args, **options):
         # Attempt to load OpenAI API key from .env files
         # This is primarily for local development. On DO, these files won't exist.
         env_loaded_from_file = False
@@ -30,11 +69,11 @@ class Command(BaseCommand):
                 env_loaded_from_file = True # Indicates an attempt was made and a file was found
                 logger.info(f"Loaded environment variables from: {path}")
                 break
-        
+
         # Now, check if the API key is actually available in the environment,
         # either from the .env file (if loaded) or from platform environment variables.
         api_key_value = os.environ.get('openai_apikey')
-        
+
         if not api_key_value:
             # Construct a more informative error message
             error_msg = "OpenAI API key ('openai_apikey') not found. "
@@ -43,43 +82,201 @@ class Command(BaseCommand):
             else:
                 error_msg += "No .env file was found, and it was not set as a platform environment variable."
             self.stderr.write(self.style.ERROR(error_msg))
+            return None
+
+        return OpenAI(api_key=api_key_value)
+
+    def embed_batch(self, client, batch, rpm_bucket, tpm_bucket, retries):
+        """
+        Embed one batch of (content_hash, text) pairs with a single API call.
+        Runs in a worker thread; returns [(content_hash, embedding), ...].
+        """
+        texts = [text for _, text in batch]
+        for attempt in range(1, retries + 1):
+            rpm_bucket.acquire(1)
+            tpm_bucket.acquire(sum(estimate_tokens(text) for text in texts))
+            try:
+                response = client.embeddings.create(input=texts, model=EMBEDDING_MODEL)
+                # The API returns one item per input, tagged with its position
+                vectors = sorted(response.data, key=lambda item: item.index)
+                return [(content_hash, item.embedding) for (content_hash, _), item in zip(batch, vectors)]
+            except Exception as e:
+                # Bad requests (e.g. an input over the context length) or
+                # authentication errors would fail again and spend budget
+                if attempt == retries or not is_transient_api_error(e):
+                    raise
+                delay = 2 ** attempt
+                logger.warning(f"Embeddings call failed ({str(e)}), retrying in {delay}s")
+                time.sleep(delay)
+
+    def stamp_existing(self):
+        """Adopt embeddings computed before content hashes were recorded"""
+        movies = Movie.objects.filter(embedding__isnull=False, embedding_hash='').only('id', 'description')
+        stamped = []
+        for movie in movies.iterator():
+            movie.embedding_hash = embedding_content_hash(movie.description)
+            stamped.append(movie)
+        with transaction.atomic():
+            Movie.objects.bulk_update(stamped, ['embedding_hash'], batch_size=500)
+        self.stdout.write(self.style.SUCCESS(f"Recorded content hashes for {len(stamped)} existing embeddings"))
+
+    def handle(self, *args, **options):
+        if options['stamp_existing']:
+            self.stamp_existing()
             return
-            
-        client = OpenAI(api_key=api_key_value)
-        
-        # Get movies that need embedding computation
+
         if options['force']:
-            movies = Movie.objects.all()
-            self.stdout.write(f"Force updating embeddings for all {movies.count()} movies")
+            mode = 'force'
+        elif options['missing_only']:
+            mode = 'missing'
         else:
-            movies = Movie.objects.filter(embedding__isnull=True)
-            self.stdout.write(f"Computing embeddings for {movies.count()} movies without embeddings")
-        
-        if movies.count() == 0:
+            mode = 'changed'
+
+        checkpoint = Checkpoint(
+            options['checkpoint'],
+            signature={'mode': mode, 'model': EMBEDDING_MODEL},
+        )
+        if options['restart']:
+            checkpoint.clear()
+        done_ids = checkpoint.load()
+        if done_ids:
+            self.stdout.write(f"Resuming from checkpoint: {len(done_ids)} movies already done")
+
+        # Work out which movies need (re-)embedding from ids, descriptions and
+        # stored hashes only; the stored vectors themselves are never loaded
+        movies = Movie.objects.order_by('id')
+        if mode == 'missing':
+            movies = movies.filter(embedding__isnull=True)
+        rows = movies.annotate(
+            has_embedding=ExpressionWrapper(Q(embedding__isnull=False), output_field=BooleanField())
+        ).values_list('id', 'title', 'description', 'embedding_hash', 'has_embedding')
+
+        # content hash -> (text, [movie ids]), so identical descriptions are embedded once
+        pending = {}
+        # content hash -> id of a movie whose stored embedding is already current
+        current = {}
+        stale_count = 0
+        for movie_id, title, description, stored_hash, has_embedding in rows.iterator():
+            if not description:
+                self.stdout.write(f"Skipping {title} - no description")
+                continue
+            content_hash = embedding_content_hash(description)
+            if has_embedding and stored_hash == content_hash:
+                current.setdefault(content_hash, movie_id)
+                if mode != 'force':
+                    continue
+            if movie_id in done_ids:
+                continue
+            stale_count += 1
+            pending.setdefault(content_hash, (description, []))[1].append(movie_id)
+
+        if mode == 'force':
+            self.stdout.write(f"Force updating embeddings for {stale_count} movies")
+            # Recompute everything, even texts that have a current embedding
+            current = {}
+        elif mode == 'missing':
+            self.stdout.write(f"Computing embeddings for {stale_count} movies without embeddings")
+        else:
+            self.stdout.write(f"Computing embeddings for {stale_count} movies that are missing or have changed descriptions")
+
+        if not pending:
             self.stdout.write(self.style.SUCCESS("No movies need embedding updates"))
+            checkpoint.clear()
             return
-            
-        for i, movie in enumerate(movies):
-            if not movie.description:
-                self.stdout.write(f"Skipping {movie.title} - no description")
-                continue
-                
-            try:
-                # Get embedding for the movie description
-                response = client.embeddings.create(input=[movie.description], model="text-embedding-3-small")
-                embedding = response.data[0].embedding
-                
-                # Store the embedding
-                movie.embedding = embedding
-                movie.embedding_updated_at = timezone.now()
-                movie.save()
-                
-                self.stdout.write(f"[{i+1}/{movies.count()}] Computed embedding for {movie.title}")
-                
-                # Add rate limit delay to avoid OpenAI API throttling
-                time.sleep(0.5)
-                
-            except Exception as e:
-                self.stderr.write(self.style.ERROR(f"Error computing embedding for {movie.title}: {str(e)}"))
-                
-        self.stdout.write(self.style.SUCCESS(f"Successfully computed embeddings for {movies.count()} movies"))
+
+        write_buffer = []
+
+        def flush():
+            if not write_buffer:
+                return
+            now = timezone.now()
+            updates = [
+                Movie(id=movie_id, embedding=embedding, embedding_hash=content_hash, embedding_updated_at=now)
+                for movie_id, content_hash, embedding in write_buffer
+            ]
+            with transaction.atomic():
+                Movie.objects.bulk_update(
+                    updates, ['embedding', 'embedding_hash', 'embedding_updated_at'], batch_size=options['write_chunk']
+                )
+            # Only mark movies done once their embeddings are committed
+            checkpoint.mark_done(movie_id for movie_id, _, _ in write_buffer)
+            write_buffer.clear()
+
+        def queue_writes(content_hash, embedding):
+            for movie_id in pending[content_hash][1]:
+                write_buffer.append((movie_id, content_hash, embedding))
+            if len(write_buffer) >= options['write_chunk']:
+                flush()
+
+        # Texts some other movie already has a current embedding for are copied, not re-embedded
+        reusable = [content_hash for content_hash in pending if content_hash in current]
+        for chunk in chunked(reusable, options['write_chunk']):
+            source_ids = {current[content_hash]: content_hash for content_hash in chunk}
+            for source_id, embedding in Movie.objects.filter(id__in=source_ids).values_list('id', 'embedding'):
+                queue_writes(source_ids[source_id], embedding)
+        if reusable:
+            self.stdout.write(f"Reused existing embeddings for {len(reusable)} descriptions")
+
+        to_embed = [(content_hash, text) for content_hash, (text, _) in pending.items() if content_hash not in current]
+        total = len(to_embed)
+        if total < stale_count:
+            self.stdout.write(f"{total} unique descriptions to embed")
+        if total == 0:
+            flush()
+            checkpoint.clear()
+            self.stdout.write(self.style.SUCCESS(f"Successfully updated embeddings for {stale_count} movies"))
+            return
+
+        client = self.get_client(options)
+        if client is None:
+            flush()
+            return
+
+        rpm_bucket = TokenBucket(options['rpm'])
+        tpm_bucket = TokenBucket(options['tpm'])
+        batches = iter(chunked(to_embed, options['batch_size']))
+        workers = max(1, options['workers'])
+        completed = 0
+        failed = 0
+        start = time.perf_counter()
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            in_flight = {}
+
+            def submit_next():
+                batch = next(batches, None)
+                if batch is not None:
+                    future = executor.submit(self.embed_batch, client, batch, rpm_bucket, tpm_bucket, options['retries'])
+                    in_flight[future] = batch
+
+            # Keep a bounded number of batches queued so memory stays flat
+            for _ in range(workers * 2):
+                submit_next()
+
+            while in_flight:
+                finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    batch = in_flight.pop(future)
+                    try:
+                        for content_hash, embedding in future.result():
+                            queue_writes(content_hash, embedding)
+                        completed += len(batch)
+                        self.stdout.write(f"[{completed}/{total}] Computed embeddings for {len(batch)} descriptions")
+                    except Exception as e:
+                        failed += len(batch)
+                        self.stderr.write(self.style.ERROR(f"Error computing embeddings for a batch of {len(batch)} descriptions: {str(e)}"))
+                    submit_next()
+
+            flush()
+
+        elapsed = time.perf_counter() - start
+        rate = completed / elapsed if elapsed else 0
+        self.stdout.write(f"Embedded {completed} descriptions in {elapsed:.1f}s ({rate:.1f} descriptions/s)")
+
+        if failed:
+            self.stderr.write(self.style.WARNING(
+                f"{failed} descriptions failed; run the command again to resume from the checkpoint"
+            ))
+        else:
+            checkpoint.clear()
+            self.stdout.write(self.style.SUCCESS(f"Successfully updated embeddings for {stale_count} movies"))
@@ -0,0 +1,84 @@
+import time
+import numpy as np
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from movie.catalog import bump_catalog_version
+from movie.models import Movie, SimilarMovie
+from recommendations.embedding_index import normalize_rows
+
+
+class Command(BaseCommand):
+    help = "Precompute the most similar movies for every movie from the stored embeddings"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top', type=int, default=6,
+                            help='Number of similar movies stored per movie')
+        parser.add_argument('--block-size', type=int, default=1024,
+                            help='Movies scored per matrix multiplication block (bounds memory use)')
+        parser.add_argument('--min-score', type=float, default=None,
+                            help='Do not store pairs less similar than this')
+
+    def load_embeddings(self):
+        ids = []
+        vectors = []
+        for movie_id, embedding in Movie.objects.exclude(embedding__isnull=True).order_by('id').values_list('id', 'embedding').iterator(chunk_size=2000):
+            if embedding is None or len(embedding) == 0:
+                continue
+            if vectors and len(embedding) != len(vectors[0]):
+                self.stderr.write(f"Skipping movie {movie_id}: embedding dimension mismatch")
+                continue
+            ids.append(movie_id)
+            vectors.append(embedding)
+        if not vectors:
+            return np.empty(0, dtype=np.int64), None
+        return np.asarray(ids, dtype=np.int64), normalize_rows(np.vstack(vectors).astype(np.float32))
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        ids, matrix = self.load_embeddings()
+        if len(ids) < 2:
+            self.stderr.write(self.style.ERROR("At least two movies need embeddings. Run 'python manage.py compute_embeddings' first."))
+            return
+
+        top = min(options['top'], len(ids) - 1)
+        block_size = options['block_size']
+        min_score = options['min_score']
+        self.stdout.write(f"Computing top {top} similar movies for {len(ids)} movies...")
+
+        # Swap the whole table in one transaction so readers never see it
+        # half-built; each block's rows are written as soon as they are
+        # scored, so memory does not grow with the catalog
+        stored = 0
+        with transaction.atomic():
+            SimilarMovie.objects.all().delete()
+            for block_start in range(0, len(ids), block_size):
+                block = matrix[block_start:block_start + block_size]
+                # (block x N) cosine similarities in one multiplication
+                similarities = block @ matrix.T
+                # A movie is never its own recommendation
+                own = np.arange(len(block))
+                similarities[own, block_start + own] = -np.inf
+
+                candidates = np.argpartition(-similarities, top - 1, axis=1)[:, :top]
+                candidate_scores = np.take_along_axis(similarities, candidates, axis=1)
+                order = np.argsort(-candidate_scores, axis=1, kind='stable')
+                candidates = np.take_along_axis(candidates, order, axis=1)
+                candidate_scores = np.take_along_axis(candidate_scores, order, axis=1)
+
+                rows = []
+                for offset in range(len(block)):
+                    movie_id = int(ids[block_start + offset])
+                    for rank, (column, score) in enumerate(zip(candidates[offset], candidate_scores[offset]), start=1):
+                        if min_score is not None and score < min_score:
+                            break
+                        rows.append(SimilarMovie(movie_id=movie_id, similar_id=int(ids[column]), score=float(score), rank=rank))
+                SimilarMovie.objects.bulk_create(rows, batch_size=1000)
+                stored += len(rows)
+
+                self.stdout.write(f"[{min(block_start + block_size, len(ids))}/{len(ids)}] movies scored")
+
+            # Cached movie pages show the similar movies; bulk writes skip signals
+            bump_catalog_version()
+
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(f"Stored {stored} similar-movie pairs in {elapsed:.1f}s"))
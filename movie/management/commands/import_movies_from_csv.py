@@ -1,106 +1,195 @@
 import os
 import csv
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
 from django.core.management.base import BaseCommand
-from movie.models import Movie
+from django.db import transaction
+from movie.batching import chunked
+from movie.catalog import bump_catalog_version
+from movie.downloads import fetch_bytes
+from movie.image_files import image_state
+from movie.models import Movie, sync_genres
 from django.core.files.base import ContentFile
-import requests
-from io import BytesIO
 
 class Command(BaseCommand):
     help = "Import movies from a CSV file to the database"
-    
+
     def add_arguments(self, parser):
-        parser.add_argument('--csv_file', type=str, default='movies_initial.csv', 
+        parser.add_argument('--csv_file', type=str, default='movies_initial.csv',
                             help='Path to the CSV file containing movie data')
-        parser.add_argument('--limit', type=int, default=100, 
+        parser.add_argument('--limit', type=int, default=100,
                             help='Maximum number of movies to import')
-        parser.add_argument('--offset', type=int, default=0, 
+        parser.add_argument('--offset', type=int, default=0,
                             help='Number of rows to skip in the CSV (excluding header)')
-        
+        parser.add_argument('--chunk-size', type=int, default=1000,
+                            help='Number of CSV rows read, downloaded and inserted together')
+        parser.add_argument('--workers', type=int, default=8,
+                            help='Maximum number of concurrent poster downloads')
+        parser.add_argument('--retries', type=int, default=3,
+                            help='Attempts per poster download before giving up on it')
+        parser.add_argument('--timeout', type=float, default=5,
+                            help='Seconds to wait for each poster download')
+        parser.add_argument('--no-posters', action='store_true',
+                            help='Import movie data only, without downloading posters')
+
     def handle(self, *args, **options):
         csv_file_path = options['csv_file']
         limit = options['limit']
         offset = options['offset']
-        
+
         if not os.path.exists(csv_file_path):
             self.stderr.write(f"CSV file not found at {csv_file_path}")
             return
-        
+
         self.stdout.write(f"Importing movies from {csv_file_path} (offset: {offset}, limit: {limit})...")
-        
+
         # Keep track of successful and failed imports
-        success_count = 0
-        skip_count = 0
-        error_count = 0
-        
-        with open(csv_file_path, 'r', encoding='utf-8') as csvfile:
+        self.success_count = 0
+        self.skip_count = 0
+        self.error_count = 0
+        start = time.perf_counter()
+
+        # One query for every existing title instead of one per row; titles
+        # added by this run are added to the set as they are inserted
+        existing_titles = set(Movie.objects.values_list('title', flat=True))
+
+        with open(csv_file_path, 'r', encoding='utf-8', newline='') as csvfile:
             reader = csv.DictReader(csvfile)
-            
+
             # Skip rows according to offset
-            for i in range(offset):
-                try:
-                    next(reader)
-                except StopIteration:
-                    self.stderr.write(f"Offset {offset} is greater than the number of rows in the CSV")
-                    return
-            
-            # Process rows up to the limit
-            for i, row in enumerate(reader):
-                if i >= limit:
-                    break
-                
-                title = row.get('title', '').strip()
-                
-                # Skip if no title
-                if not title:
-                    self.stdout.write(f"Skipping row {offset+i+1}: No title found")
-                    skip_count += 1
-                    continue
-                
-                # Check if movie already exists
-                if Movie.objects.filter(title=title).exists():
-                    self.stdout.write(f"Skipping '{title}': Already in database")
-                    skip_count += 1
-                    continue
-                
+            if sum(1 for _ in islice(reader, offset)) < offset:
+                self.stderr.write(f"Offset {offset} is greater than the number of rows in the CSV")
+                return
+
+            # Stream only the requested window of rows
+            rows = enumerate(islice(reader, limit), start=offset + 1)
+
+            with ThreadPoolExecutor(max_workers=max(1, options['workers'])) as executor:
+                for chunk in chunked(rows, options['chunk_size']):
+                    movies = self.build_movies(chunk, existing_titles)
+                    if not options['no_posters']:
+                        self.fetch_posters(executor, movies, options)
+                    self.insert(movies)
+
+        if self.success_count:
+            # bulk_create skips signals
+            bump_catalog_version()
+
+        elapsed = time.perf_counter() - start
+        self.stdout.write(f"Processed rows in {elapsed:.1f}s")
+        # Summary
+        self.stdout.write(self.style.SUCCESS(f"Import completed: {self.success_count} added, {self.skip_count} skipped, {self.error_count} errors"))
+
+    def build_movies(self, chunk, existing_titles):
+        """Unsaved Movie objects for the new rows of a chunk, with their poster URLs"""
+        movies = []
+        for row_number, row in chunk:
+            title = (row.get('title') or '').strip()
+
+            # Skip if no title
+            if not title:
+                self.stdout.write(f"Skipping row {row_number}: No title found")
+                self.skip_count += 1
+                continue
+
+            # Check if movie already exists (or appeared earlier in the file)
+            if title in existing_titles:
+                self.stdout.write(f"Skipping '{title}': Already in database")
+                self.skip_count += 1
+                continue
+
+            try:
+                # Extract movie data
+                year = int(row.get('year', 0)) if (row.get('year') or '').isdigit() else None
+                genre = row.get('genre') or ''
+
+                # Get plot as description
+                description = row.get('plot') or row.get('fullplot') or ''
+                if not description:
+                    description = f"A {genre.lower()} movie released in {year}." if genre and year else "No description available."
+
+                movie = Movie(
+                    title=title,
+                    description=description,
+                    genre=genre,
+                    year=year
+                )
+            except Exception as e:
+                self.stderr.write(f"Error importing '{title}': {str(e)}")
+                self.error_count += 1
+                continue
+
+            existing_titles.add(title)
+            poster_url = row.get('poster') or ''
+            movies.append((movie, poster_url if poster_url.startswith('http') else None))
+        return movies
+
+    def fetch_posters(self, executor, movies, options):
+        """Download the posters of a chunk concurrently and attach them to the movies"""
+        image_field = Movie._meta.get_field('image')
+
+        def download(movie, poster_url):
+            content = fetch_bytes(poster_url, timeout=options['timeout'], retries=options['retries'])
+            name = image_field.generate_filename(None, f"{movie.title.replace(' ', '_')}.jpg")
+            name = image_field.storage.save(name, ContentFile(content))
+            # bulk_create skips Movie.save, which would record these
+            return name, image_state(image_field.storage, name)
+
+        futures = [
+            (movie, executor.submit(download, movie, poster_url))
+            for movie, poster_url in movies if poster_url
+        ]
+        for movie, future in futures:
+            try:
+                movie.image, state = future.result()
+                for field, value in state._asdict().items():
+                    setattr(movie, field, value)
+            except Exception as e:
+                self.stdout.write(f"Could not download image for '{movie.title}': {str(e)}")
+
+    def insert(self, movies):
+        if not movies:
+            return
+        new_movies = [movie for movie, _ in movies]
+        try:
+            created = self.create(new_movies)
+        except Exception as e:
+            # One bad row fails the whole statement; insert the chunk row by
+            # row so only the rows that fail are lost
+            self.stderr.write(f"Error importing a chunk of {len(new_movies)} movies, retrying one by one: {str(e)}")
+            created = []
+            for movie in new_movies:
                 try:
-                    # Extract movie data
-                    year = int(row.get('year', 0)) if row.get('year', '').isdigit() else None
-                    genre = row.get('genre', '')
-                    
-                    # Get plot as description
-                    description = row.get('plot', '') or row.get('fullplot', '')
-                    if not description:
-                        description = f"A {genre.lower()} movie released in {year}." if genre and year else "No description available."
-                    
-                    # Create movie object
-                    movie = Movie(
-                        title=title,
-                        description=description,
-                        genre=genre,
-                        year=year
-                    )
-                    
-                    # Try to get poster image if URL is available
-                    poster_url = row.get('poster', '')
-                    if poster_url and poster_url.startswith('http'):
-                        try:
-                            response = requests.get(poster_url, timeout=5)
-                            if response.status_code == 200:
-                                image_name = f"{title.replace(' ', '_')}.jpg"
-                                movie.image.save(image_name, ContentFile(response.content), save=False)
-                        except Exception as e:
-                            self.stdout.write(f"Could not download image for '{title}': {str(e)}")
-                    
-                    # Save the movie
-                    movie.save()
-                    success_count += 1
-                    
-                    self.stdout.write(f"Added '{title}' ({year}) to database")
-                    
+                    created.extend(self.create([movie]))
                 except Exception as e:
-                    self.stderr.write(f"Error importing '{title}': {str(e)}")
-                    error_count += 1
-        
-        # Summary
-        self.stdout.write(self.style.SUCCESS(f"Import completed: {success_count} added, {skip_count} skipped, {error_count} errors")) 
\ No newline at end of file
+                    self.stderr.write(f"Error importing '{movie.title}': {str(e)}")
+                    self.error_count += 1
+                    self.delete_poster(movie)
+        self.success_count += len(created)
+        for movie in created:
+            self.stdout.write(f"Added '{movie.title}' ({movie.year}) to database")
+
+    def create(self, movies):
+        """bulk_create `movies` and link their genres, all or nothing"""
+        try:
+            with transaction.atomic():
+                created = Movie.objects.bulk_create(movies)
+                # bulk_create skips the signal that links genres
+                sync_genres(created)
+                return created
+        except Exception:
+            # Primary keys set by a rolled-back insert don't exist
+            for movie in movies:
+                movie.pk = None
+                movie._state.adding = True
+            raise
+
+    def delete_poster(self, movie):
+        """Remove the poster downloaded for a movie that could not be inserted"""
+        if not movie.image.name:
+            return
+        try:
+            movie.image.storage.delete(movie.image.name)
+        except OSError as e:
+            self.stderr.write(f"Could not delete image {movie.image.name}: {str(e)}")
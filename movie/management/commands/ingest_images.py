@@ -0,0 +1,187 @@
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from movie.batching import chunked
+from movie.catalog import bump_catalog_version
+from movie.image_files import IMAGE_STATE_FIELDS, IMAGES_FOLDER, ImageState
+from movie.image_hashing import DEFAULT_MAX_DISTANCE, fingerprint, group_duplicates
+from movie.models import Movie
+from movie.thumbnails import source_path
+from movie.title_index import DEFAULT_MIN_SCORE, TitleIndex
+
+# File extension of stored posters, by (lowercase) Pillow format
+STORED_EXTENSIONS = {'jpeg': 'jpg', 'png': 'png', 'webp': 'webp', 'gif': 'gif', 'bmp': 'bmp'}
+
+class Command(BaseCommand):
+    help = ("Ingest poster files from a folder: fingerprint them in parallel, store each distinct "
+            "poster once (duplicates and near-duplicates share a file) and link it to its movie")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--folder', type=str, default='images/',
+                            help="Folder with poster files named after their movies ('m_<title>.png' or '<title>.jpg')")
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help='Number of worker processes hashing files (default: one per CPU core)')
+        parser.add_argument('--max-distance', type=int, default=DEFAULT_MAX_DISTANCE,
+                            help='Largest perceptual hash difference (in bits) treated as the same poster; -1 merges identical files only')
+        parser.add_argument('--min-score', type=float, default=DEFAULT_MIN_SCORE,
+                            help='Minimum title similarity for a file name to match a movie')
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Number of movies updated per bulk_update')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Report duplicates and matches without copying files or writing to the database')
+
+    def handle(self, *args, **options):
+        folder = options['folder']
+        dry_run = options['dry_run']
+
+        if not os.path.isdir(folder):
+            self.stderr.write(f"Images folder '{folder}' not found.")
+            return
+
+        paths = sorted(
+            os.path.join(folder, name) for name in os.listdir(folder)
+            if not name.startswith('.') and os.path.isfile(os.path.join(folder, name))
+        )
+        self.stdout.write(f"Found {len(paths)} files in {folder}")
+
+        fingerprints = self.fingerprint_files(paths, options['workers'])
+        matches = self.match_files(fingerprints, options)
+        # Identical files are merged whatever they are named after; similar
+        # looking ones only among the files of one movie, so a near-match
+        # never gives a movie another movie's poster
+        groups = group_duplicates(
+            fingerprints, options['max_distance'],
+            key=lambda fp: matches[fp.path].value if fp.path in matches else None,
+        )
+
+        # File path -> (stored name relative to MEDIA_ROOT, metadata of the stored file)
+        stored = {}
+        copied = 0
+        for group in groups:
+            # The largest copy is kept; ties go to the first file by name
+            keep = max(group, key=lambda fp: fp.width * fp.height)
+            extension = STORED_EXTENSIONS.get(keep.format, keep.format or 'img')
+            # Named after the content, so identical posters always share a
+            # file and running the command again copies nothing
+            name = f"{IMAGES_FOLDER}/{keep.sha256[:16]}.{extension}"
+            state = ImageState(True, keep.width, keep.height, keep.format)
+            for fp in group:
+                stored[fp.path] = (name, state)
+
+            if len(group) > 1:
+                others = ', '.join(os.path.basename(fp.path) for fp in group if fp is not keep)
+                self.stdout.write(f"Duplicates of {os.path.basename(keep.path)}: {others}")
+            if not dry_run and self.store(keep.path, name):
+                copied += 1
+
+        self.stdout.write(
+            f"{len(fingerprints)} images hold {len(groups)} distinct posters "
+            f"({len(fingerprints) - len(groups)} duplicates); copied {copied} new files to {IMAGES_FOLDER}"
+        )
+
+        updated = self.link_movies(matches, stored, options)
+
+        if dry_run:
+            self.stdout.write(self.style.WARNING(f"Dry run: {updated} movies would be updated, nothing was written."))
+        else:
+            self.stdout.write(self.style.SUCCESS(f"✅ Updated images for {updated} movies"))
+
+    def fingerprint_files(self, paths, workers):
+        """Fingerprints of the readable images among `paths`, in path order"""
+        start = time.perf_counter()
+        results = {}
+        with ProcessPoolExecutor(max_workers=max(1, workers)) as executor:
+            futures = {executor.submit(fingerprint, path): path for path in paths}
+            for future in as_completed(futures):
+                path = futures[future]
+                try:
+                    results[path] = future.result()
+                except Exception as e:
+                    self.stderr.write(self.style.WARNING(f"Skipping {path}: not a readable image ({str(e)})"))
+        elapsed = time.perf_counter() - start
+        self.stdout.write(f"Fingerprinted {len(results)} images with {workers} workers in {elapsed:.1f}s")
+        return [results[path] for path in paths if path in results]
+
+    @staticmethod
+    def store(path, name):
+        """
+        Copy `path` to `name` under MEDIA_ROOT unless it is there already.
+        The copy is renamed into place once complete. Returns True if copied.
+        """
+        target = source_path(name)
+        if os.path.exists(target):
+            return False
+        directory = os.path.dirname(target)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.ingest-')
+        try:
+            with os.fdopen(fd, 'wb') as f, open(path, 'rb') as source:
+                shutil.copyfileobj(source, f)
+            os.replace(tmp_path, target)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return True
+
+    @staticmethod
+    def file_title(path):
+        """Movie title a file is named after: 'm_' prefix and extension removed"""
+        title, _ = os.path.splitext(os.path.basename(path))
+        return title[2:] if title.startswith('m_') else title
+
+    def match_files(self, fingerprints, options):
+        """File path -> TitleMatch of the movie each file is named after, for the files that match one"""
+        title_index = TitleIndex(Movie.objects.order_by('id').values_list('title', 'id'), options['min_score'])
+
+        matches = {}
+        unmatched = 0
+        for fp in fingerprints:
+            match = title_index.match(self.file_title(fp.path))
+            if not match:
+                unmatched += 1
+                if options['verbosity'] > 1:
+                    self.stdout.write(self.style.WARNING(f"No movie matches {os.path.basename(fp.path)}"))
+                continue
+            matches[fp.path] = match
+            if not match.exact:
+                self.stdout.write(f"Partial match: '{os.path.basename(fp.path)}' with '{match.title}' (score {match.score:.2f})")
+
+        if unmatched:
+            self.stdout.write(self.style.WARNING(f"⚠️ {unmatched} files match no movie (use -v 2 to list them)"))
+        return matches
+
+    def link_movies(self, matches, stored, options):
+        """Point each movie matched by a file name at that file's stored poster; returns the number changed"""
+        # Movie id -> (rank, file path); exact title matches beat fuzzy ones,
+        # then higher scores, then the first file by name
+        best = {}
+        for path, match in matches.items():
+            rank = (match.exact, match.score)
+            if match.value not in best or rank > best[match.value][0]:
+                best[match.value] = (rank, path)
+
+        changed = 0
+        verb = 'Would update' if options['dry_run'] else 'Updated'
+        for movie_ids in chunked(sorted(best), options['batch_size']):
+            current = Movie.objects.filter(id__in=movie_ids).values_list('id', 'title', 'image', *IMAGE_STATE_FIELDS)
+            chunk = []
+            for movie_id, title, image, *state in current:
+                name, new_state = stored[best[movie_id][1]]
+                if image == name and tuple(state) == new_state:
+                    continue
+                chunk.append(Movie(id=movie_id, image=name, **new_state._asdict()))
+                self.stdout.write(self.style.SUCCESS(f"{verb} image for: {title} -> {name}"))
+            if chunk and not options['dry_run']:
+                with transaction.atomic():
+                    Movie.objects.bulk_update(chunk, ['image', *IMAGE_STATE_FIELDS])
+            changed += len(chunk)
+
+        if changed and not options['dry_run']:
+            # bulk_update skips signals
+            bump_catalog_version()
+        return changed
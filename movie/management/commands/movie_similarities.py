@@ -1,6 +1,7 @@
 import os
 import numpy as np
 from django.core.management.base import BaseCommand
+from movie.embeddings import EMBEDDING_MODEL
 from movie.models import Movie
 from openai import OpenAI
 from dotenv import load_dotenv
@@ -48,7 +49,7 @@ class Command(BaseCommand):
         
         # ✅ Function to get embeddings from OpenAI API
         def get_embedding(text):
-            response = client.embeddings.create(input=[text], model="text-embedding-3-small")
+            response = client.embeddings.create(input=[text], model=EMBEDDING_MODEL)
             return np.array(response.data[0].embedding, dtype=np.float32)
         
         # ✅ Function to calculate cosine similarity between two vectors
@@ -82,10 +83,15 @@ class Command(BaseCommand):
             self.stdout.write(f"Movie 1: {movie1.title}")
             self.stdout.write(f"Movie 2: {movie2.title}")
             
-            # ✅ Generate embeddings for both movies
-            self.stdout.write("Generating embeddings for the movies...")
-            emb1 = get_embedding(movie1.description)
-            emb2 = get_embedding(movie2.description)
+            # ✅ Use the precomputed embeddings, only calling the API for movies without one
+            def movie_embedding(movie):
+                if movie.embedding is not None and len(movie.embedding):
+                    return movie.embedding
+                self.stdout.write(f"No stored embedding for '{movie.title}', generating one...")
+                return get_embedding(movie.description)
+            
+            emb1 = movie_embedding(movie1)
+            emb2 = movie_embedding(movie2)
             
             # ✅ Calculate the similarity between the movies
             similarity = cosine_similarity(emb1, emb2)
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from movie.models import Movie
+from movie.ratings import reconcile_ratings
+
+class Command(BaseCommand):
+    help = "Rebuild every movie's rating_sum/rating_count/rating_avg from its reviews (run after bulk review imports or to repair drift)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Number of movies updated per bulk_update')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only report how many movies are out of date')
+
+    def handle(self, *args, **options):
+        checked, changed = reconcile_ratings(
+            Movie.objects.all(), batch_size=options['batch_size'], dry_run=options['dry_run'],
+        )
+        rated = Movie.objects.filter(rating_count__gt=0).count()
+        if options['dry_run']:
+            self.stdout.write(self.style.WARNING(f"Dry run: {changed} of {checked} movies have out-of-date ratings, nothing was written."))
+        else:
+            self.stdout.write(self.style.SUCCESS(f"Checked {checked} movies: {changed} updated, {rated} with ratings"))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from movie.image_files import refresh_image_flags
+from movie.models import Movie
+
+class Command(BaseCommand):
+    help = "Recheck which movie image files exist and update Movie.image_ok and the image size/format (run periodically or after changing media files directly)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Number of movies updated per bulk_update')
+
+    def handle(self, *args, **options):
+        checked, changed = refresh_image_flags(Movie.objects.all(), batch_size=options['batch_size'])
+        missing = Movie.objects.filter(image_ok=False).count()
+        self.stdout.write(self.style.SUCCESS(f"Checked {checked} movies: {changed} updated, {missing} without an image file"))
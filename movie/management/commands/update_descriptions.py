@@ -1,10 +1,40 @@
 from django.core.management.base import BaseCommand
+from django.db import transaction
+from movie.batching import Checkpoint, ResponseCache, TokenBucket, is_transient_api_error
+from movie.catalog import bump_catalog_version
+from movie.embeddings import estimate_tokens
+from movie.fake_openai import FakeOpenAI
 from movie.models import Movie
 from openai import OpenAI
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 import os
-import sys
+import time
 from dotenv import load_dotenv
-from pathlib import Path
+
+DESCRIPTION_MODEL = "gpt-3.5-turbo"
+
+# Define the general instruction for description generation
+INSTRUCTION = """
+            Act as an expert film critic. Your task is to create a movie description for a database of movie reviews.
+            The description should be informative yet concise, with a professional and engaging style, including:
+            - A brief synopsis of the plot without revealing major twists
+            - The main genre
+            - Mention of notable actors or director, if relevant
+            - A touch of context about its importance in film history, if applicable
+
+            The description should be 2-4 sentences and objective.
+            """
+
+
+def build_prompt(title, year, genre):
+    # Create context-rich prompt
+    context = f"Title: {title}"
+    if year:
+        context += f", Year: {year}"
+    if genre:
+        context += f", Genre: {genre}"
+    return f"{INSTRUCTION}\n\nCreate a description for this movie:\n{context}"
+
 
 class Command(BaseCommand):
     help = 'Update missing movie descriptions using the OpenAI API'
@@ -15,8 +45,34 @@ class Command(BaseCommand):
             action='store_true',
             help='Update all movie descriptions, not just empty ones',
         )
+        parser.add_argument('--workers', type=int, default=4,
+                            help='Maximum number of concurrent API calls')
+        parser.add_argument('--rpm', type=int, default=500,
+                            help='Maximum API requests per minute (0 disables the limit)')
+        parser.add_argument('--tpm', type=int, default=200000,
+                            help='Maximum estimated tokens (prompt + max completion) per minute (0 disables the limit)')
+        parser.add_argument('--max-tokens', type=int, default=300,
+                            help='Maximum tokens generated per description')
+        parser.add_argument('--write-chunk', type=int, default=50,
+                            help='Number of descriptions saved per bulk_update')
+        parser.add_argument('--retries', type=int, default=3,
+                            help='Attempts per movie before giving up on it')
+        parser.add_argument('--checkpoint', type=str, default='.update_descriptions.checkpoint.json',
+                            help='File that records finished movies so an interrupted run can resume')
+        parser.add_argument('--restart', action='store_true',
+                            help='Ignore any existing checkpoint and start from scratch')
+        parser.add_argument('--cache', type=str, default='.update_descriptions.cache.jsonl',
+                            help="Local prompt/response cache; identical prompts are never paid for twice ('' disables it)")
+        parser.add_argument('--fake', action='store_true',
+                            help='Use a local fake OpenAI client (no network, no cost) for testing')
+        parser.add_argument('--fake-latency', type=float, default=0.5,
+                            help='Simulated seconds per API call when using --fake')
+
+    def get_client(self, options):
+        if options['fake']:
+            self.stdout.write(f"Using fake OpenAI client ({options['fake_latency']}s per call)")
+            return FakeOpenAI(latency=options['fake_latency'])
 
-    def handle(self, *args, **options):
         # Attempt to load OpenAI API key from .env files
         env_loaded_from_file = False
         env_paths = [
@@ -31,10 +87,10 @@ class Command(BaseCommand):
                 load_dotenv(env_path)
                 env_loaded_from_file = True
                 break
-        
+
         # Now, check if the API key is actually available in the environment
         api_key_value = os.environ.get('openai_apikey')
-        
+
         if not api_key_value:
             error_msg = "OpenAI API key ('openai_apikey') not found. "
             if env_loaded_from_file:
@@ -42,80 +98,160 @@ class Command(BaseCommand):
             else:
                 error_msg += "No .env file was found, and it was not set as a platform environment variable."
             self.stdout.write(self.style.ERROR(error_msg))
-            return
-            
-        self.stdout.write(f"Using API key: {api_key_value[:5]}...{api_key_value[-5:]}")
-            
-        try:
-            # Initialize the OpenAI client with the API Key
-            client = OpenAI(api_key=api_key_value)
+            return None
 
-            # Define the general instruction for description generation
-            instruction = """
-            Act as an expert film critic. Your task is to create a movie description for a database of movie reviews.
-            The description should be informative yet concise, with a professional and engaging style, including:
-            - A brief synopsis of the plot without revealing major twists
-            - The main genre
-            - Mention of notable actors or director, if relevant
-            - A touch of context about its importance in film history, if applicable
-            
-            The description should be 2-4 sentences and objective.
-            """
+        self.stdout.write(f"Using API key: {api_key_value[:5]}...{api_key_value[-5:]}")
+        # Initialize the OpenAI client with the API Key
+        return OpenAI(api_key=api_key_value)
 
-            # Helper function to get the API response
-            def get_completion(prompt, model="gpt-3.5-turbo"):
-                # Define the message with the 'user' role and the content we send
-                messages = [{"role": "user", "content": prompt}]
-                
-                # Call the API with the model and messages
+    def get_completion(self, client, prompt, options, rpm_bucket, tpm_bucket):
+        """
+        Generate one description. Runs in a worker thread and waits for the
+        request and token budgets before every attempt.
+        """
+        # Define the message with the 'user' role and the content we send
+        messages = [{"role": "user", "content": prompt}]
+        for attempt in range(1, options['retries'] + 1):
+            rpm_bucket.acquire(1)
+            tpm_bucket.acquire(estimate_tokens(prompt) + options['max_tokens'])
+            try:
                 response = client.chat.completions.create(
-                    model=model,
+                    model=DESCRIPTION_MODEL,
                     messages=messages,
-                    temperature=0.7  # Controls creativity
+                    temperature=0.7,  # Controls creativity
+                    max_tokens=options['max_tokens'],
                 )
-                
                 # Return only the content of the generated response
                 return response.choices[0].message.content.strip()
+            except Exception as e:
+                # Only rate limits, timeouts and server errors are worth paying for again
+                if attempt == options['retries'] or not is_transient_api_error(e):
+                    raise
+                delay = 2 ** attempt
+                self.stdout.write(self.style.WARNING(f"Completion failed ({str(e)}), retrying in {delay}s"))
+                time.sleep(delay)
+
+    def handle(self, *args, **options):
+        checkpoint = Checkpoint(
+            options['checkpoint'],
+            signature={'all': options['all'], 'model': DESCRIPTION_MODEL},
+        )
+        if options['restart']:
+            checkpoint.clear()
+        done_ids = checkpoint.load()
+        if done_ids:
+            self.stdout.write(f"Resuming from checkpoint: {len(done_ids)} movies already done")
+
+        cache = ResponseCache(options['cache']).load()
+        if len(cache):
+            self.stdout.write(f"Loaded {len(cache)} cached responses from {options['cache']}")
 
-            # Get movies with empty descriptions or all movies if --all flag is used
-            if options['all']:
-                movies = Movie.objects.all()
-                self.stdout.write(f"Processing all {movies.count()} movies in the database.")
+        # Get movies with empty descriptions or all movies if --all flag is used
+        if options['all']:
+            movies = Movie.objects.all()
+            self.stdout.write(f"Processing all {movies.count()} movies in the database.")
+        else:
+            movies = Movie.objects.filter(description='')
+            self.stdout.write(f"Found {movies.count()} movies with empty descriptions.")
+
+        # Only what the prompt needs; descriptions and embeddings are never loaded
+        work = []
+        for movie_id, title, year, genre in movies.order_by('id').values_list('id', 'title', 'year', 'genre').iterator():
+            if movie_id not in done_ids:
+                work.append((movie_id, title, build_prompt(title, year, genre)))
+
+        if not work:
+            self.stdout.write(self.style.WARNING("No movies to process."))
+            checkpoint.clear()
+            return
+
+        write_buffer = []
+        count = 0
+
+        def flush():
+            nonlocal count
+            if not write_buffer:
+                return
+            with transaction.atomic():
+                Movie.objects.bulk_update(
+                    [Movie(id=movie_id, description=description) for movie_id, description in write_buffer],
+                    ['description'],
+                )
+            # Only mark movies done once their descriptions are committed
+            checkpoint.mark_done(movie_id for movie_id, _ in write_buffer)
+            count += len(write_buffer)
+            write_buffer.clear()
+
+        def queue_write(movie_id, title, description):
+            write_buffer.append((movie_id, description))
+            self.stdout.write(self.style.SUCCESS(f"Description updated for: {title}"))
+            self.stdout.write(f"New description: {description}")
+            if len(write_buffer) >= options['write_chunk']:
+                flush()
+
+        # Prompts answered by an earlier run are reused without calling the API
+        to_generate = []
+        for movie_id, title, prompt in work:
+            cached = cache.get(ResponseCache.key(DESCRIPTION_MODEL, options['max_tokens'], prompt))
+            if cached is not None:
+                queue_write(movie_id, title, cached)
             else:
-                movies = Movie.objects.filter(description='')
-                self.stdout.write(f"Found {movies.count()} movies with empty descriptions.")
-            
-            if not movies:
-                self.stdout.write(self.style.WARNING("No movies to process."))
+                to_generate.append((movie_id, title, prompt))
+        if len(to_generate) < len(work):
+            self.stdout.write(f"Reused cached descriptions for {len(work) - len(to_generate)} movies")
+
+        failed = 0
+        if to_generate:
+            client = self.get_client(options)
+            if client is None:
+                flush()
                 return
-                
-            count = 0
-            
-            for movie in movies:
-                try:
-                    # Create context-rich prompt
-                    context = f"Title: {movie.title}"
-                    if movie.year:
-                        context += f", Year: {movie.year}"
-                    if movie.genre:
-                        context += f", Genre: {movie.genre}"
-                    
-                    prompt = f"{instruction}\n\nCreate a description for this movie:\n{context}"
-                    self.stdout.write(f"Processing movie: {movie.title}")
-                    
-                    response = get_completion(prompt)
-                    
-                    movie.description = response
-                    movie.save()
-                    
-                    count += 1
-                    self.stdout.write(self.style.SUCCESS(f"Description updated for: {movie.title}"))
-                    self.stdout.write(f"New description: {response}")
-                    
-                except Exception as e:
-                    self.stdout.write(self.style.ERROR(f"Error updating movie {movie.title}: {str(e)}"))
-            
-            self.stdout.write(self.style.SUCCESS(f'Successfully updated {count} movie descriptions.'))
-            
-        except Exception as e:
-            self.stdout.write(self.style.ERROR(f"General error: {str(e)}"))
+
+            rpm_bucket = TokenBucket(options['rpm'])
+            tpm_bucket = TokenBucket(options['tpm'])
+            pending = iter(to_generate)
+            workers = max(1, options['workers'])
+            start = time.perf_counter()
+
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                in_flight = {}
+
+                def submit_next():
+                    item = next(pending, None)
+                    if item is not None:
+                        future = executor.submit(self.get_completion, client, item[2], options, rpm_bucket, tpm_bucket)
+                        in_flight[future] = item
+
+                # Keep a bounded number of requests queued so memory stays flat
+                for _ in range(workers * 2):
+                    submit_next()
+
+                while in_flight:
+                    finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        movie_id, title, prompt = in_flight.pop(future)
+                        try:
+                            description = future.result()
+                        except Exception as e:
+                            failed += 1
+                            self.stdout.write(self.style.ERROR(f"Error updating movie {title}: {str(e)}"))
+                        else:
+                            cache.put(ResponseCache.key(DESCRIPTION_MODEL, options['max_tokens'], prompt), description)
+                            queue_write(movie_id, title, description)
+                        submit_next()
+
+            elapsed = time.perf_counter() - start
+            self.stdout.write(f"Generated {len(to_generate) - failed} descriptions in {elapsed:.1f}s")
+
+        flush()
+        if count:
+            # bulk_update skips signals
+            bump_catalog_version()
+
+        if failed:
+            self.stdout.write(self.style.WARNING(
+                f"{failed} movies failed; run the command again to resume from the checkpoint"
+            ))
+        else:
+            checkpoint.clear()
+        self.stdout.write(self.style.SUCCESS(f'Successfully updated {count} movie descriptions.'))
@@ -1,6 +1,14 @@
 import os
-import requests
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from django.conf import settings
 from django.core.management.base import BaseCommand
+from django.db import transaction
+from movie.batching import TokenBucket, is_transient_api_error
+from movie.catalog import bump_catalog_version
+from movie.downloads import stream_to_file
+from movie.fake_openai import FakeOpenAI, fake_stream_to_file
+from movie.image_files import DEFAULT_IMAGE_NAME, IMAGE_STATE_FIELDS, IMAGES_FOLDER, image_state
 from movie.models import Movie
 from openai import OpenAI
 from dotenv import load_dotenv
@@ -8,7 +16,28 @@ from dotenv import load_dotenv
 class Command(BaseCommand):
     help = "Generate movie poster images using OpenAI API and update the database"
 
-    def handle(self, *args, **kwargs):
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4,
+                            help='Maximum number of posters generated and downloaded concurrently')
+        parser.add_argument('--rpm', type=int, default=50,
+                            help='Maximum image generation requests per minute (0 disables the limit)')
+        parser.add_argument('--retries', type=int, default=3,
+                            help='Attempts per poster before giving up on it')
+        parser.add_argument('--write-chunk', type=int, default=50,
+                            help='Number of movies saved per bulk_update')
+        parser.add_argument('--force', action='store_true',
+                            help='Regenerate posters even for movies that already have an image file')
+        parser.add_argument('--fake', action='store_true',
+                            help='Use a local fake image client and downloader (no network, no cost) for testing')
+        parser.add_argument('--fake-latency', type=float, default=0.5,
+                            help='Simulated seconds per generation when using --fake')
+
+    def get_client(self, options):
+        """Image generation client; anything with OpenAI's images.generate() works"""
+        if options['fake']:
+            self.stdout.write(f"Using fake OpenAI client ({options['fake_latency']}s per call)")
+            return FakeOpenAI(latency=options['fake_latency'])
+
         # Attempt to load OpenAI API key from .env files
         env_loaded_from_file = False
         env_file_paths = ['openAI.env', '../openAI.env', './openAI.env']
@@ -18,10 +47,10 @@ class Command(BaseCommand):
                 env_loaded_from_file = True
                 self.stdout.write(f"Loaded environment variables from: {path}")
                 break
-        
+
         # Now, check if the API key is actually available in the environment
         api_key_value = os.environ.get('openai_apikey')
-        
+
         if not api_key_value:
             error_msg = "OpenAI API key ('openai_apikey') not found. "
             if env_loaded_from_file:
@@ -29,58 +58,150 @@ class Command(BaseCommand):
             else:
                 error_msg += "No .env file was found, and it was not set as a platform environment variable."
             self.stderr.write(self.style.ERROR(error_msg))
-            return
+            return None
 
         # Initialize the OpenAI client with the API key
-        client = OpenAI(api_key=api_key_value)
+        return OpenAI(api_key=api_key_value)
+
+    def get_fetcher(self, options):
+        """Callable (url, path) that downloads a generated image to path"""
+        return fake_stream_to_file if options['fake'] else stream_to_file
 
+    def handle(self, *args, **options):
+        images_root = os.path.join(settings.MEDIA_ROOT, IMAGES_FOLDER)
         # Create the images folder if it doesn't exist
-        images_folder = 'media/movie/images/'
-        os.makedirs(images_folder, exist_ok=True)
+        os.makedirs(images_root, exist_ok=True)
 
-        # Get all movies from the database
-        movies = Movie.objects.all()
+        # Get all movies from the database (only what is needed to name and skip posters)
+        movies = Movie.objects.order_by('id').only('id', 'title', 'image', 'image_ok')
         self.stdout.write(f"Found {movies.count()} movies")
 
-        # Process each movie
-        for movie in movies:
-            self.stdout.write(f"Processing movie: {movie.title}")
-            
-            # Generate and download the image, then update the movie
-            image_relative_path = self.generate_and_download_image(client, movie.title, images_folder)
-            
-            # Update the movie with the new image path
-            movie.image = image_relative_path
-            movie.save()
-            
-            self.stdout.write(self.style.SUCCESS(f"Saved and updated image for: {movie.title}"))
-            
-            # The break statement below was removed to allow processing multiple images.
-            # Consider API rate limits and costs if processing a large number of images.
-            # break 
-            
-        self.stdout.write(self.style.SUCCESS(f"Image generation and database update process completed for all iterated movies."))
-
-    def generate_and_download_image(self, client, movie_title, save_folder):
+        work = []
+        linked = []
+        skipped = 0
+        for movie in movies.iterator():
+            image_filename = self.image_filename(movie.title)
+            relative_path = f"{IMAGES_FOLDER}/{image_filename}"
+            if not options['force']:
+                # Keep posters that exist already instead of paying for new ones
+                if movie.image_ok and movie.image.name != DEFAULT_IMAGE_NAME:
+                    skipped += 1
+                    continue
+                if os.path.exists(os.path.join(images_root, image_filename)):
+                    # Generated by an earlier run that didn't get to save the movie
+                    linked.append(self.linked_movie(movie.id, relative_path))
+                    continue
+            work.append((movie.id, movie.title, relative_path))
+
+        self.stdout.write(f"Skipping {skipped} movies that already have a poster")
+        if linked:
+            self.stdout.write(f"Linking {len(linked)} movies to poster files generated earlier")
+
+        self.written = 0
+        self.save_movies(linked, options['write_chunk'])
+
+        failed = 0
+        if work:
+            client = self.get_client(options)
+            if client is None:
+                return
+            fetch = self.get_fetcher(options)
+            rpm_bucket = TokenBucket(options['rpm'])
+            pending = iter(work)
+            workers = max(1, options['workers'])
+            write_buffer = []
+            start = time.perf_counter()
+
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                in_flight = {}
+
+                def submit_next():
+                    item = next(pending, None)
+                    if item is not None:
+                        movie_id, title, relative_path = item
+                        future = executor.submit(
+                            self.generate_and_download_image, client, fetch, title,
+                            os.path.join(settings.MEDIA_ROOT, relative_path), rpm_bucket, options['retries'],
+                        )
+                        in_flight[future] = item
+
+                # Keep a bounded number of posters queued so memory stays flat
+                for _ in range(workers * 2):
+                    submit_next()
+
+                while in_flight:
+                    finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        movie_id, title, relative_path = in_flight.pop(future)
+                        try:
+                            future.result()
+                        except Exception as e:
+                            failed += 1
+                            self.stderr.write(self.style.ERROR(f"Error generating image for {title}: {str(e)}"))
+                        else:
+                            write_buffer.append(self.linked_movie(movie_id, relative_path))
+                            self.stdout.write(self.style.SUCCESS(f"Saved image for: {title}"))
+                            if len(write_buffer) >= options['write_chunk']:
+                                self.save_movies(write_buffer, options['write_chunk'])
+                                write_buffer = []
+                        submit_next()
+
+                self.save_movies(write_buffer, options['write_chunk'])
+
+            elapsed = time.perf_counter() - start
+            self.stdout.write(f"Generated {len(work) - failed} posters in {elapsed:.1f}s")
+
+        if self.written:
+            # bulk_update skips signals
+            bump_catalog_version()
+
+        if failed:
+            self.stderr.write(self.style.WARNING(f"{failed} posters failed; run the command again to retry them"))
+        self.stdout.write(self.style.SUCCESS(f"Image generation and database update process completed: {self.written} movies updated."))
+
+    def save_movies(self, movies, batch_size):
+        if not movies:
+            return
+        with transaction.atomic():
+            Movie.objects.bulk_update(movies, ['image', *IMAGE_STATE_FIELDS], batch_size=batch_size)
+        self.written += len(movies)
+
+    @staticmethod
+    def linked_movie(movie_id, relative_path):
+        # bulk_update skips Movie.save, so the file's state is recorded here
+        state = image_state(Movie._meta.get_field('image').storage, relative_path)
+        return Movie(id=movie_id, image=relative_path, **state._asdict())
+
+    @staticmethod
+    def image_filename(movie_title):
+        # Path separators in a title would otherwise create directories
+        return f"m_{movie_title.replace('/', '_').replace(os.sep, '_')}.png"
+
+    def generate_and_download_image(self, client, fetch, movie_title, image_path_full, rpm_bucket, retries):
         """
-        Generate an image using OpenAI API and download it to the specified folder
+        Generate an image using OpenAI API and download it to image_path_full.
+        Runs in a worker thread.
         """
         prompt = f"Movie poster of {movie_title}"
-        response = client.images.generate(
-            model="dall-e-2",
-            prompt=prompt,
-            size="256x256",
-            # quality="standard", # Removed: 'quality' parameter is not supported by dall-e-2
-            n=1,
-        )
+        for attempt in range(1, retries + 1):
+            rpm_bucket.acquire(1)
+            try:
+                response = client.images.generate(
+                    model="dall-e-2",
+                    prompt=prompt,
+                    size="256x256",
+                    # quality="standard", # Removed: 'quality' parameter is not supported by dall-e-2
+                    n=1,
+                )
+                break
+            except Exception as e:
+                # Authentication or content policy errors would fail again
+                if attempt == retries or not is_transient_api_error(e):
+                    raise
+                delay = 2 ** attempt
+                self.stdout.write(self.style.WARNING(f"Image generation failed for {movie_title} ({str(e)}), retrying in {delay}s"))
+                time.sleep(delay)
         image_url = response.data[0].url
 
-        image_filename = f"m_{movie_title}.png"
-        image_path_full = os.path.join(save_folder, image_filename)
-
-        image_response = requests.get(image_url)
-        image_response.raise_for_status()
-        with open(image_path_full, 'wb') as f:
-            f.write(image_response.content)
-
-        return os.path.join('movie/images', image_filename)
+        # Streamed to a temporary file and renamed into place
+        return fetch(image_url, image_path_full)
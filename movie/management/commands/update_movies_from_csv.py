@@ -1,77 +1,92 @@
 import os
 import csv
 from django.core.management.base import BaseCommand
+from django.db import transaction
+from movie.batching import chunked
+from movie.catalog import bump_catalog_version
 from movie.models import Movie
-from django.db.models import Q
+from movie.title_index import TitleIndex
 
 class Command(BaseCommand):
     help = "Update movie descriptions in the database from a CSV file"
 
-    def handle(self, *args, **kwargs):
+    def add_arguments(self, parser):
+        parser.add_argument('--csv_file', type=str, default='updated_movie_descriptions.csv',
+                            help="CSV file with 'Title' and 'Updated Description' columns")
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Number of CSV rows matched and written per transaction')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Report which descriptions would change without writing anything')
+
+    def handle(self, *args, **options):
         # 📥 Ruta del archivo CSV con las descripciones actualizadas
-        csv_file = 'updated_movie_descriptions.csv'  # ← Puedes cambiar el nombre si es necesario
+        csv_file = options['csv_file']
+        dry_run = options['dry_run']
 
         # ✅ Verifica si el archivo existe
         if not os.path.exists(csv_file):
             self.stderr.write(f"CSV file '{csv_file}' not found.")
             return
 
-        updated_count = 0
+        # 🔎 Índice de títulos en memoria, construido una sola vez
+        title_index = TitleIndex(Movie.objects.order_by('id').values_list('title', 'id'))
 
-        # 📖 Primero contamos cuántas películas hay en el CSV
-        with open(csv_file, mode='r', encoding='utf-8') as file:
-            reader = csv.DictReader(file)
-            rows = list(reader)
-            total_count = len(rows)
-            self.stdout.write(f"Found {total_count} movies in CSV")
+        row_count = 0
+        updated_count = 0
+        unchanged_count = 0
+        not_found_count = 0
 
-        # 📖 Abrimos el CSV nuevamente para procesar las actualizaciones
-        with open(csv_file, mode='r', encoding='utf-8') as file:
+        # 📖 Una sola pasada sobre el CSV, por bloques
+        with open(csv_file, mode='r', encoding='utf-8', newline='') as file:
             reader = csv.DictReader(file)
-            for row in reader:
-                title = row['Title']
-                new_description = row['Updated Description']
-                
-                self.stdout.write(f"Processing: {title}")
+            for chunk in chunked(reader, options['batch_size']):
+                row_count += len(chunk)
 
-                try:
-                    # Intentar buscar la película con coincidencia exacta (case-insensitive)
-                    movie = Movie.objects.filter(title__iexact=title).first()
-                    
-                    # Si no se encuentra, intentar con coincidencia parcial
-                    if not movie:
-                        self.stdout.write(f"Exact match not found, trying partial match for: {title}")
-                        movie = Movie.objects.filter(title__icontains=title).first()
-                        
-                        # Si sigue sin encontrarse, intentar una búsqueda más agresiva
-                        if not movie:
-                            # Extraer palabras clave del título (ignorando artículos)
-                            keywords = [word for word in title.lower().split() if word not in ['the', 'a', 'an']]
-                            if keywords:
-                                query = Q()
-                                for keyword in keywords:
-                                    if len(keyword) > 3:  # Ignorar palabras muy cortas
-                                        query |= Q(title__icontains=keyword)
-                                
-                                movie = Movie.objects.filter(query).first()
-                    
-                    if not movie:
-                        raise Movie.DoesNotExist()
-                        
-                    # Mostrar qué película se encontró (por si la coincidencia no es exacta)
-                    self.stdout.write(f"Found movie in database: {movie.title}")
+                # Movie id -> (CSV title, new description); a later row for the same movie wins
+                pending = {}
+                for row in chunk:
+                    title = row['Title']
+                    match = title_index.match(title)
+                    if not match:
+                        self.stderr.write(f"Movie not found: {title}")
+                        not_found_count += 1
+                        continue
+                    if not match.exact:
+                        self.stdout.write(f"Exact match not found for: {title}, using '{match.title}' (score {match.score:.2f})")
+                    pending[match.value] = (title, row['Updated Description'])
 
-                    # Actualizar la descripción de la película
+                # One query for the current descriptions of the whole chunk
+                movies = Movie.objects.filter(id__in=list(pending)).only('id', 'title', 'description')
+                changed = []
+                for movie in movies:
+                    _, new_description = pending[movie.id]
+                    if movie.description == new_description:
+                        unchanged_count += 1
+                        continue
+                    if dry_run:
+                        self.stdout.write(
+                            f"Would update: {movie.title}\n"
+                            f"  - {movie.description[:100]!r}\n"
+                            f"  + {new_description[:100]!r}"
+                        )
                     movie.description = new_description
-                    movie.save()
-                    updated_count += 1
+                    changed.append(movie)
 
-                    self.stdout.write(self.style.SUCCESS(f"Updated: {movie.title}"))
+                if changed and not dry_run:
+                    # 💾 Un bulk_update por bloque, dentro de una transacción
+                    with transaction.atomic():
+                        Movie.objects.bulk_update(changed, ['description'])
+                    for movie in changed:
+                        self.stdout.write(self.style.SUCCESS(f"Updated: {movie.title}"))
+                updated_count += len(changed)
 
-                except Movie.DoesNotExist:
-                    self.stderr.write(f"Movie not found: {title}")
-                except Exception as e:
-                    self.stderr.write(f"Failed to update {title}: {str(e)}")
+        if updated_count and not dry_run:
+            # bulk_update skips signals
+            bump_catalog_version()
 
         # ✅ Al finalizar, muestra cuántas películas se actualizaron
-        self.stdout.write(self.style.SUCCESS(f"Finished updating {updated_count} movies from CSV.")) 
\ No newline at end of file
+        self.stdout.write(f"Processed {row_count} CSV rows: {unchanged_count} unchanged, {not_found_count} not found")
+        if dry_run:
+            self.stdout.write(self.style.WARNING(f"Dry run: {updated_count} movies would be updated, nothing was written."))
+        else:
+            self.stdout.write(self.style.SUCCESS(f"Finished updating {updated_count} movies from CSV."))
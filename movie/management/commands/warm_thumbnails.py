@@ -0,0 +1,64 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.management.base import BaseCommand
+from movie.image_files import DEFAULT_IMAGE_NAME
+from movie.models import Movie
+from movie.thumbnails import THUMBNAIL_FORMATS, render_rendition, poster_source_path, rendition_path
+
+class Command(BaseCommand):
+    help = "Generate every poster thumbnail rendition ahead of time, in parallel across CPU cores"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help='Number of worker processes (default: one per CPU core)')
+        parser.add_argument('--force', action='store_true',
+                            help='Regenerate renditions even if they are up to date')
+
+    def handle(self, *args, **options):
+        names = set(Movie.objects.filter(image_ok=True).values_list('image', flat=True).distinct())
+        names.add(DEFAULT_IMAGE_NAME)
+
+        # One task per source image and width/format pair; each writes a single file
+        tasks = []
+        for name in sorted(names):
+            try:
+                source = poster_source_path(name)
+            except SuspiciousFileOperation:
+                self.stderr.write(self.style.WARNING(f"Skipping image outside the poster folder: {name}"))
+                continue
+            if not os.path.exists(source):
+                self.stderr.write(self.style.WARNING(f"Skipping missing image: {name}"))
+                continue
+            for width in settings.MOVIE_THUMBNAIL_WIDTHS:
+                for fmt in THUMBNAIL_FORMATS:
+                    tasks.append((name, source, rendition_path(name, width, fmt), width, fmt))
+
+        self.stdout.write(f"Warming {len(tasks)} renditions of {len(names)} images with {options['workers']} workers")
+        start = time.perf_counter()
+        written = 0
+        failed = 0
+
+        with ProcessPoolExecutor(max_workers=max(1, options['workers'])) as executor:
+            futures = {
+                executor.submit(
+                    render_rendition, source, target, width, fmt,
+                    quality=settings.MOVIE_THUMBNAIL_QUALITY, force=options['force'],
+                ): (name, width, fmt)
+                for name, source, target, width, fmt in tasks
+            }
+            for future in as_completed(futures):
+                name, width, fmt = futures[future]
+                try:
+                    if future.result():
+                        written += 1
+                except Exception as e:
+                    failed += 1
+                    self.stderr.write(self.style.ERROR(f"Error rendering {name} at {width}px as {fmt}: {str(e)}"))
+
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(
+            f"Generated {written} renditions ({len(tasks) - written - failed} already up to date, {failed} failed) in {elapsed:.1f}s"
+        ))
@@ -0,0 +1,60 @@
+# Converts Movie.embedding from a JSON list of floats to packed float32 bytes
+
+from django.db import migrations, models
+
+import movie.fields
+
+BATCH_SIZE = 500
+
+
+def json_to_binary(apps, schema_editor):
+    Movie = apps.get_model('movie', 'Movie')
+    batch = []
+    for movie in Movie.objects.exclude(embedding__isnull=True).only('id', 'embedding').iterator(chunk_size=BATCH_SIZE):
+        if not movie.embedding:
+            continue
+        movie.embedding_vector = movie.embedding
+        batch.append(movie)
+        if len(batch) >= BATCH_SIZE:
+            Movie.objects.bulk_update(batch, ['embedding_vector'])
+            batch = []
+    if batch:
+        Movie.objects.bulk_update(batch, ['embedding_vector'])
+
+
+def binary_to_json(apps, schema_editor):
+    Movie = apps.get_model('movie', 'Movie')
+    batch = []
+    for movie in Movie.objects.exclude(embedding_vector__isnull=True).only('id', 'embedding_vector').iterator(chunk_size=BATCH_SIZE):
+        movie.embedding = movie.embedding_vector.tolist()
+        batch.append(movie)
+        if len(batch) >= BATCH_SIZE:
+            Movie.objects.bulk_update(batch, ['embedding'])
+            batch = []
+    if batch:
+        Movie.objects.bulk_update(batch, ['embedding'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movie', '0003_movie_embedding_movie_embedding_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='movie',
+            name='embedding_vector',
+            field=movie.fields.VectorField(blank=True, null=True),
+        ),
+        migrations.RunPython(json_to_binary, binary_to_json),
+        migrations.RemoveField(
+            model_name='movie',
+            name='embedding',
+        ),
+        migrations.RenameField(
+            model_name='movie',
+            old_name='embedding_vector',
+            new_name='embedding',
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2 on 2026-10-18 07:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movie', '0004_movie_embedding_binary'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='movie',
+            name='embedding_hash',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+    ]
@@ -0,0 +1,51 @@
+# Parses the existing comma-separated Movie.genre strings into Genre rows and
+# Movie.genres links
+
+from django.db import migrations
+
+BATCH_SIZE = 1000
+
+
+def populate_genres(apps, schema_editor):
+    Movie = apps.get_model('movie', 'Movie')
+    Genre = apps.get_model('movie', 'Genre')
+    Through = Movie.genres.through
+
+    genres = {}
+    links = []
+    rows = Movie.objects.exclude(genre__isnull=True).exclude(genre='').values_list('id', 'genre')
+    for movie_id, genre_string in rows.iterator(chunk_size=BATCH_SIZE):
+        seen = set()
+        for name in genre_string.split(','):
+            name = name.strip()
+            if not name or name.lower() in seen:
+                continue
+            seen.add(name.lower())
+            genres.setdefault(name.lower(), name)
+            links.append((movie_id, name.lower()))
+
+    Genre.objects.bulk_create([Genre(name=name) for name in genres.values()], ignore_conflicts=True)
+    ids = {genre.name.lower(): genre.id for genre in Genre.objects.all()}
+    Through.objects.bulk_create(
+        [Through(movie_id=movie_id, genre_id=ids[key]) for movie_id, key in links],
+        batch_size=BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+
+
+def clear_genres(apps, schema_editor):
+    Movie = apps.get_model('movie', 'Movie')
+    Genre = apps.get_model('movie', 'Genre')
+    Movie.genres.through.objects.all().delete()
+    Genre.objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movie', '0007_genre'),
+    ]
+
+    operations = [
+        migrations.RunPython(populate_genres, clear_genres),
+    ]
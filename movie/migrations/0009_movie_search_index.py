@@ -0,0 +1,83 @@
+# Full-text search index over Movie.title and Movie.description: an FTS5
+# table with sync triggers on SQLite, a generated tsvector column with a GIN
+# index on PostgreSQL. Other databases use substring search (see movie.search).
+#
+# The SQL is a copy of movie.search as it was when this migration was
+# written (that module imports the Movie model, which migrations must not
+# use). movie.signals reinstalls the index after every migrate with the
+# current movie.search code.
+
+from django.db import OperationalError, migrations
+
+TABLE = 'movie_movie'
+FTS_TABLE = 'movie_movie_fts'
+SEARCH_VECTOR_COLUMN = 'search_vector'
+SEARCH_INDEX_NAME = 'movie_movie_search_idx'
+SEARCH_CONFIG = 'english'
+
+SQLITE_INSTALL_SQL = [
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        title, description,
+        content='{TABLE}', content_rowid='id',
+        tokenize='porter unicode61 remove_diacritics 2', prefix='2 3'
+    )""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON {TABLE} BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, title, description) VALUES (new.id, new.title, new.description);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON {TABLE} BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, description) VALUES ('delete', old.id, old.title, old.description);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF title, description ON {TABLE} BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, description) VALUES ('delete', old.id, old.title, old.description);
+        INSERT INTO {FTS_TABLE}(rowid, title, description) VALUES (new.id, new.title, new.description);
+    END""",
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')",
+]
+
+
+def create_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor == 'sqlite':
+        try:
+            with connection.cursor() as cursor:
+                for statement in SQLITE_INSTALL_SQL:
+                    cursor.execute(statement)
+        except OperationalError:
+            # SQLite compiled without FTS5; searches fall back to icontains
+            pass
+    elif connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""ALTER TABLE {TABLE} ADD COLUMN IF NOT EXISTS {SEARCH_VECTOR_COLUMN} tsvector
+                GENERATED ALWAYS AS (
+                    setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(title, '')), 'A') ||
+                    setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(description, '')), 'B')
+                ) STORED"""
+            )
+            cursor.execute(
+                f"CREATE INDEX IF NOT EXISTS {SEARCH_INDEX_NAME} ON {TABLE} USING GIN ({SEARCH_VECTOR_COLUMN})"
+            )
+
+
+def drop_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            for suffix in ('ai', 'ad', 'au'):
+                cursor.execute(f"DROP TRIGGER IF EXISTS {FTS_TABLE}_{suffix}")
+            cursor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+    elif connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute(f"DROP INDEX IF EXISTS {SEARCH_INDEX_NAME}")
+            cursor.execute(f"ALTER TABLE {TABLE} DROP COLUMN IF EXISTS {SEARCH_VECTOR_COLUMN}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movie', '0008_populate_genres'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
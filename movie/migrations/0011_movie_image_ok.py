@@ -0,0 +1,43 @@
+# Adds Movie.image_ok and sets it from the files present at migration time
+
+from django.core.files.storage import default_storage
+from django.db import migrations, models
+
+BATCH_SIZE = 500
+
+
+def check_images(apps, schema_editor):
+    Movie = apps.get_model('movie', 'Movie')
+    exists = {}
+    batch = []
+    for movie in Movie.objects.only('id', 'image').iterator(chunk_size=BATCH_SIZE):
+        name = movie.image.name
+        if name not in exists:
+            try:
+                exists[name] = bool(name) and default_storage.exists(name)
+            except Exception:
+                exists[name] = False
+        if exists[name]:
+            movie.image_ok = True
+            batch.append(movie)
+            if len(batch) >= BATCH_SIZE:
+                Movie.objects.bulk_update(batch, ['image_ok'])
+                batch = []
+    if batch:
+        Movie.objects.bulk_update(batch, ['image_ok'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movie', '0010_movie_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='movie',
+            name='image_ok',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.RunPython(check_images, migrations.RunPython.noop),
+    ]
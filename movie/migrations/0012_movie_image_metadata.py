@@ -0,0 +1,70 @@
+# Adds Movie.image_width, image_height and image_format and reads them from
+# the image headers present at migration time. The header reading is a copy
+# of movie.image_files.image_state() as it was when this migration was
+# written, so later changes to the app can't change what the migration does.
+
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.storage import default_storage
+from django.db import migrations, models
+from PIL import ExifTags, Image
+
+BATCH_SIZE = 500
+# EXIF orientations that swap width and height
+ROTATED_ORIENTATIONS = {5, 6, 7, 8}
+
+
+def read_header(name):
+    """(width, height, format) of an image file as displayed, or None if it can't be read"""
+    try:
+        with default_storage.open(name, 'rb') as f, Image.open(f) as image:
+            width, height = image.size
+            if image.getexif().get(ExifTags.Base.Orientation, 1) in ROTATED_ORIENTATIONS:
+                width, height = height, width
+            return width, height, (image.format or '').lower()
+    except (OSError, ValueError, SuspiciousFileOperation, Image.DecompressionBombError):
+        return None
+
+
+def read_metadata(apps, schema_editor):
+    Movie = apps.get_model('movie', 'Movie')
+    headers = {}
+    batch = []
+    for movie in Movie.objects.filter(image_ok=True).only('id', 'image').iterator(chunk_size=BATCH_SIZE):
+        name = movie.image.name
+        if name not in headers:
+            headers[name] = read_header(name) if name else None
+        header = headers[name]
+        if header is not None:
+            movie.image_width, movie.image_height, movie.image_format = header
+            batch.append(movie)
+            if len(batch) >= BATCH_SIZE:
+                Movie.objects.bulk_update(batch, ['image_width', 'image_height', 'image_format'])
+                batch = []
+    if batch:
+        Movie.objects.bulk_update(batch, ['image_width', 'image_height', 'image_format'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movie', '0011_movie_image_ok'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='movie',
+            name='image_format',
+            field=models.CharField(blank=True, default='', editable=False, max_length=10),
+        ),
+        migrations.AddField(
+            model_name='movie',
+            name='image_height',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='movie',
+            name='image_width',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.RunPython(read_metadata, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2 on 2026-10-18 08:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movie', '0013_review_movie_ratings'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='movie',
+            name='rating_avg',
+            field=models.FloatField(default=0, editable=False),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Merges genres whose names differ only in case ('Drama' and 'drama') into
+# the oldest one, so 0017 can make genre names unique case-insensitively.
+# A separate migration so the deletes commit before the constraint is added.
+
+from django.db import migrations
+
+
+def merge_duplicates(apps, schema_editor):
+    Movie = apps.get_model('movie', 'Movie')
+    Genre = apps.get_model('movie', 'Genre')
+    Through = Movie.genres.through
+
+    keep = {}
+    duplicates = {}
+    for genre_id, name in Genre.objects.order_by('id').values_list('id', 'name'):
+        key = name.lower()
+        if key in keep:
+            duplicates[genre_id] = keep[key]
+        else:
+            keep[key] = genre_id
+    if not duplicates:
+        return
+
+    links = Through.objects.filter(genre_id__in=list(duplicates)).values_list('movie_id', 'genre_id')
+    Through.objects.bulk_create(
+        [Through(movie_id=movie_id, genre_id=duplicates[genre_id]) for movie_id, genre_id in links],
+        ignore_conflicts=True,
+    )
+    Through.objects.filter(genre_id__in=list(duplicates)).delete()
+    Genre.objects.filter(id__in=list(duplicates)).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movie', '0015_catalog_version'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicates, migrations.RunPython.noop),
+    ]
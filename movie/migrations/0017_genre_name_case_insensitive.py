@@ -0,0 +1,23 @@
+# Generated by Django 5.2 on 2026-10-18 08:21
+
+import django.db.models.functions.text
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movie', '0016_merge_case_duplicate_genres'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='genre',
+            name='name',
+            field=models.CharField(max_length=100),
+        ),
+        migrations.AddConstraint(
+            model_name='genre',
+            constraint=models.UniqueConstraint(django.db.models.functions.text.Lower('name'), name='unique_genre_name_ci'),
+        ),
+    ]
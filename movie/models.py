@@ -1,14 +1,247 @@
-from django.db import models
+from django.conf import settings
+from django.core.validators import MaxValueValidator, MinValueValidator
+from django.db import models, transaction
+from django.db.models import BooleanField, ExpressionWrapper, Q
+from django.db.models.functions import Lower, Substr
+
+from .fields import VectorField
+from .image_files import IMAGE_STATE_FIELDS, image_state
+from .ratings import apply_rating_change
+
+def parse_genres(genre_string):
+    """Split a comma-separated genre string into unique, stripped names"""
+    names = []
+    seen = set()
+    for name in (genre_string or '').split(','):
+        name = name.strip()
+        if name and name.lower() not in seen:
+            seen.add(name.lower())
+            names.append(name)
+    return names
+
+
+class Genre(models.Model):
+    name = models.CharField(max_length=100)
+
+    class Meta:
+        ordering = ['name']
+        constraints = [
+            # Names are matched case-insensitively ('Drama' and 'drama' are one
+            # genre); the index on LOWER(name) also serves sync_genres' lookups
+            models.UniqueConstraint(Lower('name'), name='unique_genre_name_ci'),
+        ]
+
+    def __str__(self):
+        return self.name
+
+
+def sync_genres(movies):
+    """
+    Point each movie's `genres` relation at the genres named in its `genre`
+    string, creating missing Genre rows. Works on any number of movies with
+    a fixed number of queries, so bulk writers (which skip the post_save
+    signal) should call it after bulk_create / bulk_update.
+    """
+    movies = [movie for movie in movies if movie.pk]
+    if not movies:
+        return
+    wanted = {movie.pk: parse_genres(movie.genre) for movie in movies}
+
+    # Only the genres named by these movies are loaded, by the LOWER(name) index
+    all_names = {name.lower(): name for names in wanted.values() for name in names}
+
+    def load_genres():
+        if not all_names:
+            return {}
+        genres = Genre.objects.annotate(lower_name=Lower('name')).filter(lower_name__in=list(all_names))
+        return {genre.lower_name: genre for genre in genres}
+
+    by_name = load_genres()
+    missing = [name for key, name in all_names.items() if key not in by_name]
+    if missing:
+        Genre.objects.bulk_create([Genre(name=name) for name in missing], ignore_conflicts=True)
+        by_name = load_genres()
+
+    # Only write the difference, so re-saving an unchanged movie costs one read
+    Through = Movie.genres.through
+    wanted_pairs = {
+        (movie_id, by_name[name.lower()].pk)
+        for movie_id, names in wanted.items()
+        for name in names
+    }
+    existing_pairs = set(Through.objects.filter(movie_id__in=list(wanted)).values_list('movie_id', 'genre_id'))
+    stale = existing_pairs - wanted_pairs
+    if stale:
+        stale_query = models.Q()
+        for movie_id, genre_id in stale:
+            stale_query |= models.Q(movie_id=movie_id, genre_id=genre_id)
+        Through.objects.filter(stale_query).delete()
+    added = wanted_pairs - existing_pairs
+    if added:
+        Through.objects.bulk_create(
+            [Through(movie_id=movie_id, genre_id=genre_id) for movie_id, genre_id in added],
+            ignore_conflicts=True,
+        )
+
+
+class MovieQuerySet(models.QuerySet):
+    """
+    Column projections for listings. Each loads only what its page renders,
+    and none of them loads `embedding` or the full `description`.
+    """
+    # Columns rendered by the home page movie cards
+    LISTING_FIELDS = (
+        'id', 'title', 'year', 'genre', 'image', 'image_ok', 'image_width', 'image_height', 'url',
+        'rating_avg', 'rating_count',
+    )
+    # Characters of the description shown on a card (one more than the
+    # template's truncatechars, so it can tell when to add an ellipsis)
+    EXCERPT_LENGTH = 81
+    # Columns rendered by the admin changelist
+    ADMIN_LIST_FIELDS = ('id', 'title', 'genre', 'year', 'rating_avg', 'rating_count', 'embedding_updated_at')
+
+    def with_embedding_flag(self):
+        """Annotate `embedding_stored` without reading the vectors themselves"""
+        return self.annotate(
+            embedding_stored=ExpressionWrapper(Q(embedding__isnull=False), output_field=BooleanField())
+        )
+
+    def for_listing(self):
+        """Home page cards: a short `description_excerpt` instead of the full text"""
+        return self.only(*self.LISTING_FIELDS).annotate(
+            description_excerpt=Substr('description', 1, self.EXCERPT_LENGTH)
+        )
+
+    def for_admin_list(self):
+        return self.only(*self.ADMIN_LIST_FIELDS).with_embedding_flag()
+
 
 class Movie(models.Model):
     title = models.CharField(max_length=100)
     description = models.TextField()
     image = models.ImageField(upload_to='movie/images/')
+    # Whether the image file exists, and its size and format; set on save so
+    # rendering never has to open the file (see movie.image_files)
+    image_ok = models.BooleanField(default=False, editable=False)
+    image_width = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    image_height = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    image_format = models.CharField(max_length=10, blank=True, default='', editable=False)
     url = models.URLField(blank=True)
+    # Comma-separated genres as imported; `genres` is the normalized, indexed form
     genre = models.CharField(max_length=100, null=True, blank=True)
+    genres = models.ManyToManyField(Genre, related_name='movies', blank=True, editable=False)
     year = models.IntegerField(null=True, blank=True)
-    embedding = models.JSONField(null=True, blank=True)
+    # float32 vector stored as raw bytes; read back as a NumPy array
+    embedding = VectorField(null=True, blank=True)
     embedding_updated_at = models.DateTimeField(null=True, blank=True)
+    # sha256 of the embedding model and the text that produced `embedding`
+    embedding_hash = models.CharField(max_length=64, blank=True, default='')
+    # Totals of the movie's reviews, kept current on every review write (see movie.ratings)
+    rating_sum = models.PositiveIntegerField(default=0, editable=False)
+    rating_count = models.PositiveIntegerField(default=0, editable=False)
+    # 0 while the movie has no reviews (rating_count == 0). Never NULL, so unrated movies sort
+    # below every rated one (ratings are 1-5) on every database, whatever its NULL ordering
+    rating_avg = models.FloatField(default=0, editable=False)
+
+    objects = MovieQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Keyset pagination of the listing sorts (see movie.pagination)
+            models.Index(fields=['title', 'id'], name='movie_title_id_idx'),
+            models.Index(fields=['year', 'id'], name='movie_year_id_idx'),
+            models.Index(fields=['rating_avg', 'id'], name='movie_rating_id_idx'),
+        ]
+
+    def __str__(self):
+        return self.title
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or 'image' in update_fields:
+            if self.image and not self.image._committed:
+                # A new upload is normally written to storage inside
+                # super().save(); write it now so it can be inspected
+                self.image.save(self.image.name, self.image.file, save=False)
+            state = image_state(self.image.storage, self.image.name)
+            for field, value in state._asdict().items():
+                setattr(self, field, value)
+            if update_fields is not None:
+                kwargs['update_fields'] = {*update_fields, *IMAGE_STATE_FIELDS}
+        super().save(*args, **kwargs)
+
+class SimilarMovie(models.Model):
+    """
+    Precomputed "similar movies" for each movie, ranked by embedding cosine
+    similarity. Rebuilt by `manage.py compute_similar_movies`.
+    """
+    movie = models.ForeignKey(Movie, on_delete=models.CASCADE, related_name='similar_entries')
+    similar = models.ForeignKey(Movie, on_delete=models.CASCADE, related_name='+')
+    score = models.FloatField()
+    rank = models.PositiveSmallIntegerField()
+
+    class Meta:
+        ordering = ['movie', 'rank']
+        constraints = [
+            # Also the index movie_detail reads through
+            models.UniqueConstraint(fields=['movie', 'rank'], name='unique_similar_movie_rank'),
+        ]
+
+    def __str__(self):
+        return f'{self.movie} -> {self.similar} ({self.score:.3f})'
+
+
+class Review(models.Model):
+    """
+    A user's rating (1-5 stars) and optional review of a movie. Saving or
+    deleting one updates the movie's rating aggregates.
+    """
+    movie = models.ForeignKey(Movie, on_delete=models.CASCADE, related_name='reviews')
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='movie_reviews')
+    rating = models.PositiveSmallIntegerField(validators=[MinValueValidator(1), MaxValueValidator(5)])
+    text = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        constraints = [
+            # One review per user and movie; also the index for a movie's reviews
+            models.UniqueConstraint(fields=['movie', 'user'], name='unique_review_movie_user'),
+            models.CheckConstraint(condition=Q(rating__gte=1, rating__lte=5), name='review_rating_range'),
+        ]
+
+    def __str__(self):
+        return f'{self.user} on {self.movie}: {self.rating}'
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            previous = None
+            if self.pk is not None:
+                # Locked so a concurrent edit can't apply the same old rating twice
+                previous = (
+                    Review.objects.select_for_update()
+                    .filter(pk=self.pk)
+                    .values_list('movie_id', 'rating')
+                    .first()
+                )
+            super().save(*args, **kwargs)
+            if previous is None:
+                apply_rating_change(self.movie_id, self.rating, 1)
+            elif previous != (self.movie_id, self.rating):
+                old_movie_id, old_rating = previous
+                apply_rating_change(old_movie_id, -old_rating, -1)
+                apply_rating_change(self.movie_id, self.rating, 1)
+
+
+class CatalogVersion(models.Model):
+    """
+    Current version stamp of one catalog namespace (see movie.catalog).
+    Kept in the database so every process, including management commands,
+    reads and bumps the same stamp whatever cache backend is configured.
+    """
+    namespace = models.CharField(max_length=20, primary_key=True)
+    version = models.BigIntegerField()
 
     def __str__(self):
-        return self.title
\ No newline at end of file
+        return f'{self.namespace}: {self.version}'
@@ -0,0 +1,115 @@
+"""
+Rendered-page cache for the read-mostly public views.
+
+    @cache_page_for('movie', params=('searchMovie', 'genre', 'sort', 'page'))
+    def home(request): ...
+
+stores the response of anonymous GET requests for settings.PAGE_CACHE_TIMEOUT
+seconds. The key is built from:
+
+* the path;
+* the whitelisted query parameters, sorted, so `?sort=x&page=2` and
+  `?page=2&sort=x` share an entry;
+* the catalog version of each namespace the page shows (see movie.catalog).
+  A Movie or News write bumps its namespace's version, so it invalidates
+  every page showing that data without deleting anything. Stale entries
+  simply expire.
+
+A request is rendered normally, and not stored, when:
+* the user is logged in (the navigation bar differs per user);
+* it has query parameters outside the whitelist;
+* messages are waiting to be shown;
+* the response sets cookies or uses a CSRF token.
+
+Cached responses carry an `X-Page-Cache: hit` header (`miss` when stored).
+
+Views whose pages are rendered anyway (for logged-in users) cache their
+expensive parts as fragments instead: {% cache %} blocks keyed by the same
+catalog versions, and cached_fragment() for data computed in the view.
+"""
+import hashlib
+from functools import wraps
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.contrib.messages import get_messages
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils.cache import patch_vary_headers
+
+from .catalog import get_catalog_version, get_catalog_versions
+
+PAGE_CACHE_PREFIX = 'page'
+FRAGMENT_CACHE_PREFIX = 'fragment'
+
+
+def page_cache_timeout():
+    return settings.PAGE_CACHE_TIMEOUT
+
+
+def is_cacheable_request(request, params):
+    """Whether the response to `request` is the same for every anonymous visitor"""
+    if request.method not in ('GET', 'HEAD') or page_cache_timeout() <= 0:
+        return False
+    if any(name not in params for name in request.GET):
+        return False
+    if request.user.is_authenticated:
+        return False
+    # len() reads pending messages without marking them as shown
+    return not len(get_messages(request))
+
+
+def page_cache_key(request, namespaces, params):
+    query = urlencode(sorted(
+        (name, value) for name in params for value in request.GET.getlist(name)
+    ))
+    versions = get_catalog_versions(namespaces)
+    digest = hashlib.md5(f'{request.path}?{query}'.encode()).hexdigest()
+    return f"{PAGE_CACHE_PREFIX}:{'.'.join(versions)}:{digest}"
+
+
+def cache_page_for(*namespaces, params=()):
+    """
+    Cache the view's anonymous GET responses until any of `namespaces`
+    changes (or PAGE_CACHE_TIMEOUT passes). `params` are the query
+    parameters the view reads; requests with any other parameter bypass
+    the cache.
+    """
+    params = frozenset(params)
+
+    def decorator(view):
+        @wraps(view)
+        def wrapped(request, *args, **kwargs):
+            if not is_cacheable_request(request, params):
+                return view(request, *args, **kwargs)
+
+            key = page_cache_key(request, namespaces, params)
+            cached = cache.get(key)
+            if cached is not None:
+                content, content_type = cached
+                response = HttpResponse(content, content_type=content_type)
+                response['X-Page-Cache'] = 'hit'
+                patch_vary_headers(response, ('Cookie',))
+                return response
+
+            response = view(request, *args, **kwargs)
+            if (
+                response.status_code == 200
+                and not response.streaming
+                and not response.cookies
+                and not request.META.get('CSRF_COOKIE_NEEDS_UPDATE')
+            ):
+                cache.set(key, (response.content, response['Content-Type']), page_cache_timeout())
+                response['X-Page-Cache'] = 'miss'
+            return response
+        return wrapped
+    return decorator
+
+
+def cached_fragment(name, compute, namespace='movie', timeout=None):
+    """
+    compute() cached under `name` until `namespace` changes; for data a view
+    needs on every request, such as the genre list.
+    """
+    key = f"{FRAGMENT_CACHE_PREFIX}:{name}:{get_catalog_version(namespace)}"
+    return cache.get_or_set(key, compute, page_cache_timeout() if timeout is None else timeout)
@@ -0,0 +1,157 @@
+"""
+Keyset ("cursor") pagination for movie listings.
+
+Paginator runs a COUNT(*) and then an OFFSET query, so deep pages get
+slower the further in they are. Keyset pagination instead remembers the
+sort key of the last row shown, (sort column, id), and asks for the rows
+that come after it. With a composite index on (sort column, id) every page
+costs the same, however deep it is. There is no total count and no
+jumping to page N, only previous/next.
+
+The cursor is an opaque URL-safe token. Clients pass it back unchanged.
+"""
+import base64
+import json
+
+from django.db import connections
+from django.db.models import Q
+
+# sort option -> (sort field, descending); `id` breaks ties in the same direction
+SORTS = {
+    'default': ('id', False),
+    'title_asc': ('title', False),
+    'year_desc': ('year', True),
+    'year_asc': ('year', False),
+    'rating_desc': ('rating_avg', True),
+}
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(values, backwards=False):
+    payload = json.dumps({'k': values, 'b': backwards}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Return (values, backwards) from a token made by encode_cursor()"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        values, backwards = payload['k'], bool(payload['b'])
+    except (ValueError, TypeError, KeyError):
+        raise InvalidCursor(f"Invalid cursor: {cursor!r}")
+    if not isinstance(values, list):
+        raise InvalidCursor(f"Invalid cursor: {cursor!r}")
+    return values, backwards
+
+
+class KeysetPage:
+    def __init__(self, object_list, has_next, has_previous, next_cursor, previous_cursor):
+        self.object_list = object_list
+        self.has_next = has_next
+        self.has_previous = has_previous
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+
+class KeysetPaginator:
+    """
+    Paginate `queryset` by one of the SORTS options:
+
+        page = KeysetPaginator(movies, 12, 'year_desc').page(request.GET.get('cursor'))
+
+    Any ordering already on the queryset is replaced.
+    """
+
+    def __init__(self, queryset, per_page, sort='default'):
+        if sort not in SORTS:
+            sort = 'default'
+        self.queryset = queryset
+        self.per_page = per_page
+        self.field, self.descending = SORTS[sort]
+        self.nullable = self.field != 'id' and queryset.model._meta.get_field(self.field).null
+
+    def _keys(self, obj):
+        if self.field == 'id':
+            return [obj.id]
+        return [getattr(obj, self.field), obj.id]
+
+    def _ordered(self, backwards):
+        descending = self.descending != backwards
+        prefix = '-' if descending else ''
+        if self.field == 'id':
+            return self.queryset.order_by(f'{prefix}id')
+        # Nulls go wherever the database puts them by default, so the
+        # (field, id) index can serve the ordering in either direction
+        return self.queryset.order_by(f'{prefix}{self.field}', f'{prefix}id')
+
+    def _after(self, values, backwards):
+        """Condition for rows strictly after `values` in the scan order"""
+        descending = self.descending != backwards
+        op = 'lt' if descending else 'gt'
+        if self.field == 'id':
+            return Q(**{f'id__{op}': values[0]})
+
+        value, pk = values
+        if not self.nullable:
+            return Q(**{f'{self.field}__{op}': value}) | Q(**{self.field: value, f'id__{op}': pk})
+
+        # Where NULLs fall in this scan: after every value if the database
+        # sorts them as largest and we scan ascending (or the reverse)
+        nulls_order_largest = connections[self.queryset.db].features.nulls_order_largest
+        nulls_after = nulls_order_largest != descending
+        is_null = Q(**{f'{self.field}__isnull': True})
+        if value is None:
+            condition = is_null & Q(**{f'id__{op}': pk})
+            if not nulls_after:
+                condition |= Q(**{f'{self.field}__isnull': False})
+            return condition
+        condition = Q(**{f'{self.field}__{op}': value}) | Q(**{self.field: value, f'id__{op}': pk})
+        if nulls_after:
+            condition |= is_null
+        return condition
+
+    def page(self, cursor=None):
+        """Return the KeysetPage after (or before) `cursor`; None for the first page"""
+        backwards = False
+        if cursor:
+            values, backwards = decode_cursor(cursor)
+            if len(values) != (1 if self.field == 'id' else 2):
+                raise InvalidCursor(f"Cursor does not match the sort order: {cursor!r}")
+            try:
+                queryset = self._ordered(backwards).filter(self._after(values, backwards))
+            except (ValueError, TypeError):
+                # Values of the wrong type for the sort column
+                raise InvalidCursor(f"Cursor does not match the sort order: {cursor!r}")
+        else:
+            queryset = self._ordered(False)
+
+        # One extra row tells whether there is another page in this direction
+        rows = list(queryset[:self.per_page + 1])
+        more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if backwards:
+            rows.reverse()
+            has_previous, has_next = more, True
+        else:
+            has_previous, has_next = bool(cursor), more
+
+        return KeysetPage(
+            rows,
+            has_next=has_next and bool(rows),
+            has_previous=has_previous and bool(rows),
+            next_cursor=encode_cursor(self._keys(rows[-1])) if rows else None,
+            previous_cursor=encode_cursor(self._keys(rows[0]), backwards=True) if rows else None,
+        )
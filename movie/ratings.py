@@ -0,0 +1,87 @@
+"""
+Denormalized movie ratings.
+
+Movie.rating_sum, rating_count and rating_avg summarize the movie's
+Review rows, so listings can show and sort by rating without an AVG()
+per movie. They are updated with a single atomic UPDATE ... SET
+rating_sum = rating_sum + n per review write (see Review.save and the
+post_delete receiver in movie.signals). This never reads the aggregates
+into Python, so concurrent reviews of the same movie can't lose updates.
+
+rating_avg is 0, not NULL, for a movie without reviews; use rating_count
+to tell rated movies apart. Ratings are 1-5, so the "Top Rated" sort puts
+unrated movies last on every database without any NULL ordering clause.
+
+Bulk writes (bulk_create / bulk_update / queryset.update on reviews) skip
+both, so code doing them must run reconcile_ratings() afterwards;
+`manage.py reconcile_ratings` does the same from the command line.
+"""
+from django.db import transaction
+from django.db.models import Count, F, FloatField, Sum, Value
+from django.db.models.functions import Cast, Coalesce, NullIf
+
+from .batching import chunked
+from .catalog import bump_catalog_version
+
+# Movie fields derived from its reviews
+RATING_FIELDS = ['rating_sum', 'rating_count', 'rating_avg']
+
+
+def average(rating_sum, rating_count):
+    return rating_sum / rating_count if rating_count else 0.0
+
+
+def apply_rating_change(movie_id, sum_delta, count_delta):
+    """Add the deltas to a movie's rating totals and recompute its average, in one UPDATE"""
+    from .models import Movie
+
+    new_sum = F('rating_sum') + sum_delta
+    new_count = F('rating_count') + count_delta
+    Movie.objects.filter(pk=movie_id).update(
+        rating_sum=new_sum,
+        rating_count=new_count,
+        # SET expressions see the row's old values, so the average uses the new totals
+        rating_avg=Coalesce(Cast(new_sum, FloatField()) / NullIf(new_count, Value(0)), Value(0.0)),
+    )
+    # queryset.update() skips signals; listings show the rating
+    bump_catalog_version()
+
+
+def reconcile_ratings(queryset=None, batch_size=500, dry_run=False):
+    """
+    Recompute the rating aggregates of every movie in `queryset` from its
+    reviews with one grouped query, and store the ones that differ.
+    Returns (checked, changed).
+    """
+    from .models import Movie, Review
+
+    if queryset is None:
+        queryset = Movie.objects.all()
+
+    totals = {
+        movie_id: (rating_sum, rating_count)
+        for movie_id, rating_sum, rating_count in Review.objects.order_by()
+        .values('movie_id')
+        .annotate(rating_sum=Sum('rating'), rating_count=Count('id'))
+        .values_list('movie_id', 'rating_sum', 'rating_count')
+    }
+
+    changed = []
+    checked = 0
+    rows = queryset.values_list('id', *RATING_FIELDS).iterator(chunk_size=batch_size)
+    for movie_id, rating_sum, rating_count, rating_avg in rows:
+        checked += 1
+        new_sum, new_count = totals.get(movie_id, (0, 0))
+        new_avg = average(new_sum, new_count)
+        # The average is compared with a tolerance; the database may round differently
+        if (rating_sum, rating_count) != (new_sum, new_count) or abs(rating_avg - new_avg) > 1e-9:
+            changed.append(Movie(id=movie_id, rating_sum=new_sum, rating_count=new_count, rating_avg=new_avg))
+
+    if not dry_run:
+        for chunk in chunked(changed, batch_size):
+            with transaction.atomic():
+                Movie.objects.bulk_update(chunk, RATING_FIELDS)
+        if changed:
+            # bulk_update skips signals
+            bump_catalog_version()
+    return checked, len(changed)
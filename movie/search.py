@@ -0,0 +1,188 @@
+"""
+Full-text search over movie titles and descriptions.
+
+The backend depends on the database:
+
+* SQLite: an FTS5 virtual table (`movie_movie_fts`) over the movie table,
+  kept current by triggers, ranked with bm25().
+* PostgreSQL: a generated `search_vector` tsvector column with a GIN index,
+  ranked with ts_rank().
+* Anything else (or an SQLite build without FTS5): icontains matching,
+  ordered by id.
+
+The index lives in the database, so every write path keeps it current,
+including bulk_create/bulk_update and raw SQL. Titles weigh more than
+descriptions when ranking.
+
+    search_movies("space travel")                 # every word must match
+    search_movies("space travel", match_any=True)  # any word may match
+"""
+import logging
+import re
+
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connections
+from django.db.models import FloatField, Q, Value
+
+from .models import Movie
+
+logger = logging.getLogger(__name__)
+
+FTS_TABLE = f'{Movie._meta.db_table}_fts'
+SEARCH_VECTOR_COLUMN = 'search_vector'
+SEARCH_INDEX_NAME = f'{Movie._meta.db_table}_search_idx'
+# Text search configuration used for stemming on PostgreSQL
+SEARCH_CONFIG = 'english'
+# Relative weight of a title match against a description match
+TITLE_WEIGHT = 10.0
+# Words beyond this are ignored, so a pasted paragraph can't build a huge query
+MAX_TERMS = 16
+
+# Database name -> whether the FTS5 table exists there
+_fts_available = {}
+
+
+def _sqlite_install_sql():
+    table = Movie._meta.db_table
+    return [
+        f"""CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+            title, description,
+            content='{table}', content_rowid='id',
+            tokenize='porter unicode61 remove_diacritics 2', prefix='2 3'
+        )""",
+        f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON {table} BEGIN
+            INSERT INTO {FTS_TABLE}(rowid, title, description) VALUES (new.id, new.title, new.description);
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON {table} BEGIN
+            INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, description) VALUES ('delete', old.id, old.title, old.description);
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF title, description ON {table} BEGIN
+            INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, description) VALUES ('delete', old.id, old.title, old.description);
+            INSERT INTO {FTS_TABLE}(rowid, title, description) VALUES (new.id, new.title, new.description);
+        END""",
+    ]
+
+
+def install_search_index(connection, rebuild=False):
+    """
+    Create the search index for `connection` if it is missing. Safe to call
+    repeatedly.
+
+    On SQLite, migrations that rebuild the movie table drop its triggers, so
+    this also runs after every migrate (see movie.signals) to put them back.
+    """
+    if connection.vendor == 'sqlite':
+        try:
+            with connection.cursor() as cursor:
+                for statement in _sqlite_install_sql():
+                    cursor.execute(statement)
+                if rebuild:
+                    cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+        except OperationalError as e:
+            # SQLite compiled without FTS5; searches fall back to icontains
+            logger.warning(f"Full-text search unavailable, using substring search: {str(e)}")
+        _fts_available.pop(connection.settings_dict['NAME'], None)
+    elif connection.vendor == 'postgresql':
+        table = Movie._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""ALTER TABLE {table} ADD COLUMN IF NOT EXISTS {SEARCH_VECTOR_COLUMN} tsvector
+                GENERATED ALWAYS AS (
+                    setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(title, '')), 'A') ||
+                    setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(description, '')), 'B')
+                ) STORED"""
+            )
+            cursor.execute(
+                f"CREATE INDEX IF NOT EXISTS {SEARCH_INDEX_NAME} ON {table} USING GIN ({SEARCH_VECTOR_COLUMN})"
+            )
+
+
+def uninstall_search_index(connection):
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            for suffix in ('ai', 'ad', 'au'):
+                cursor.execute(f"DROP TRIGGER IF EXISTS {FTS_TABLE}_{suffix}")
+            cursor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+        _fts_available.pop(connection.settings_dict['NAME'], None)
+    elif connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute(f"DROP INDEX IF EXISTS {SEARCH_INDEX_NAME}")
+            cursor.execute(f"ALTER TABLE {Movie._meta.db_table} DROP COLUMN IF EXISTS {SEARCH_VECTOR_COLUMN}")
+
+
+def search_backend(using=DEFAULT_DB_ALIAS):
+    """'fts5', 'postgres' or 'basic' for the given database"""
+    connection = connections[using]
+    if connection.vendor == 'postgresql':
+        return 'postgres'
+    if connection.vendor == 'sqlite':
+        name = connection.settings_dict['NAME']
+        if name not in _fts_available:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [FTS_TABLE])
+                _fts_available[name] = cursor.fetchone() is not None
+        if _fts_available[name]:
+            return 'fts5'
+    return 'basic'
+
+
+def search_terms(query):
+    """Lower-cased words of the query, without punctuation or duplicates"""
+    terms = []
+    for word in re.findall(r'\w+', query.lower()):
+        if word not in terms:
+            terms.append(word)
+    return terms[:MAX_TERMS]
+
+
+def search_movies(query, queryset=None, match_any=False):
+    """
+    Movies matching `query`, annotated with `search_rank` (higher is more
+    relevant) and ordered best first.
+
+    Every word must match unless match_any is set. Words match as prefixes,
+    so partially typed words still find results.
+    """
+    if queryset is None:
+        queryset = Movie.objects.all()
+    terms = search_terms(query or '')
+    if not terms:
+        return queryset.none()
+
+    backend = search_backend(queryset.db)
+    table = Movie._meta.db_table
+
+    if backend == 'fts5':
+        # Each word becomes a quoted prefix query, so FTS5 syntax in user
+        # input is never interpreted
+        operator = ' OR ' if match_any else ' AND '
+        match = operator.join(f'"{term}"*' for term in terms)
+        queryset = queryset.extra(
+            select={'search_rank': f"-bm25({FTS_TABLE}, %s, 1.0)"},
+            select_params=[TITLE_WEIGHT],
+            tables=[FTS_TABLE],
+            where=[f"{FTS_TABLE}.rowid = {table}.id", f"{FTS_TABLE} MATCH %s"],
+            params=[match],
+        )
+    elif backend == 'postgres':
+        operator = ' | ' if match_any else ' & '
+        tsquery = operator.join(f"{term}:*" for term in terms)
+        # Weights for D, C, B (description) and A (title) labels
+        weights = f"'{{0.1, 0.2, {1.0 / TITLE_WEIGHT}, 1.0}}'"
+        queryset = queryset.extra(
+            select={
+                'search_rank': f"ts_rank({weights}, {table}.{SEARCH_VECTOR_COLUMN}, to_tsquery('{SEARCH_CONFIG}', %s))"
+            },
+            select_params=[tsquery],
+            where=[f"{table}.{SEARCH_VECTOR_COLUMN} @@ to_tsquery('{SEARCH_CONFIG}', %s)"],
+            params=[tsquery],
+        )
+    else:
+        conditions = [Q(title__icontains=term) | Q(description__icontains=term) for term in terms]
+        condition = conditions[0]
+        for other in conditions[1:]:
+            condition = (condition | other) if match_any else (condition & other)
+        return queryset.filter(condition).annotate(
+            search_rank=Value(0.0, output_field=FloatField())
+        ).order_by('id')
+
+    return queryset.order_by('-search_rank', 'id')
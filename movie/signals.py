@@ -0,0 +1,42 @@
+from django.db import connections
+from django.db.migrations.recorder import MigrationRecorder
+from django.db.models.signals import post_delete, post_migrate, post_save
+from django.dispatch import receiver
+
+from .catalog import bump_catalog_version
+from .models import Movie, Review, sync_genres
+from .ratings import apply_rating_change
+from .search import install_search_index
+
+
+@receiver(post_save, sender=Movie)
+@receiver(post_delete, sender=Movie)
+def movie_changed(sender, **kwargs):
+    bump_catalog_version()
+
+
+@receiver(post_delete, sender=Review)
+def review_deleted(sender, instance, **kwargs):
+    # Also runs for queryset and cascade deletes, which skip Review.delete()
+    apply_rating_change(instance.movie_id, -instance.rating, -1)
+
+
+@receiver(post_save, sender=Movie)
+def movie_genres_changed(sender, instance, update_fields=None, raw=False, **kwargs):
+    # Keep the normalized genres in step with the genre string
+    if raw or (update_fields is not None and 'genre' not in update_fields):
+        return
+    sync_genres([instance])
+
+
+@receiver(post_migrate)
+def restore_search_index(sender, using, **kwargs):
+    # SQLite migrations that rebuild the movie table drop the triggers that
+    # keep the full-text index current; recreate them once it is installed
+    if sender.name != 'movie':
+        return
+    connection = connections[using]
+    if connection.vendor != 'sqlite':
+        return
+    if ('movie', '0009_movie_search_index') in MigrationRecorder(connection).applied_migrations():
+        install_search_index(connection)
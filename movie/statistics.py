@@ -0,0 +1,69 @@
+"""
+Data and chart rendering for the statistics page.
+
+Counts are computed by the database with GROUP BY aggregates, and the chart
+PNGs are cached under the catalog version, so they are only re-rendered after
+movie data actually changes.
+"""
+import io
+
+from django.core.cache import cache
+from django.db.models import Count
+from matplotlib.figure import Figure
+
+from .catalog import get_catalog_version
+from .models import Genre, Movie
+
+CHART_CACHE_TIMEOUT = 24 * 3600
+
+
+def movies_per_year():
+    rows = Movie.objects.values('year').annotate(count=Count('id')).order_by('year')
+    return [(row['year'] if row['year'] else "None", row['count']) for row in rows]
+
+
+def movies_per_genre():
+    # A movie with several genres counts once for each of them
+    rows = Genre.objects.annotate(count=Count('movies')).filter(count__gt=0).order_by('name')
+    data = [(genre.name, genre.count) for genre in rows]
+    unknown = Movie.objects.filter(genres__isnull=True).count()
+    if unknown:
+        data.append(("Unknown", unknown))
+    return data
+
+
+def render_bar_chart(data, title, xlabel, figsize, rotation, color=None):
+    """Render a bar chart of (label, count) pairs to PNG bytes"""
+    # Figure instead of pyplot: no global state, safe in threaded workers
+    figure = Figure(figsize=figsize)
+    axes = figure.subplots()
+    bar_positions = range(len(data))
+    axes.bar(bar_positions, [count for _, count in data], width=0.5, align='center', color=color)
+    axes.set_title(title)
+    axes.set_xlabel(xlabel)
+    axes.set_ylabel('Number of movies')
+    axes.set_xticks(list(bar_positions))
+    axes.set_xticklabels([str(label) for label, _ in data], rotation=rotation)
+    figure.subplots_adjust(bottom=0.3)
+
+    buffer = io.BytesIO()
+    figure.savefig(buffer, format='png')
+    return buffer.getvalue()
+
+
+CHARTS = {
+    'year': lambda: render_bar_chart(movies_per_year(), 'Movies per year', 'Year', (10, 6), 90),
+    'genre': lambda: render_bar_chart(movies_per_genre(), 'Movies per genre', 'Genre', (12, 6), 45, color='green'),
+}
+
+
+def get_chart_png(name, version=None):
+    """PNG bytes of a statistics chart, rendered at most once per catalog version"""
+    if version is None:
+        version = get_catalog_version()
+    key = f'movie:chart:{name}:{version}'
+    png = cache.get(key)
+    if png is None:
+        png = CHARTS[name]()
+        cache.set(key, png, CHART_CACHE_TIMEOUT)
+    return png
@@ -1,30 +1,50 @@
 from django import template
 from django.conf import settings
-import os.path
+from movie.image_files import DEFAULT_IMAGE_NAME
+from movie.thumbnails import srcset
 
 register = template.Library()
 
 
+def _image_name(image_field):
+    """Name of the image to show for a field: its own, or the default image's"""
+    try:
+        # Fields not attached to a Movie have no flag; trust the stored name
+        image_ok = getattr(getattr(image_field, 'instance', None), 'image_ok', True)
+        if image_field and image_ok:
+            return image_field.name
+    except (ValueError, AttributeError):
+        pass
+    return DEFAULT_IMAGE_NAME
+
+
 @register.simple_tag
 def safe_image_url(image_field):
     """
     Return the URL of the image or a default image URL if there's an error
     or if the image file doesn't exist.
+
+    Existence comes from the movie's `image_ok` flag (kept current on save
+    and by `manage.py refresh_image_flags`), so rendering does no
+    filesystem I/O.
     """
-    default_image_url = f"{settings.MEDIA_URL}movie/images/default.jpg"
+    default_image_url = f"{settings.MEDIA_URL}{DEFAULT_IMAGE_NAME}"
     try:
-        # Check if image_field is valid and the actual file exists
-        is_valid_field = image_field and hasattr(image_field, 'path')
-        file_exists = False
-        if is_valid_field:
-            # Check path only if field and attribute are valid
-            file_exists = os.path.exists(image_field.path)
-
-        if file_exists:  # True implies is_valid_field was also true
+        if _image_name(image_field) != DEFAULT_IMAGE_NAME:
             return image_field.url
         else:
-            # Image field might be invalid or point to a non-existent file.
+            # The image file is missing
             return default_image_url
     except (ValueError, AttributeError):
         # Catch other potential errors with the image_field
         return default_image_url
+
+
+@register.simple_tag
+def poster_srcset(image_field, fmt='jpeg'):
+    """
+    `srcset` value with every thumbnail width of the image (or of the
+    default image) in `fmt` ('webp' or 'jpeg'). Renditions are generated on
+    first request, so this does no filesystem I/O either.
+    """
+    return srcset(_image_name(image_field), fmt)
@@ -0,0 +1,35 @@
+from functools import lru_cache
+
+from django import template
+from django.utils.html import format_html
+from django.utils.safestring import mark_safe
+
+register = template.Library()
+
+MAX_STARS = 5
+
+
+@lru_cache(maxsize=None)
+def _stars_html(half_stars, label):
+    # Only a few dozen distinct (stars, label) pairs, so each is built once per process
+    full, half = divmod(half_stars, 2)
+    empty = MAX_STARS - full - half
+    return mark_safe(
+        '<i class="bi bi-star-fill"></i>' * full
+        + '<i class="bi bi-star-half"></i>' * half
+        + '<i class="bi bi-star"></i>' * empty
+        + format_html('<small class="ms-1 text-muted">{}</small>', label)
+    )
+
+
+@register.simple_tag
+def star_rating(rating):
+    """
+    Star icons for a 0-5 rating, rounded to the nearest half star, followed
+    by the rating to one decimal. Renders nothing for a missing rating.
+    """
+    try:
+        rating = min(max(float(rating), 0.0), float(MAX_STARS))
+    except (TypeError, ValueError):
+        return ''
+    return _stars_html(round(rating * 2), f'{rating:.1f}')
@@ -1,3 +1,960 @@
-from django.test import TestCase
+import csv
+import io
+import os
+import re
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
 
-# Create your tests here.
+import httpx
+import numpy as np
+import openai
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import IntegrityError, connection, transaction
+from django.db.migrations.executor import MigrationExecutor
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from PIL import Image, ImageDraw
+
+from news.models import News
+
+from .batching import Checkpoint, TokenBucket
+from .catalog import bump_catalog_version, get_catalog_version, get_catalog_versions
+from .fake_openai import FakeOpenAI
+from .fields import VectorField
+from .image_hashing import ImageFingerprint, dhash, fingerprint, group_duplicates, hamming, is_low_detail
+from .management.commands.compute_embeddings import Command as ComputeEmbeddingsCommand
+from .management.commands.update_descriptions import Command as UpdateDescriptionsCommand
+from .management.commands.update_images import Command as UpdateImagesCommand
+from .models import Genre, Movie, Review, SimilarMovie, sync_genres
+from .pagination import InvalidCursor, KeysetPaginator
+from .title_index import TitleIndex, TitleMatch
+from .ratings import reconcile_ratings
+from .search import install_search_index, search_backend, search_movies
+
+
+def selected_columns(sql, table='movie_movie'):
+    """Columns of `table` referenced in the SELECT list of a query"""
+    select_list = sql[sql.index('SELECT') + len('SELECT'):sql.index(' FROM ')]
+    return re.findall(rf'"{table}"\."(\w+)"', select_list)
+
+
+class ListingProjectionTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        for i in range(3):
+            Movie.objects.create(
+                title=f'Movie {i}',
+                description='A long description. ' * 50,
+                image='movie/images/default.jpg',
+                genre='Drama',
+                year=2000 + i,
+                embedding=[0.1] * 8,
+            )
+
+    def movie_queries(self, captured):
+        return [
+            query['sql'] for query in captured
+            if query['sql'].startswith('SELECT') and selected_columns(query['sql'])
+        ]
+
+    def test_home_selects_only_card_columns(self):
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.get('/')
+        self.assertEqual(response.status_code, 200)
+
+        queries = self.movie_queries(captured)
+        self.assertEqual(len(queries), 1)
+        sql = queries[0]
+        # The description is only read through the SUBSTR excerpt
+        self.assertEqual(
+            sorted(selected_columns(sql)),
+            sorted([
+                'id', 'title', 'year', 'genre', 'image', 'image_ok', 'image_width', 'image_height', 'url',
+                'rating_avg', 'rating_count', 'description',
+            ]),
+        )
+        self.assertIn('SUBSTR', sql.upper())
+        self.assertNotIn('embedding', sql)
+        self.assertContains(response, 'A long description.')
+
+    def test_admin_changelist_does_not_load_embeddings(self):
+        admin = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(admin)
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.get('/admin/movie/movie/')
+        self.assertEqual(response.status_code, 200)
+
+        queries = [sql for sql in self.movie_queries(captured) if 'title' in selected_columns(sql)]
+        self.assertEqual(len(queries), 1)
+        sql = queries[0]
+        self.assertEqual(
+            sorted(selected_columns(sql)),
+            sorted(['id', 'title', 'genre', 'year', 'rating_avg', 'rating_count', 'embedding_updated_at', 'embedding']),
+        )
+        # `embedding` is only tested for NULL, never loaded
+        self.assertEqual(
+            sql.count('"movie_movie"."embedding"'),
+            sql.count('"movie_movie"."embedding" IS NOT NULL'),
+        )
+
+
+class PageCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.movie = Movie.objects.create(title='Cached Movie', description='d', image='movie/images/default.jpg')
+
+    def setUp(self):
+        cache.clear()
+
+    def test_anonymous_pages_are_cached_until_a_movie_changes(self):
+        first = self.client.get('/', {'page': '1'})
+        self.assertEqual(first['X-Page-Cache'], 'miss')
+        # Only the catalog version is read
+        with self.assertNumQueries(1):
+            second = self.client.get('/', {'page': '1'})
+        self.assertEqual(second['X-Page-Cache'], 'hit')
+        self.assertEqual(first.content, second.content)
+
+        self.movie.title = 'Renamed Movie'
+        self.movie.save()
+        third = self.client.get('/', {'page': '1'})
+        self.assertEqual(third['X-Page-Cache'], 'miss')
+        self.assertContains(third, 'Renamed Movie')
+
+    def test_catalog_versions_are_shared_through_the_database(self):
+        version = get_catalog_version()
+        # Not kept in the (possibly per-process) cache
+        cache.clear()
+        self.assertEqual(get_catalog_version(), version)
+        bump_catalog_version()
+        bumped = get_catalog_version()
+        self.assertNotEqual(bumped, version)
+        self.assertEqual(get_catalog_versions(['news', 'movie'])[1], bumped)
+        # A rolled-back write doesn't invalidate anything
+        with self.assertRaises(ZeroDivisionError), transaction.atomic():
+            bump_catalog_version()
+            1 / 0
+        self.assertEqual(get_catalog_version(), bumped)
+
+    def test_query_parameters_are_part_of_the_key(self):
+        self.client.get('/', {'sort': 'title_asc'})
+        self.assertEqual(self.client.get('/', {'sort': 'year_desc'})['X-Page-Cache'], 'miss')
+        # Parameters the view doesn't read are never cached
+        self.assertNotIn('X-Page-Cache', self.client.get('/', {'utm_source': 'x'}))
+
+    def test_logged_in_users_bypass_the_cache(self):
+        self.client.get('/about/')
+        user = User.objects.create_user('reader', password='password')
+        self.client.force_login(user)
+        response = self.client.get('/about/')
+        self.assertNotIn('X-Page-Cache', response)
+        self.assertContains(response, 'reader')
+
+    def test_news_writes_invalidate_news_pages_only(self):
+        self.client.get('/news/')
+        self.client.get(f'/movie/{self.movie.id}/')
+        News.objects.create(headline='Fresh headline', body='b', date='2024-01-01T00:00Z')
+        response = self.client.get('/news/')
+        self.assertEqual(response['X-Page-Cache'], 'miss')
+        self.assertContains(response, 'Fresh headline')
+        self.assertEqual(self.client.get(f'/movie/{self.movie.id}/')['X-Page-Cache'], 'hit')
+
+
+class ThumbnailTests(TestCase):
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        thumbnails = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.addCleanup(thumbnails.cleanup)
+        self.thumbnail_root = thumbnails.name
+        os.makedirs(os.path.join(media.name, 'movie', 'images'))
+        Image.new('RGB', (600, 400), 'red').save(os.path.join(media.name, 'movie', 'images', 'poster.jpg'))
+        Image.new('RGB', (600, 400), 'blue').save(os.path.join(media.name, 'other.jpg'))
+        settings_override = override_settings(
+            MEDIA_ROOT=media.name, MOVIE_THUMBNAIL_ROOT=thumbnails.name, MOVIE_THUMBNAIL_WIDTHS=[240],
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def rendition_files(self):
+        return sorted(
+            os.path.relpath(os.path.join(directory, name), self.thumbnail_root)
+            for directory, _, names in os.walk(self.thumbnail_root) for name in names
+        )
+
+    def test_poster_renditions_are_generated(self):
+        response = self.client.get('/thumbnails/240/webp/movie/images/poster.jpg')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/webp')
+        self.assertEqual(self.rendition_files(), [os.path.join('240', 'movie', 'images', 'poster.jpg.webp')])
+
+    def test_only_normalized_poster_names_are_rendered(self):
+        self.client.get('/thumbnails/240/webp/movie/images/poster.jpg')
+        for name in (
+            'other.jpg',
+            '240/movie/images/poster.jpg.webp',
+            'movie/images/../../240/movie/images/poster.jpg.webp',
+            'movie/images/./poster.jpg',
+            'movie/images//poster.jpg',
+        ):
+            with self.subTest(name=name):
+                self.assertEqual(self.client.get(f'/thumbnails/240/webp/{name}').status_code, 404)
+        # Nothing but the one poster rendition was written
+        self.assertEqual(self.rendition_files(), [os.path.join('240', 'movie', 'images', 'poster.jpg.webp')])
+
+
+class RatingAggregateTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.movies = [
+            Movie.objects.create(title=f'Rated {i}', description='d', image='movie/images/default.jpg')
+            for i in range(4)
+        ]
+        cls.users = [User.objects.create_user(f'user{i}') for i in range(3)]
+
+    def aggregates(self, movie):
+        movie.refresh_from_db(fields=['rating_sum', 'rating_count', 'rating_avg'])
+        return movie.rating_sum, movie.rating_count, movie.rating_avg
+
+    def test_review_writes_update_the_aggregates(self):
+        movie = self.movies[0]
+        first = Review.objects.create(movie=movie, user=self.users[0], rating=5)
+        Review.objects.create(movie=movie, user=self.users[1], rating=2)
+        self.assertEqual(self.aggregates(movie), (7, 2, 3.5))
+
+        first.rating = 3
+        first.save()
+        self.assertEqual(self.aggregates(movie), (5, 2, 2.5))
+
+        first.movie = self.movies[1]
+        first.save()
+        self.assertEqual(self.aggregates(movie), (2, 1, 2.0))
+        self.assertEqual(self.aggregates(self.movies[1]), (3, 1, 3.0))
+
+        Review.objects.filter(movie=movie).delete()
+        self.assertEqual(self.aggregates(movie), (0, 0, 0.0))
+
+    def test_reconcile_repairs_bulk_writes(self):
+        Review.objects.bulk_create([
+            Review(movie=self.movies[2], user=user, rating=rating)
+            for user, rating in zip(self.users, [4, 4, 1])
+        ])
+        Movie.objects.filter(pk=self.movies[3].pk).update(rating_sum=9, rating_count=2, rating_avg=4.5)
+
+        self.assertEqual(reconcile_ratings(), (4, 2))
+        self.assertEqual(self.aggregates(self.movies[2]), (9, 3, 3.0))
+        self.assertEqual(self.aggregates(self.movies[3]), (0, 0, 0.0))
+        self.assertEqual(reconcile_ratings(), (4, 0))
+
+    def test_rating_sort_pages_through_unrated_movies(self):
+        for movie, rating in zip(self.movies[:2], [3, 5]):
+            Review.objects.create(movie=movie, user=self.users[0], rating=rating)
+        paginator = KeysetPaginator(Movie.objects.all(), 1, 'rating_desc')
+        seen = []
+        cursor = None
+        while True:
+            page = paginator.page(cursor)
+            seen.extend(movie.title for movie in page)
+            if not page.has_next:
+                break
+            cursor = page.next_cursor
+        self.assertEqual(seen[:2], ['Rated 1', 'Rated 0'])
+        self.assertCountEqual(seen, [movie.title for movie in self.movies])
+
+    def test_unrated_movies_sort_last_without_null_ordering(self):
+        Review.objects.create(movie=self.movies[2], user=self.users[0], rating=1)
+        # Unrated movies have a 0 average, not NULL, so the order doesn't
+        # depend on where the database sorts NULLs
+        self.assertFalse(Movie.objects.filter(rating_avg__isnull=True).exists())
+        response = self.client.get('/', {'sort': 'rating_desc'})
+        titles = [movie.title for movie in response.context['movies']]
+        self.assertEqual(titles, ['Rated 2', 'Rated 3', 'Rated 1', 'Rated 0'])
+        self.assertContains(response, 'No ratings yet', count=3)
+
+
+class PosterHandler(BaseHTTPRequestHandler):
+    """Local stand-in for the poster host: /ok/* serves a PNG, /error/* a 500, anything else 404"""
+    png = None
+    hits = []
+
+    def do_GET(self):
+        self.hits.append(self.path)
+        if self.path.startswith('/ok/'):
+            self.send_response(200)
+            self.send_header('Content-Type', 'image/png')
+            self.send_header('Content-Length', str(len(self.png)))
+            self.end_headers()
+            self.wfile.write(self.png)
+        else:
+            self.send_error(500 if self.path.startswith('/error/') else 404)
+
+    def log_message(self, *args):
+        pass
+
+
+class ImportMoviesFromCsvTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        buffer = io.BytesIO()
+        Image.new('RGB', (30, 45), 'green').save(buffer, 'PNG')
+        PosterHandler.png = buffer.getvalue()
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), PosterHandler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.base_url = f'http://127.0.0.1:{cls.server.server_port}'
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        PosterHandler.hits = []
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.media_root = media.name
+        settings_override = override_settings(MEDIA_ROOT=media.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def write_csv(self, rows):
+        path = os.path.join(self.media_root, 'movies.csv')
+        with open(path, 'w', encoding='utf-8', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=['title', 'year', 'genre', 'plot', 'poster'])
+            writer.writeheader()
+            writer.writerows(rows)
+        return path
+
+    def import_csv(self, path, *args):
+        stdout, stderr = io.StringIO(), io.StringIO()
+        call_command('import_movies_from_csv', '--csv_file', path, '--retries', '2', *args, stdout=stdout, stderr=stderr)
+        return stdout.getvalue(), stderr.getvalue()
+
+    def stored_posters(self):
+        return sorted(os.listdir(os.path.join(self.media_root, 'movie', 'images')))
+
+    def test_bad_rows_are_retried_one_by_one(self):
+        path = self.write_csv([
+            {'title': 'Good One', 'year': '1999', 'genre': 'Drama', 'poster': f'{self.base_url}/ok/1.png'},
+            # Too large for an integer column: fails the chunk's INSERT
+            {'title': 'Bad Year', 'year': '9' * 30, 'genre': 'Drama', 'poster': f'{self.base_url}/ok/2.png'},
+            {'title': 'Server Error', 'year': '2001', 'genre': 'Comedy', 'poster': f'{self.base_url}/error/3.png'},
+            {'title': 'No Poster', 'year': '2002', 'genre': 'Comedy', 'poster': f'{self.base_url}/missing/4.png'},
+        ])
+        with self.assertLogs('movie.downloads', 'WARNING'):
+            stdout, stderr = self.import_csv(path)
+
+        self.assertIn('1 errors', stdout)
+        self.assertIn("Error importing 'Bad Year'", stderr)
+        self.assertEqual(
+            sorted(Movie.objects.values_list('title', flat=True)),
+            ['Good One', 'No Poster', 'Server Error'],
+        )
+        good = Movie.objects.get(title='Good One')
+        self.assertTrue(good.image_ok)
+        self.assertEqual((good.image_width, good.image_height), (30, 45))
+        self.assertEqual(list(good.genres.values_list('name', flat=True)), ['Drama'])
+        # Failed downloads leave the movie without a poster
+        self.assertFalse(Movie.objects.get(title='Server Error').image)
+        # 500s are retried, 404s are not
+        self.assertEqual(PosterHandler.hits.count('/error/3.png'), 2)
+        self.assertEqual(PosterHandler.hits.count('/missing/4.png'), 1)
+        # The poster of the row that failed to insert was removed
+        self.assertEqual(self.stored_posters(), [os.path.basename(good.image.name)])
+
+    def test_offset_past_the_end(self):
+        path = self.write_csv([{'title': 'Only Row', 'year': '2000', 'genre': 'Drama', 'poster': ''}])
+        stdout, stderr = self.import_csv(path, '--offset', '2')
+        self.assertIn('Offset 2 is greater than the number of rows in the CSV', stderr)
+        self.assertFalse(Movie.objects.exists())
+
+
+def poster(size=(300, 450)):
+    """An image with enough structure for a meaningful dHash"""
+    image = Image.new('RGB', size, 'white')
+    draw = ImageDraw.Draw(image)
+    width, height = size
+    for i, color in enumerate(['red', 'navy', 'gold', 'black', 'teal']):
+        draw.rectangle([i * width // 6, i * height // 8, width - i * width // 16, height // 2 + i * height // 12], fill=color)
+    draw.ellipse([width // 4, height * 2 // 3, width * 3 // 4, height - 10], fill='purple')
+    return image
+
+
+class ImageHashingTests(SimpleTestCase):
+    def test_resized_copies_hash_alike(self):
+        original = poster()
+        copy = original.resize((150, 225)).convert('L')
+        self.assertLessEqual(hamming(dhash(original), dhash(copy)), 2)
+        self.assertFalse(is_low_detail(dhash(original)))
+        self.assertGreater(hamming(dhash(original), dhash(original.transpose(Image.FLIP_LEFT_RIGHT))), 10)
+
+    def test_flat_images_are_low_detail(self):
+        self.assertEqual(dhash(Image.new('RGB', (64, 64), 'white')), 0)
+        self.assertTrue(is_low_detail(dhash(Image.new('RGB', (64, 64), 'gray'))))
+
+    def test_fingerprint(self):
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, 'poster.png')
+            poster((120, 80)).save(path)
+            fp = fingerprint(path)
+        self.assertEqual((fp.width, fp.height, fp.format), (120, 80, 'png'))
+        self.assertEqual(len(fp.sha256), 64)
+        self.assertEqual(fp.dhash, dhash(poster((120, 80))))
+
+    @staticmethod
+    def fp(path, dhash_value, sha256=None):
+        return ImageFingerprint(path, sha256 or path, dhash_value, 100, 150, 'png')
+
+    def names(self, groups):
+        return [[fp.path for fp in group] for group in groups]
+
+    def test_groups_identical_files_and_near_hashes(self):
+        base = 0x0123456789ABCDEF
+        fingerprints = [
+            self.fp('a', base),
+            self.fp('b', base ^ 0b1011),  # 3 bits away
+            self.fp('c', base ^ 0xFF),  # 8 bits away from a, 5 from b
+            self.fp('d', 0xFEDCBA9876543210, sha256='a'),  # same file as a
+        ]
+        self.assertEqual(self.names(group_duplicates(fingerprints, 4)), [['a', 'b', 'd'], ['c']])
+        # Identical files only
+        self.assertEqual(self.names(group_duplicates(fingerprints, -1)), [['a', 'd'], ['b'], ['c']])
+
+    def test_near_hashes_only_group_within_a_key(self):
+        base = 0x0123456789ABCDEF
+        fingerprints = [
+            self.fp('a1', base), self.fp('a2', base ^ 1), self.fp('b1', base ^ 2), self.fp('x', base ^ 4),
+            self.fp('b2', 0xFEDCBA9876543210, sha256='a1'),
+        ]
+        movies = {'a1': 1, 'a2': 1, 'b1': 2, 'b2': 2, 'x': None}
+        groups = group_duplicates(fingerprints, 4, key=lambda fp: movies[fp.path])
+        # b1 looks like a1 but belongs to another movie; x matched no movie.
+        # b2 is the same file as a1, which is always merged
+        self.assertEqual(self.names(groups), [['a1', 'a2', 'b2'], ['b1'], ['x']])
+
+    def test_low_detail_hashes_are_never_near_matched(self):
+        fingerprints = [self.fp('flat', 0), self.fp('almost flat', 0b101), self.fp('copy', 0, sha256='flat')]
+        self.assertEqual(self.names(group_duplicates(fingerprints, 4)), [['flat', 'copy'], ['almost flat']])
+
+
+def api_error(error_class, status_code):
+    request = httpx.Request('POST', 'https://api.openai.com/v1/images/generations')
+    return error_class('error', response=httpx.Response(status_code, request=request), body=None)
+
+
+class FailingImages:
+    """FakeOpenAI images API that raises the queued errors for a prompt before succeeding"""
+
+    def __init__(self, client, errors):
+        self.generate_image = client.images.generate
+        self.errors = errors
+        self.prompts = []
+
+    def generate(self, prompt, **kwargs):
+        self.prompts.append(prompt)
+        if self.errors.get(prompt):
+            raise self.errors[prompt].pop(0)
+        return self.generate_image(prompt, **kwargs)
+
+
+class UpdateImagesTests(TestCase):
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.images_root = os.path.join(media.name, 'movie', 'images')
+        os.makedirs(self.images_root)
+        settings_override = override_settings(MEDIA_ROOT=media.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def test_skips_links_retries_and_fails(self):
+        Image.new('RGB', (10, 10)).save(os.path.join(self.images_root, 'has.png'))
+        has_poster = Movie.objects.create(title='Has Poster', description='d', image='movie/images/has.png')
+        Movie.objects.create(title='Left Over', description='d', image='')
+        Image.new('RGB', (20, 30)).save(os.path.join(self.images_root, 'm_Left Over.png'))
+        Movie.objects.create(title='Rate Limited', description='d', image='')
+        Movie.objects.create(title='Rejected', description='d', image='')
+        client = FakeOpenAI()
+        client.images = FailingImages(client, {
+            'Movie poster of Rate Limited': [api_error(openai.RateLimitError, 429), api_error(openai.InternalServerError, 500)],
+            'Movie poster of Rejected': [api_error(openai.BadRequestError, 400)],
+        })
+
+        stdout, stderr = io.StringIO(), io.StringIO()
+        with mock.patch.object(UpdateImagesCommand, 'get_client', return_value=client), \
+                mock.patch('movie.management.commands.update_images.time.sleep') as sleep:
+            call_command('update_images', '--fake', '--workers', '1', stdout=stdout, stderr=stderr)
+
+        # Only the movies without a poster file were generated; the 400 was not retried
+        self.assertEqual(sorted(client.images.prompts), [
+            'Movie poster of Rate Limited', 'Movie poster of Rate Limited', 'Movie poster of Rate Limited',
+            'Movie poster of Rejected',
+        ])
+        self.assertEqual(sleep.call_count, 2)
+        self.assertIn('Error generating image for Rejected', stderr.getvalue())
+        self.assertIn('2 movies updated', stdout.getvalue())
+
+        movies = {movie.title: movie for movie in Movie.objects.all()}
+        self.assertEqual(movies['Has Poster'].image.name, has_poster.image.name)
+        self.assertEqual(
+            (movies['Left Over'].image.name, movies['Left Over'].image_ok, movies['Left Over'].image_width),
+            ('movie/images/m_Left Over.png', True, 20),
+        )
+        self.assertEqual(movies['Rate Limited'].image.name, 'movie/images/m_Rate Limited.png')
+        self.assertTrue(movies['Rate Limited'].image_ok)
+        self.assertEqual((movies['Rejected'].image.name, movies['Rejected'].image_ok), ('', False))
+        self.assertEqual(sorted(os.listdir(self.images_root)), ['has.png', 'm_Left Over.png', 'm_Rate Limited.png'])
+
+
+class FailingCompletions:
+    """FakeOpenAI chat completions API that raises the queued errors for a movie before succeeding"""
+
+    def __init__(self, client, errors):
+        self.create_completion = client.chat.completions.create
+        self.errors = errors
+        self.titles = []
+
+    def create(self, messages, **kwargs):
+        title = re.search(r'Untold \d+', messages[0]['content']).group()
+        self.titles.append(title)
+        if self.errors.get(title):
+            raise self.errors[title].pop(0)
+        return self.create_completion(messages=messages, **kwargs)
+
+
+class UpdateDescriptionsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        for i in range(3):
+            Movie.objects.create(title=f'Untold {i}', description='', genre='Drama', year=2000 + i, image='')
+        Movie.objects.create(title='Told', description='Already described', image='')
+
+    def setUp(self):
+        folder = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        self.cache_path = os.path.join(folder.name, 'cache.jsonl')
+        self.checkpoint_path = os.path.join(folder.name, 'checkpoint.json')
+
+    def update_descriptions(self):
+        """Run the command with a fresh fake client; returns (client, SQL of the UPDATEs, output)"""
+        client = FakeOpenAI()
+        stdout = io.StringIO()
+        with mock.patch.object(UpdateDescriptionsCommand, 'get_client', return_value=client), \
+                CaptureQueriesContext(connection) as captured:
+            call_command(
+                'update_descriptions', '--fake', '--cache', self.cache_path, '--checkpoint', self.checkpoint_path,
+                stdout=stdout,
+            )
+        updates = [query['sql'] for query in captured if query['sql'].startswith('UPDATE "movie_movie"')]
+        return client, updates, stdout.getvalue()
+
+    def descriptions(self):
+        return dict(Movie.objects.values_list('title', 'description'))
+
+    def test_generates_once_and_reuses_cached_responses(self):
+        client, updates, output = self.update_descriptions()
+        self.assertEqual(client.calls['chat'], 3)
+        # All three descriptions written by one bulk UPDATE
+        self.assertEqual(len(updates), 1)
+        self.assertIn('Successfully updated 3 movie descriptions', output)
+        first = self.descriptions()
+        self.assertEqual(first['Told'], 'Already described')
+        self.assertTrue(all(first[f'Untold {i}'].startswith('Fake description for') for i in range(3)))
+        # Finished runs remove their checkpoint
+        self.assertFalse(os.path.exists(self.checkpoint_path))
+
+        Movie.objects.filter(title__startswith='Untold').update(description='')
+        client, updates, output = self.update_descriptions()
+        self.assertEqual(client.calls['chat'], 0)
+        self.assertEqual(len(updates), 1)
+        self.assertIn('Reused cached descriptions for 3 movies', output)
+        self.assertEqual(self.descriptions(), first)
+
+    def test_retries_only_transient_errors(self):
+        client = FakeOpenAI()
+        client.chat.completions = FailingCompletions(client, {
+            'Untold 0': [api_error(openai.RateLimitError, 429), api_error(openai.InternalServerError, 503)],
+            'Untold 1': [api_error(openai.BadRequestError, 400)],
+        })
+        stdout = io.StringIO()
+        with mock.patch.object(UpdateDescriptionsCommand, 'get_client', return_value=client), \
+                mock.patch('movie.management.commands.update_descriptions.time.sleep') as sleep:
+            call_command(
+                'update_descriptions', '--fake', '--workers', '1',
+                '--cache', self.cache_path, '--checkpoint', self.checkpoint_path, stdout=stdout,
+            )
+
+        # The 400 was sent once; the rate limit and server error were retried
+        self.assertEqual(client.chat.completions.titles, ['Untold 0', 'Untold 0', 'Untold 0', 'Untold 1', 'Untold 2'])
+        self.assertEqual(sleep.call_count, 2)
+        self.assertEqual(client.calls['chat'], 2)
+        self.assertIn('Error updating movie Untold 1', stdout.getvalue())
+        self.assertIn('1 movies failed', stdout.getvalue())
+        descriptions = self.descriptions()
+        self.assertEqual(descriptions['Untold 1'], '')
+        self.assertTrue(descriptions['Untold 0'].startswith('Fake description for'))
+
+
+class FakeClock:
+    """Stands in for the time module: sleep() advances monotonic() instantly"""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.slept = 0.0
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+        self.slept += seconds
+
+
+class TokenBucketTests(SimpleTestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        patcher = mock.patch('movie.batching.time', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_bursts_up_to_capacity_then_waits_for_refill(self):
+        bucket = TokenBucket(60, capacity=2)
+        bucket.acquire()
+        bucket.acquire()
+        self.assertEqual(self.clock.slept, 0)
+        # 60 per minute: one token a second
+        bucket.acquire()
+        self.assertAlmostEqual(self.clock.slept, 1.0)
+        self.clock.now += 10
+        bucket.acquire(2)
+        self.assertAlmostEqual(self.clock.slept, 1.0)
+
+    def test_oversized_requests_wait_for_a_full_bucket(self):
+        bucket = TokenBucket(120, capacity=4)
+        bucket.acquire(4)
+        bucket.acquire(100)
+        self.assertAlmostEqual(self.clock.slept, 2.0)
+
+    def test_zero_rate_never_waits(self):
+        bucket = TokenBucket(0)
+        for _ in range(1000):
+            bucket.acquire(50)
+        self.assertEqual(self.clock.slept, 0)
+
+
+class CheckpointTests(SimpleTestCase):
+    def setUp(self):
+        folder = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        self.path = os.path.join(folder.name, 'checkpoint.json')
+
+    def test_resumes_with_the_same_signature_only(self):
+        checkpoint = Checkpoint(self.path, signature={'model': 'a'})
+        checkpoint.load()
+        checkpoint.mark_done([3, 1])
+        checkpoint.mark_done(iter([2]))
+
+        self.assertEqual(Checkpoint(self.path, signature={'model': 'a'}).load(), {1, 2, 3})
+        # A run with other options starts over
+        self.assertEqual(Checkpoint(self.path, signature={'model': 'b'}).load(), set())
+        # Every save replaced the file whole; no temporary files are left
+        self.assertEqual(os.listdir(os.path.dirname(self.path)), ['checkpoint.json'])
+
+        checkpoint.clear()
+        self.assertFalse(os.path.exists(self.path))
+        self.assertEqual(Checkpoint(self.path, signature={'model': 'a'}).load(), set())
+
+    def test_unreadable_checkpoint_starts_over(self):
+        with open(self.path, 'w', encoding='utf-8') as f:
+            f.write('{"signature": null, "done": [1, 2')
+        self.assertEqual(Checkpoint(self.path).load(), set())
+
+
+
+class EmbedBatchTests(SimpleTestCase):
+    def embed(self, errors):
+        """Embed one text with a client that raises `errors` first; records the calls and sleeps"""
+        client = FakeOpenAI()
+        create_embeddings = client.embeddings.create
+        calls = []
+
+        def embeddings_create(**kwargs):
+            calls.append(kwargs['input'])
+            if errors:
+                raise errors.pop(0)
+            return create_embeddings(**kwargs)
+
+        client.embeddings.create = embeddings_create
+        with mock.patch('movie.management.commands.compute_embeddings.time.sleep') as sleep:
+            try:
+                return ComputeEmbeddingsCommand().embed_batch(client, [('hash', 'text')], TokenBucket(0), TokenBucket(0), 3)
+            finally:
+                self.calls, self.sleeps = len(calls), sleep.call_count
+
+    def test_transient_errors_are_retried(self):
+        with self.assertLogs('movie.management.commands.compute_embeddings', 'WARNING'):
+            result = self.embed([api_error(openai.RateLimitError, 429), api_error(openai.InternalServerError, 502)])
+        self.assertEqual([content_hash for content_hash, _ in result], ['hash'])
+        self.assertEqual((self.calls, self.sleeps), (3, 2))
+
+    def test_permanent_errors_are_not_retried(self):
+        for error_class, status_code in [(openai.BadRequestError, 400), (openai.AuthenticationError, 401)]:
+            with self.subTest(status_code=status_code), self.assertRaises(error_class):
+                self.embed([api_error(error_class, status_code)])
+            self.assertEqual((self.calls, self.sleeps), (1, 0))
+
+class TitleIndexTests(SimpleTestCase):
+    def test_exact_matches_win_and_keep_the_first_entry(self):
+        index = TitleIndex([('Alien', 1), ('ALIEN!', 2), ('Aliens', 3)])
+        self.assertEqual(index.match('alien'), TitleMatch(1, 'Alien', 1.0, True))
+        self.assertEqual(index.match('Aliens'), TitleMatch(3, 'Aliens', 1.0, True))
+
+    def test_fuzzy_ties_go_to_the_higher_jaccard(self):
+        # Both contain every trigram of the query; the shorter one is more similar
+        index = TitleIndex([('Star Wars: The Movie Episode', 1), ('The Star Wars', 2)])
+        self.assertEqual(index.match('star wars').value, 2)
+
+    def test_then_to_the_closer_length(self):
+        # Same trigram sets, so the same score and Jaccard similarity
+        index = TitleIndex([('Red Blue', 1), ('Red Red Blue', 2)])
+        self.assertEqual(index.match('red blue green').value, 2)
+
+    def test_then_to_the_smaller_normalized_title_then_the_first_added(self):
+        index = TitleIndex([('Red Blue', 1), ('Blue Red', 2)])
+        self.assertEqual(index.match('red blue green').value, 2)
+        index = TitleIndex([('Alien', 1), ('ALIEN!', 2)])
+        self.assertEqual(index.match('Aliens').value, 1)
+
+    def test_below_min_score(self):
+        index = TitleIndex([('Casablanca', 1)])
+        self.assertIsNone(index.match('Vertigo'))
+        self.assertIsNone(index.match('Casablanka', min_score=0.9))
+        self.assertEqual(index.match('Casablanka', min_score=0.5).value, 1)
+
+
+class KeysetPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        # Several NULL years, and repeated years, so pages split inside runs of equal keys
+        years = [2000, None, 2001, None, 2000, 1999, None, 2001, 2000]
+        for i, year in enumerate(years):
+            Movie.objects.create(title=f'Movie {i}', description='d', image='', year=year)
+
+    def walk(self, sort, per_page):
+        """Pages going forward from the first page, then backward from the last"""
+        paginator = KeysetPaginator(Movie.objects.all(), per_page, sort)
+        forward = [paginator.page()]
+        while forward[-1].has_next:
+            forward.append(paginator.page(forward[-1].next_cursor))
+        backward = [forward[-1]]
+        while backward[-1].has_previous:
+            backward.append(paginator.page(backward[-1].previous_cursor))
+        return [[m.id for m in page] for page in forward], [[m.id for m in page] for page in reversed(backward)]
+
+    def test_forward_and_backward_paging_with_null_keys(self):
+        for sort, ordering in (('year_desc', ('-year', '-id')), ('year_asc', ('year', 'id'))):
+            # Wherever this database puts NULLs, paging must visit every
+            # row once, in the same order as a plain ORDER BY
+            expected = list(Movie.objects.order_by(*ordering).values_list('id', flat=True))
+            for per_page in (1, 2, 4):
+                with self.subTest(sort=sort, per_page=per_page):
+                    forward, backward = self.walk(sort, per_page)
+                    self.assertEqual([movie_id for page in forward for movie_id in page], expected)
+                    self.assertEqual(backward, forward)
+
+    def test_last_page_and_bad_cursors(self):
+        paginator = KeysetPaginator(Movie.objects.all(), 20, 'year_desc')
+        page = paginator.page()
+        self.assertEqual(len(page), 9)
+        self.assertFalse(page.has_next or page.has_previous)
+        self.assertEqual(len(paginator.page(page.next_cursor)), 0)
+        for cursor in ('not-a-cursor', page.next_cursor[:-2]):
+            with self.subTest(cursor=cursor), self.assertRaises(InvalidCursor):
+                paginator.page(cursor)
+
+
+class GenreTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        Genre.objects.bulk_create([Genre(name=f'Genre {i}') for i in range(50)] + [Genre(name='Drama')])
+
+    def test_names_are_unique_ignoring_case(self):
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Genre.objects.create(name='DRAMA')
+
+    def test_sync_loads_only_the_named_genres(self):
+        movie = Movie.objects.create(title='Mixed Case', description='d', image='', genre='drama, Comedy')
+        self.assertEqual(sorted(movie.genres.values_list('name', flat=True)), ['Comedy', 'Drama'])
+
+        movie.genre = 'Comedy, DRAMA, Western'
+        with CaptureQueriesContext(connection) as captured:
+            sync_genres([movie])
+        genre_selects = [
+            query['sql'] for query in captured
+            if query['sql'].startswith('SELECT') and 'FROM "movie_genre"' in query['sql']
+        ]
+        # Before and after creating 'Western', each filtered by name
+        self.assertEqual(len(genre_selects), 2)
+        self.assertTrue(all('LOWER' in sql.upper() and 'WHERE' in sql for sql in genre_selects))
+        self.assertEqual(sorted(movie.genres.values_list('name', flat=True)), ['Comedy', 'Drama', 'Western'])
+        self.assertEqual(Genre.objects.count(), 53)
+
+
+class ComputeSimilarMoviesTests(TestCase):
+    def test_rows_are_written_block_by_block(self):
+        rng = np.random.default_rng(5)
+        movies = [
+            Movie.objects.create(title=f'Movie {i}', description='d', image='', embedding=rng.standard_normal(8).astype(np.float32))
+            for i in range(5)
+        ]
+        SimilarMovie.objects.create(movie=movies[0], similar=movies[0], score=1.0, rank=1)
+        with mock.patch.object(SimilarMovie.objects, 'bulk_create', wraps=SimilarMovie.objects.bulk_create) as bulk_create:
+            call_command('compute_similar_movies', '--top', '2', '--block-size', '2', stdout=io.StringIO())
+        self.assertEqual([len(call.args[0]) for call in bulk_create.call_args_list], [4, 4, 2])
+
+        vectors = np.vstack([movie.embedding for movie in movies])
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        similarities = vectors @ vectors.T
+        np.fill_diagonal(similarities, -np.inf)
+        for position, movie in enumerate(movies):
+            expected = [movies[column].pk for column in np.argsort(-similarities[position])[:2]]
+            self.assertEqual(list(movie.similar_entries.values_list('similar_id', flat=True)), expected)
+
+
+class SearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.alien = Movie.objects.create(title='Alien', description='A crew in deep space meets a creature.', image='')
+        cls.station = Movie.objects.create(title='Space Station', description='Astronauts orbit the earth.', image='')
+        cls.drama = Movie.objects.create(title='Quiet Drama', description='An alien visits a small town.', image='')
+        cls.cooking = Movie.objects.create(title='Cooking', description='Recipes from an aliens cookbook.', image='')
+
+    def setUp(self):
+        if search_backend() != 'fts5':
+            self.skipTest('SQLite without FTS5')
+
+    def titles(self, query, match_any=False):
+        return list(search_movies(query, match_any=match_any).values_list('title', flat=True))
+
+    def test_title_matches_rank_first(self):
+        results = search_movies('alien')
+        self.assertEqual(list(results.values_list('title', flat=True))[0], 'Alien')
+        # Prefix matching also finds 'aliens'
+        self.assertCountEqual(self.titles('alien'), ['Alien', 'Quiet Drama', 'Cooking'])
+        ranks = [movie.search_rank for movie in results]
+        self.assertEqual(ranks, sorted(ranks, reverse=True))
+        self.assertEqual(self.titles('ali'), self.titles('alien'))
+
+    def test_all_terms_or_any_term(self):
+        self.assertEqual(self.titles('alien space'), ['Alien'])
+        self.assertEqual(self.titles('alien space', match_any=True)[:2], ['Alien', 'Space Station'])
+        self.assertCountEqual(self.titles('alien space', match_any=True), ['Alien', 'Space Station', 'Quiet Drama', 'Cooking'])
+        self.assertEqual(self.titles(''), [])
+        self.assertEqual(self.titles('!!!'), [])
+
+    def test_query_syntax_in_user_input_is_not_interpreted(self):
+        for query in ['"alien', 'alien"', 'alien*', '*alien', '-alien', '(alien', '^alien', 'alien:']:
+            with self.subTest(query=query):
+                self.assertEqual(self.titles(query), self.titles('alien'))
+        # Operators and column filters are searched for as words ('or' is a prefix of 'orbit')
+        self.assertEqual(self.titles('alien NEAR space'), [])
+        self.assertEqual(self.titles('title:alien'), [])
+        self.assertEqual(self.titles('space OR astronauts'), ['Space Station'])
+        self.assertEqual(self.titles('alien AND cookbook'), [])
+        self.assertIn('Cooking', self.titles('alien NOT cookbook', match_any=True))
+
+    def test_index_follows_every_write(self):
+        self.alien.title = 'Xenomorph'
+        self.alien.save()
+        self.assertEqual(self.titles('xenomorph'), ['Xenomorph'])
+        self.assertNotIn('Xenomorph', self.titles('alien'))
+
+        self.drama.description = 'A lighthouse keeper waits.'
+        Movie.objects.bulk_update([self.drama], ['description'])
+        self.assertEqual(self.titles('lighthouse'), ['Quiet Drama'])
+        Movie.objects.filter(pk=self.cooking.pk).update(title='Baking')
+        self.assertEqual(self.titles('baking'), ['Baking'])
+        Movie.objects.bulk_create([Movie(title='Lighthouse Keeper', description='d', image='')])
+        self.assertEqual(self.titles('lighthouse'), ['Lighthouse Keeper', 'Quiet Drama'])
+
+        self.station.delete()
+        Movie.objects.filter(title='Baking').delete()
+        self.assertEqual(self.titles('space orbit baking', match_any=True), ['Xenomorph'])
+
+
+class VectorFieldTests(SimpleTestCase):
+    def setUp(self):
+        self.field = Movie._meta.get_field('embedding')
+
+    def test_values_round_trip_as_float32_bytes(self):
+        for value in [[0.5, -1.25, 3.0], (0.5, -1.25, 3.0), np.array([0.5, -1.25, 3.0]), np.array([0.5, -1.25, 3.0], dtype=np.float32)]:
+            with self.subTest(value=value):
+                stored = self.field.get_db_prep_value(value, connection)
+                self.assertEqual(bytes(stored), np.array([0.5, -1.25, 3.0], dtype='<f4').tobytes())
+                loaded = self.field.from_db_value(stored, None, connection)
+                self.assertEqual(loaded.dtype, np.dtype('<f4'))
+                self.assertEqual(loaded.tolist(), [0.5, -1.25, 3.0])
+                # Loaded arrays are views over the row bytes, never copied
+                self.assertFalse(loaded.flags.writeable)
+        self.assertIsNone(self.field.get_db_prep_value(None, connection))
+        self.assertIsNone(self.field.from_db_value(None, None, connection))
+
+    def test_serialized_values_and_to_python(self):
+        movie = Movie(embedding=[1.0, 2.0])
+        serialized = self.field.value_to_string(movie)
+        self.assertEqual(self.field.to_python(serialized).tolist(), [1.0, 2.0])
+        self.assertEqual(self.field.to_python(np.array([1.0, 2.0], dtype=np.float32).tobytes()).tolist(), [1.0, 2.0])
+        self.assertEqual(self.field.to_python([1, 2]).dtype, np.dtype('<f4'))
+        self.assertIsNone(self.field.to_python(None))
+        self.assertIsNone(self.field.value_to_string(Movie(embedding=None)))
+
+    def test_dtype_and_length(self):
+        half = VectorField(dtype='float16')
+        self.assertEqual(len(half.get_db_prep_value([1.0, 2.0, 3.0], connection)), 6)
+        self.assertEqual(half.deconstruct()[3]['dtype'], 'float16')
+        self.assertNotIn('dtype', self.field.deconstruct()[3])
+        self.assertEqual(half.from_db_value(half.get_db_prep_value([1.5], connection), None, connection).tolist(), [1.5])
+        # Bytes that are not a whole number of values are rejected
+        with self.assertRaises(ValueError):
+            self.field.from_db_value(b'\x00' * 6, None, connection)
+
+
+class EmbeddingBinaryMigrationTests(TransactionTestCase):
+    before = [('movie', '0003_movie_embedding_movie_embedding_updated_at')]
+    after = [('movie', '0004_movie_embedding_binary')]
+
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def tearDown(self):
+        self.migrate(MigrationExecutor(connection).loader.graph.leaf_nodes())
+        # Table rebuilds dropped the search triggers; `migrate` restores them on post_migrate
+        install_search_index(connection)
+
+    def test_json_embeddings_become_float32_vectors(self):
+        apps = self.migrate(self.before)
+        OldMovie = apps.get_model('movie', 'Movie')
+        converted = OldMovie.objects.create(title='Old', description='d', image='', embedding=[0.1, -2.5, 3.75])
+        OldMovie.objects.create(title='Empty', description='d', image='', embedding=[])
+        OldMovie.objects.create(title='None', description='d', image='', embedding=None)
+
+        apps = self.migrate(self.after)
+        embeddings = dict(apps.get_model('movie', 'Movie').objects.values_list('title', 'embedding'))
+        self.assertEqual(embeddings['Old'].dtype, np.dtype('<f4'))
+        self.assertEqual(embeddings['Old'].tolist(), np.array([0.1, -2.5, 3.75], dtype=np.float32).tolist())
+        self.assertIsNone(embeddings['Empty'])
+        self.assertIsNone(embeddings['None'])
+
+        # And back again
+        apps = self.migrate(self.before)
+        OldMovie = apps.get_model('movie', 'Movie')
+        self.assertEqual(OldMovie.objects.get(pk=converted.pk).embedding, np.array([0.1, -2.5, 3.75], dtype=np.float32).tolist())
@@ -0,0 +1,125 @@
+"""
+Resized poster renditions for responsive images.
+
+Each poster is served in a few widths (settings.MOVIE_THUMBNAIL_WIDTHS), as
+WebP and as JPEG. A rendition is generated on its first request by the
+`movie_thumbnail` view and cached on disk under MOVIE_THUMBNAIL_ROOT:
+
+    <MOVIE_THUMBNAIL_ROOT>/<width>/<image name>.<format>
+
+Only poster images (names under IMAGES_FOLDER, in normalized form) have
+renditions, and MOVIE_THUMBNAIL_ROOT lives outside MEDIA_ROOT, so a request
+can never render a rendition of a rendition: the set of files the view may
+write is bounded by the posters on disk.
+
+A cached rendition older than its source image is regenerated, so replacing
+a poster file is picked up automatically. `manage.py warm_thumbnails`
+generates every rendition ahead of time across all CPU cores.
+
+render_rendition() touches only the filesystem and Pillow (no Django
+state), so it can run in worker processes.
+"""
+import os
+import posixpath
+import tempfile
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.urls import reverse
+from django.utils._os import safe_join
+from PIL import Image, ImageOps
+
+from .image_files import IMAGES_FOLDER
+
+THUMBNAIL_FORMATS = {
+    'webp': ('WEBP', 'image/webp'),
+    'jpeg': ('JPEG', 'image/jpeg'),
+}
+
+
+def thumbnail_widths():
+    return settings.MOVIE_THUMBNAIL_WIDTHS
+
+
+def source_path(name):
+    """Absolute path of an image name relative to MEDIA_ROOT (no escaping it)"""
+    return safe_join(settings.MEDIA_ROOT, name)
+
+
+def poster_source_path(name):
+    """
+    source_path() of a poster image. Raises SuspiciousFileOperation for any
+    other name, and for spellings of a poster name other than the normalized
+    one ('movie/images/./x.jpg'), which would each get their own renditions.
+    """
+    if posixpath.normpath(name) != name or not name.startswith(IMAGES_FOLDER + '/'):
+        raise SuspiciousFileOperation(f"Not a poster image: {name}")
+    return source_path(name)
+
+
+def rendition_path(name, width, fmt):
+    return safe_join(settings.MOVIE_THUMBNAIL_ROOT, str(width), f'{name}.{fmt}')
+
+
+def thumbnail_url(name, width, fmt):
+    return reverse('movie_thumbnail', args=[width, fmt, name])
+
+
+def render_rendition(source, target, width, fmt, quality=80, force=False):
+    """
+    Write `source` resized to `width` pixels wide (never upscaled) to
+    `target` in format `fmt`, unless an up-to-date rendition exists.
+    Returns True if a file was written.
+    """
+    if not force:
+        try:
+            if os.path.getmtime(target) >= os.path.getmtime(source):
+                return False
+        except FileNotFoundError:
+            pass
+
+    with Image.open(source) as image:
+        image = ImageOps.exif_transpose(image)
+        if image.width > width:
+            height = max(1, round(image.height * width / image.width))
+            image = image.resize((width, height), Image.LANCZOS)
+
+        pil_format = THUMBNAIL_FORMATS[fmt][0]
+        if pil_format == 'JPEG':
+            image = image.convert('RGB')
+        elif image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA' if 'A' in image.getbands() or 'transparency' in image.info else 'RGB')
+
+        # Written next to the target and renamed into place, so concurrent
+        # requests never serve a partial file
+        directory = os.path.dirname(target)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.thumb-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                image.save(f, pil_format, quality=quality, optimize=True)
+            os.replace(tmp_path, target)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+    return True
+
+
+def get_thumbnail(name, width, fmt):
+    """
+    Path of the rendition of image `name`, generating it if needed. Raises
+    FileNotFoundError for missing sources and SuspiciousFileOperation for
+    names that aren't poster images (see poster_source_path).
+    """
+    if width not in thumbnail_widths() or fmt not in THUMBNAIL_FORMATS:
+        raise SuspiciousFileOperation(f"Unsupported rendition {width}/{fmt}")
+    source = poster_source_path(name)
+    target = rendition_path(name, width, fmt)
+    render_rendition(source, target, width, fmt, quality=settings.MOVIE_THUMBNAIL_QUALITY)
+    return target
+
+
+def srcset(name, fmt):
+    """`srcset` attribute value listing every width of image `name`"""
+    return ', '.join(f'{thumbnail_url(name, width, fmt)} {width}w' for width in thumbnail_widths())
@@ -0,0 +1,133 @@
+"""
+In-memory fuzzy title matcher for the bulk update commands.
+
+Built once per run from (title, value) pairs, e.g. movie titles and ids or
+image file names. Each lookup then costs one dictionary probe plus a scan
+of the postings of its own trigrams, instead of one or more database
+queries or a scan over every title:
+
+* titles are normalized (see normalize_title_for_matching) and matched
+  exactly first;
+* otherwise candidates sharing character trigrams are scored, and the best
+  one above `min_score` wins.
+
+A candidate's score is the larger of:
+* its trigram Jaccard similarity to the query, which covers typos and
+  small differences;
+* its containment, meaning the share of the shorter title's trigrams found
+  in the longer one. This covers one title inside the other, as in
+  "Batman" vs "The Lego Batman Movie".
+
+Ties are broken by Jaccard similarity, then closeness in length, then
+normalized title, then insertion order, so results never depend on hash
+or database ordering.
+"""
+import re
+import unicodedata
+from collections import defaultdict, namedtuple
+
+# Below this many trigrams (words of about 3 letters), the shorter title is
+# too short for containment to mean anything
+MIN_CONTAINED_TRIGRAMS = 5
+DEFAULT_MIN_SCORE = 0.6
+
+TitleMatch = namedtuple('TitleMatch', ['value', 'title', 'score', 'exact'])
+
+
+def normalize_title_for_matching(title_str):
+    # Lowercase
+    s = title_str.lower()
+    # Replace specific problematic characters with space
+    s = re.sub(r'[:&?]', ' ', s)
+    # Remove other characters that are not alphanumeric, space, or hyphen
+    s = re.sub(r'[^\w\s-]', '', s)
+    # Collapse multiple spaces/hyphens into a single space and strip
+    s = re.sub(r'[\s-]+', ' ', s).strip()
+    return s
+
+
+def trigrams(key):
+    """
+    Character trigrams of each word, padded like PostgreSQL's pg_trgm.
+    Accents are dropped first, so "amelie" still matches "amélie".
+    """
+    folded = ''.join(c for c in unicodedata.normalize('NFKD', key) if not unicodedata.combining(c))
+    grams = set()
+    for word in folded.split():
+        padded = f'  {word} '
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+class TitleIndex:
+    def __init__(self, items=(), min_score=DEFAULT_MIN_SCORE):
+        self.min_score = min_score
+        # Entry number -> (normalized key, original title, value, trigram set)
+        self._entries = []
+        # Normalized key -> first entry number with that key
+        self._exact = {}
+        # Trigram -> entry numbers containing it
+        self._postings = defaultdict(list)
+        for title, value in items:
+            self.add(title, value)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def add(self, title, value):
+        """Index `value` under `title`; titles that normalize to nothing are ignored"""
+        key = normalize_title_for_matching(title or '')
+        if not key:
+            return
+        number = len(self._entries)
+        grams = trigrams(key)
+        self._entries.append((key, title, value, grams))
+        self._exact.setdefault(key, number)
+        for gram in grams:
+            self._postings[gram].append(number)
+
+    def exact(self, title):
+        """TitleMatch for a title with the same normalized form, or None"""
+        number = self._exact.get(normalize_title_for_matching(title or ''))
+        if number is None:
+            return None
+        _, original, value, _ = self._entries[number]
+        return TitleMatch(value, original, 1.0, True)
+
+    def best_match(self, title, min_score=None):
+        """Highest-scoring fuzzy TitleMatch at or above min_score, or None"""
+        if min_score is None:
+            min_score = self.min_score
+        key = normalize_title_for_matching(title or '')
+        grams = trigrams(key)
+        if not grams:
+            return None
+
+        shared = defaultdict(int)
+        for gram in grams:
+            for number in self._postings.get(gram, ()):
+                shared[number] += 1
+
+        best = None
+        best_rank = None
+        for number, common in shared.items():
+            candidate_key, original, value, candidate_grams = self._entries[number]
+            jaccard = common / (len(grams) + len(candidate_grams) - common)
+            smaller = min(len(grams), len(candidate_grams))
+            containment = common / smaller if smaller >= MIN_CONTAINED_TRIGRAMS else 0.0
+            score = max(jaccard, containment)
+            if score < min_score:
+                continue
+            # Higher rank wins; equal ranks go to the smaller normalized
+            # title, then to the entry added first
+            rank = (score, jaccard, -abs(len(candidate_key) - len(key)))
+            if best is None or rank > best_rank or (
+                rank == best_rank and (candidate_key, number) < (best[0], best[1])
+            ):
+                best = (candidate_key, number, TitleMatch(value, original, score, False))
+                best_rank = rank
+        return best[2] if best else None
+
+    def match(self, title, min_score=None):
+        """Exact normalized match if there is one, otherwise the best fuzzy match"""
+        return self.exact(title) or self.best_match(title, min_score)
@@ -1,46 +1,54 @@
 from django.shortcuts import render, get_object_or_404, redirect
 from django.shortcuts import render
-from .models import Movie
-import matplotlib
-import matplotlib.pyplot as plt
-import io
-import urllib, base64
+from .models import Genre, Movie, SimilarMovie
+from .catalog import get_catalog_version
+from .page_cache import cache_page_for, cached_fragment
+from .pagination import InvalidCursor, KeysetPaginator
+from .search import search_movies
+from .statistics import CHART_CACHE_TIMEOUT, CHARTS, get_chart_png
+from .thumbnails import THUMBNAIL_FORMATS, get_thumbnail
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse
+from PIL import UnidentifiedImageError
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import etag
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.forms import UserCreationForm, AuthenticationForm
+from django.conf import settings
 from django.contrib import messages
-from django.db.models import Count
+from django.db.models import Count, Exists, OuterRef
 from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
 
+# Query parameters home() reads; any other parameter bypasses the page cache
+HOME_PARAMS = ('searchMovie', 'genre', 'sort', 'page', 'cursor')
+
+@cache_page_for('movie', params=HOME_PARAMS)
 def home(request):
     searchTerm = request.GET.get('searchMovie')
     genre_filter = request.GET.get('genre')
     sort_by = request.GET.get('sort', 'default')  # Default sorting
     
-    # Base queryset with default ordering to avoid pagination warning
-    movies = Movie.objects.all().order_by('id')
+    # Base queryset with default ordering to avoid pagination warning; only
+    # the columns the cards render are loaded
+    movies = Movie.objects.for_listing().order_by('id')
     
-    # Apply search filter if provided
+    # Apply search filter if provided (full-text, most relevant first)
     if searchTerm:
-        movies = movies.filter(title__icontains=searchTerm)
-    
-    # Extract individual genres from the combined genre strings
-    all_genre_strings = Movie.objects.exclude(genre__isnull=True).exclude(genre='').values_list('genre', flat=True)
-    unique_genres = set()
-    
-    for genre_string in all_genre_strings:
-        if genre_string:
-            # Split by comma and remove leading/trailing whitespace
-            individual_genres = [g.strip() for g in genre_string.split(',')]
-            for genre in individual_genres:
-                if genre:
-                    unique_genres.add(genre)
+        movies = search_movies(searchTerm, movies)
     
-    # Sort genres alphabetically
-    available_genres = sorted(list(unique_genres))
+    # Genres that have at least one movie, from the normalized genre table
+    # (cached until the catalog changes)
+    genre_rows = cached_fragment('home_genres', lambda: list(
+        Genre.objects.filter(Exists(Movie.genres.through.objects.filter(genre_id=OuterRef('pk'))))
+        .order_by('name')
+        .values_list('id', 'name')
+    ))
+    available_genres = [name for _, name in genre_rows]
     
-    # Apply genre filter if provided
+    # Apply genre filter if provided (an indexed join instead of a substring match)
     if genre_filter and genre_filter.lower() != 'all':
-        movies = movies.filter(genre__icontains=genre_filter)
+        genre_ids = [genre_id for genre_id, name in genre_rows if name.lower() == genre_filter.lower()]
+        movies = movies.filter(genres__in=genre_ids)
     
     # Apply sorting
     if sort_by == 'title_asc':
@@ -49,11 +57,39 @@ def home(request):
         movies = movies.order_by('-year')
     elif sort_by == 'year_asc':
         movies = movies.order_by('year')
-    # Default ordering is by id which was set at the beginning
+    elif sort_by == 'rating_desc':
+        # Served by the (rating_avg, id) index
+        movies = movies.order_by('-rating_avg', '-id')
+    # Default ordering is by relevance when searching, otherwise by id
+    
+    movies_per_page = 12  # Adjust this number as needed
+    
+    # Keyset pagination: constant cost per page, previous/next only. Used when
+    # a cursor is passed or it is the configured mode, except for relevance-ordered
+    # search results, which have no stable sort key
+    cursor = request.GET.get('cursor')
+    use_cursor = (cursor is not None or settings.MOVIES_PAGINATION == 'keyset') and not (
+        searchTerm and sort_by not in ('title_asc', 'year_desc', 'year_asc', 'rating_desc')
+    )
+    if use_cursor:
+        paginator = KeysetPaginator(movies, movies_per_page, sort_by)
+        try:
+            paginated_movies = paginator.page(cursor)
+        except InvalidCursor:
+            # Stale or tampered cursor, start from the first page
+            paginated_movies = paginator.page()
+        
+        return render(request, 'home.html', {
+            'searchTerm': searchTerm,
+            'movies': paginated_movies,
+            'cursor_pagination': True,
+            'current_genre': genre_filter,
+            'available_genres': available_genres,
+            'current_sort': sort_by
+        })
     
     # Pagination
     page = request.GET.get('page', 1)
-    movies_per_page = 12  # Adjust this number as needed
     paginator = Paginator(movies, movies_per_page)
     
     try:
@@ -73,87 +109,56 @@ def home(request):
         'current_sort': sort_by
     })
 
+@cache_page_for()
 def about(request):
     return render(request, 'about.html')
 
+@cache_page_for('movie')
 def movie_detail(request, movie_id):
     movie = get_object_or_404(Movie, pk=movie_id)
-    return render(request, 'movie_detail.html', {'movie': movie})
+    # Precomputed by `manage.py compute_similar_movies`; one indexed query,
+    # run only when the template's cached fragment is missing
+    similar_movies = (
+        SimilarMovie.objects.filter(movie_id=movie.id)
+        .select_related('similar')
+        .only('rank', 'similar', 'similar__title', 'similar__year', 'similar__image', 'similar__image_ok',
+              'similar__image_width', 'similar__image_height')
+        .order_by('rank')
+    )
+    return render(request, 'movie_detail.html', {
+        'movie': movie,
+        'similar_movies': similar_movies,
+        'catalog_version': get_catalog_version(),
+        'fragment_cache_timeout': settings.PAGE_CACHE_TIMEOUT,
+    })
 
 def statistics_view(request):
-    matplotlib.use('Agg')  # Backend para generar gráfica sin interfaz
-
-    # OBTENER TODAS LAS PELÍCULAS
-    all_movies = Movie.objects.all()
-
-    # CONTAR PELÍCULAS POR AÑO
-    movie_counts_by_year = {}
-
-    for mv in all_movies:
-        yr = mv.year if mv.year else "None"
-        if yr in movie_counts_by_year:
-            movie_counts_by_year[yr] += 1
-        else:
-            movie_counts_by_year[yr] = 1
-
-    # GRÁFICA DE BARRAS - PELÍCULAS POR AÑO
-    plt.figure(figsize=(10, 6))
-    bar_positions = range(len(movie_counts_by_year))
-    plt.bar(bar_positions, movie_counts_by_year.values(), width=0.5, align='center')
-    plt.title('Movies per year')
-    plt.xlabel('Year')
-    plt.ylabel('Number of movies')
-    plt.xticks(bar_positions, movie_counts_by_year.keys(), rotation=90)
-    plt.subplots_adjust(bottom=0.3)
-
-    # GUARDAR EN MEMORIA - GRÁFICA POR AÑO
-    buffer = io.BytesIO()
-    plt.savefig(buffer, format='png')
-    buffer.seek(0)
-    plt.close()
-
-    # CONVERTIR A BASE64 - GRÁFICA POR AÑO
-    image_png = buffer.getvalue()
-    buffer.close()
-    graphic_year = base64.b64encode(image_png)
-    graphic_year = graphic_year.decode('utf-8')
-
-    # CONTAR PELÍCULAS POR GÉNERO
-    movie_counts_by_genre = {}
-
-    for mv in all_movies:
-        genre = mv.genre if mv.genre else "Unknown"
-        if genre in movie_counts_by_genre:
-            movie_counts_by_genre[genre] += 1
-        else:
-            movie_counts_by_genre[genre] = 1
-
-    # GRÁFICA DE BARRAS - PELÍCULAS POR GÉNERO
-    plt.figure(figsize=(12, 6))
-    bar_positions = range(len(movie_counts_by_genre))
-    plt.bar(bar_positions, movie_counts_by_genre.values(), width=0.5, align='center', color='green')
-    plt.title('Movies per genre')
-    plt.xlabel('Genre')
-    plt.ylabel('Number of movies')
-    plt.xticks(bar_positions, movie_counts_by_genre.keys(), rotation=45)
-    plt.subplots_adjust(bottom=0.3)
+    # The charts themselves are served (and cached) by statistics_chart;
+    # the version in their URL changes whenever the catalog does
+    return render(request, 'statistics.html', {
+        'catalog_version': get_catalog_version(),
+    })
 
-    # GUARDAR EN MEMORIA - GRÁFICA POR GÉNERO
-    buffer = io.BytesIO()
-    plt.savefig(buffer, format='png')
-    buffer.seek(0)
-    plt.close()
+def _chart_etag(request, chart):
+    return f'{chart}-{get_catalog_version()}'
 
-    # CONVERTIR A BASE64 - GRÁFICA POR GÉNERO
-    image_png = buffer.getvalue()
-    buffer.close()
-    graphic_genre = base64.b64encode(image_png)
-    graphic_genre = graphic_genre.decode('utf-8')
+@etag(_chart_etag)
+def statistics_chart(request, chart):
+    if chart not in CHARTS:
+        raise Http404("Unknown chart")
+    response = HttpResponse(get_chart_png(chart), content_type='image/png')
+    patch_cache_control(response, public=True, max_age=CHART_CACHE_TIMEOUT)
+    return response
 
-    return render(request, 'statistics.html', {
-        'graphic_year': graphic_year,
-        'graphic_genre': graphic_genre
-    })
+def movie_thumbnail(request, width, fmt, name):
+    # Resized poster, generated on first request and cached on disk
+    try:
+        path = get_thumbnail(name, width, fmt)
+    except (FileNotFoundError, IsADirectoryError, SuspiciousFileOperation, UnidentifiedImageError):
+        raise Http404("No such image")
+    response = FileResponse(open(path, 'rb'), content_type=THUMBNAIL_FORMATS[fmt][1])
+    patch_cache_control(response, public=True, max_age=settings.MOVIE_THUMBNAIL_CACHE_TIMEOUT)
+    return response
 
 def signup_view(request):
     if request.method == 'POST':
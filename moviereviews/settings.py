@@ -25,9 +25,9 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 SECRET_KEY = os.environ.get('DJANGO_SECRET_KEY', 'django-insecure-04uw%2=@6trgveh0n4*=!#lrjyuk9@2r%g%x!q7u^=!_#%ez4u')
 
 # SECURITY WARNING: don't run with debug turned on in production!
-# Fetch DEBUG from environment variable, defaulting to False
-# DEBUG = os.environ.get('DJANGO_DEBUG', 'False') == 'True'
-DEBUG = True # Temporarily set to True for development media serving
+# Fetch DEBUG from environment variable. It defaults to True for development media
+# serving; set DJANGO_DEBUG=False in production.
+DEBUG = os.environ.get('DJANGO_DEBUG', 'True') == 'True'
 
 # Fetch ALLOWED_HOSTS from environment variable, defaulting to localhost and a common DO app pattern
 # For production, this should be a comma-separated string like "myapp.ondigitalocean.app,www.myapp.ondigitalocean.app"
@@ -68,13 +68,18 @@ MIDDLEWARE = [
 
 ROOT_URLCONF = 'moviereviews.urls'
 
+# Loaders that find templates on disk; TEMPLATES wraps them in the cached loader
+BASE_TEMPLATE_LOADERS = [
+    'django.template.loaders.filesystem.Loader',
+    'django.template.loaders.app_directories.Loader',
+]
+
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
         'DIRS': [
             os.path.join(BASE_DIR, 'moviereviews', 'templates'),
         ],
-        'APP_DIRS': True,
         'OPTIONS': {
             'context_processors': [
                 'django.template.context_processors.debug',
@@ -82,6 +87,12 @@ TEMPLATES = [
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
             ],
+            # Templates are parsed once per process and kept compiled. Set
+            # DJANGO_TEMPLATE_CACHE=False to re-read them on every render instead
+            # (with DEBUG on, the autoreloader already clears the cache on changes).
+            'loaders': [
+                ('django.template.loaders.cached.Loader', BASE_TEMPLATE_LOADERS),
+            ] if os.environ.get('DJANGO_TEMPLATE_CACHE', 'True') == 'True' else BASE_TEMPLATE_LOADERS,
         },
     },
 ]
@@ -107,6 +118,41 @@ else:
     }
 
 
+# Cache
+# CACHE_BACKEND selects where cached pages, fragments and charts live:
+#   'locmem' - per process (default; each worker renders and stores its own copy)
+#   'file'   - shared by the processes of one host, under CACHE_DIR
+#   'redis'  - shared by every host, at REDIS_URL
+# Whatever the backend, writes from any process (including management commands) invalidate
+# them at once: the catalog version stamps in their keys live in the database (movie.catalog).
+CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'locmem')
+
+if CACHE_BACKEND == 'redis':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ.get('REDIS_URL', 'redis://127.0.0.1:6379/0'),
+        }
+    }
+elif CACHE_BACKEND == 'file':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.environ.get('CACHE_DIR', os.path.join(BASE_DIR, '.django_cache')),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# Seconds anonymous pages and page fragments stay cached (see movie.page_cache); 0 disables them.
+# Movie and News writes invalidate them immediately.
+PAGE_CACHE_TIMEOUT = int(os.environ.get('PAGE_CACHE_TIMEOUT', '300'))
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -155,3 +201,37 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 MEDIA_URL = '/media/'
+
+# Poster renditions (see movie.thumbnails): widths in pixels, output directory, quality and
+# browser cache lifetime (seconds) of the thumbnail responses. The output directory must not
+# be inside MEDIA_ROOT, so renditions are never themselves served as media or used as sources.
+MOVIE_THUMBNAIL_WIDTHS = [int(width) for width in os.environ.get('MOVIE_THUMBNAIL_WIDTHS', '240,480,960').split(',')]
+MOVIE_THUMBNAIL_ROOT = os.environ.get('MOVIE_THUMBNAIL_ROOT', os.path.join(BASE_DIR, 'thumbnails'))
+MOVIE_THUMBNAIL_QUALITY = int(os.environ.get('MOVIE_THUMBNAIL_QUALITY', '80'))
+MOVIE_THUMBNAIL_CACHE_TIMEOUT = int(os.environ.get('MOVIE_THUMBNAIL_CACHE_TIMEOUT', str(24 * 3600)))
+
+# Movie listing pagination: 'offset' (numbered pages) or 'keyset' (previous/next cursors,
+# constant cost per page). Passing ?cursor= selects keyset pagination for a single request.
+MOVIES_PAGINATION = os.environ.get('MOVIES_PAGINATION', 'offset')
+
+# Recommendations
+# Seconds between checks for recomputed embeddings by the recommendation indexes (0 = check on
+# every query). Each check is an aggregate over the movie table, shared by all indexes of a process.
+RECOMMENDATIONS_INDEX_CHECK_INTERVAL = float(os.environ.get('RECOMMENDATIONS_INDEX_CHECK_INTERVAL', '30'))
+# Longest ranking kept per prompt, and how long (seconds) it is reused for later pages
+RECOMMENDATIONS_MAX_RESULTS = int(os.environ.get('RECOMMENDATIONS_MAX_RESULTS', '100'))
+RECOMMENDATIONS_RANKING_TTL = int(os.environ.get('RECOMMENDATIONS_RANKING_TTL', '600'))
+# Prompt-embedding cache: in-process LRU size, TTL (seconds) and size of the shared database tier
+RECOMMENDATIONS_PROMPT_CACHE_SIZE = int(os.environ.get('RECOMMENDATIONS_PROMPT_CACHE_SIZE', '1024'))
+RECOMMENDATIONS_PROMPT_CACHE_TTL = int(os.environ.get('RECOMMENDATIONS_PROMPT_CACHE_TTL', str(7 * 24 * 3600)))
+RECOMMENDATIONS_PROMPT_CACHE_SHARED_SIZE = int(os.environ.get('RECOMMENDATIONS_PROMPT_CACHE_SHARED_SIZE', '50000'))
+# Approximate nearest-neighbour index built by `manage.py build_ann_index`. When enabled and the
+# file matches the stored embeddings, recommendations scan only the number of lists saved by
+# `build_ann_index --nprobe` instead of every movie. RECOMMENDATIONS_ANN_NPROBE overrides it if set.
+RECOMMENDATIONS_ANN_ENABLED = os.environ.get('RECOMMENDATIONS_ANN_ENABLED', 'False') == 'True'
+RECOMMENDATIONS_ANN_PATH = os.environ.get('RECOMMENDATIONS_ANN_PATH', os.path.join(BASE_DIR, 'indexes', 'movie_ann.npz'))
+RECOMMENDATIONS_ANN_NPROBE = int(os.environ['RECOMMENDATIONS_ANN_NPROBE']) if os.environ.get('RECOMMENDATIONS_ANN_NPROBE') else None
+# Directory of the memory-mapped embedding matrix written by `manage.py export_embeddings`. When
+# an export exists, every worker maps that one file instead of building a private in-memory copy.
+# An export older than the stored embeddings is ignored until export_embeddings runs again.
+RECOMMENDATIONS_EMBEDDINGS_DIR = os.environ.get('RECOMMENDATIONS_EMBEDDINGS_DIR', os.path.join(BASE_DIR, 'indexes', 'embeddings'))
@@ -12,6 +12,8 @@ urlpatterns = [
     path('news/', include('news.urls')),
     path('recommendations/', include('recommendations.urls')),
     path('statistics/', movieViews.statistics_view, name='statistics'),
+    path('statistics/chart/<str:chart>.png', movieViews.statistics_chart, name='statistics_chart'),
+    path('thumbnails/<int:width>/<str:fmt>/<path:name>', movieViews.movie_thumbnail, name='movie_thumbnail'),
     path('signup/', movieViews.signup_view, name='signup'),
     path('login/', movieViews.login_view, name='login'),
     path('logout/', movieViews.logout_view, name='logout'),
@@ -0,0 +1,13 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from movie.catalog import bump_catalog_version
+
+from .models import News
+
+
+@receiver(post_save, sender=News)
+@receiver(post_delete, sender=News)
+def news_changed(sender, **kwargs):
+    # Invalidates the cached news pages (see movie.page_cache)
+    bump_catalog_version('news')
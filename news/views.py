@@ -1,7 +1,16 @@
+from django.conf import settings
 from django.shortcuts import render
+from movie.catalog import get_catalog_version
+from movie.page_cache import cache_page_for
 from .models import News
 
+@cache_page_for('news')
 def news(request):
-    # Order by date in descending order
+    # Order by date in descending order; only queried when the template's
+    # cached fragment is missing
     all_news = News.objects.all().order_by('-date')
-    return render(request, 'news.html', {'news_list': all_news})
+    return render(request, 'news.html', {
+        'news_list': all_news,
+        'news_version': get_catalog_version('news'),
+        'fragment_cache_timeout': settings.PAGE_CACHE_TIMEOUT,
+    })
@@ -1,3 +1,11 @@
 from django.contrib import admin
+from .models import PromptEmbedding
 
-# Register your models here.
+
+@admin.register(PromptEmbedding)
+class PromptEmbeddingAdmin(admin.ModelAdmin):
+    list_display = ('prompt', 'model', 'hits', 'created_at')
+    list_filter = ('model',)
+    search_fields = ('prompt',)
+    readonly_fields = ('key', 'model', 'prompt', 'hits', 'created_at')
+    exclude = ('embedding',)
@@ -0,0 +1,285 @@
+"""
+Approximate nearest-neighbour search over movie embeddings for large catalogs.
+
+Implements an inverted-file (IVF) index in plain NumPy, CPU only:
+
+* training clusters the (L2-normalized) embeddings with spherical k-means,
+* every movie is filed under its closest centroid ("list"),
+* a query only scores the movies in the `nprobe` lists whose centroids are
+  closest to it, instead of the whole catalog.
+
+`nprobe` is the recall-vs-latency knob: 1 is fastest, `n_lists` is an exact
+(brute-force) search. Movies can be added or replaced incrementally without
+retraining, and the index is saved to / loaded from a single .npz file.
+"""
+import json
+import logging
+import os
+import tempfile
+import threading
+
+import numpy as np
+from django.conf import settings
+
+from . import embedding_index
+from .embedding_index import normalize_rows, serialize_version
+
+logger = logging.getLogger(__name__)
+
+# Rows scored per block when assigning vectors to centroids, to bound memory
+ASSIGN_BLOCK_SIZE = 8192
+
+
+def assign_to_centroids(vectors, centroids):
+    """Index of the most similar centroid for every (normalized) row"""
+    assignments = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), ASSIGN_BLOCK_SIZE):
+        block = vectors[start:start + ASSIGN_BLOCK_SIZE]
+        assignments[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+    return assignments
+
+
+def spherical_kmeans(vectors, n_clusters, iterations=20, seed=0):
+    """
+    k-means on the unit sphere (cosine similarity). Returns normalized centroids.
+    """
+    rng = np.random.default_rng(seed)
+    n_clusters = min(n_clusters, len(vectors))
+    centroids = vectors[rng.choice(len(vectors), n_clusters, replace=False)].copy()
+
+    for _ in range(iterations):
+        assignments = assign_to_centroids(vectors, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, vectors)
+        counts = np.bincount(assignments, minlength=n_clusters)
+
+        # Re-seed empty clusters with random points so no list stays unused
+        empty = np.flatnonzero(counts == 0)
+        if len(empty):
+            sums[empty] = vectors[rng.choice(len(vectors), len(empty), replace=False)]
+
+        new_centroids = normalize_rows(sums)
+        if np.allclose(new_centroids, centroids, atol=1e-5):
+            centroids = new_centroids
+            break
+        centroids = new_centroids
+
+    return centroids
+
+
+class IVFIndex:
+    """
+    Inverted-file index with cosine similarity scoring
+    """
+
+    def __init__(self, centroids, nprobe=8):
+        self.centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+        self.nprobe = nprobe
+        n_lists, dimensions = self.centroids.shape
+        self._list_ids = [np.empty(0, dtype=np.int64) for _ in range(n_lists)]
+        self._list_vectors = [np.empty((0, dimensions), dtype=np.float32) for _ in range(n_lists)]
+        # movie id -> list number, for replacing or removing entries
+        self._list_of = {}
+
+    @classmethod
+    def train(cls, vectors, n_lists=None, iterations=20, sample_size=None, nprobe=8, seed=0):
+        """
+        Cluster a (sample of the) vectors into `n_lists` lists. Defaults to
+        about sqrt(N) lists, the usual IVF sweet spot.
+        """
+        vectors = normalize_rows(np.array(vectors, dtype=np.float32))
+        if n_lists is None:
+            n_lists = max(1, int(np.sqrt(len(vectors))))
+        if sample_size is None:
+            # k-means needs a few dozen points per centroid, not the whole catalog
+            sample_size = 64 * n_lists
+        if len(vectors) > sample_size:
+            rng = np.random.default_rng(seed)
+            vectors = vectors[rng.choice(len(vectors), sample_size, replace=False)]
+        return cls(spherical_kmeans(vectors, n_lists, iterations, seed), nprobe=nprobe)
+
+    @property
+    def n_lists(self):
+        return len(self.centroids)
+
+    def __len__(self):
+        return len(self._list_of)
+
+    def __contains__(self, movie_id):
+        return int(movie_id) in self._list_of
+
+    def ids(self):
+        """Ids of every indexed movie, in no particular order"""
+        return list(self._list_of)
+
+    def remove(self, ids):
+        """Drop movies from the index (unknown ids are ignored)"""
+        by_list = {}
+        for movie_id in ids:
+            list_no = self._list_of.pop(int(movie_id), None)
+            if list_no is not None:
+                by_list.setdefault(list_no, set()).add(int(movie_id))
+        for list_no, removed in by_list.items():
+            keep = ~np.isin(self._list_ids[list_no], list(removed))
+            self._list_ids[list_no] = self._list_ids[list_no][keep]
+            self._list_vectors[list_no] = self._list_vectors[list_no][keep]
+
+    def add(self, ids, vectors):
+        """
+        Insert movies, replacing any already indexed under the same id. The
+        centroids are not retrained; rebuild occasionally if the catalog drifts.
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        if len(ids) == 0:
+            return
+        vectors = normalize_rows(np.array(vectors, dtype=np.float32))
+        self.remove(ids.tolist())
+
+        assignments = assign_to_centroids(vectors, self.centroids)
+        for list_no in np.unique(assignments):
+            members = assignments == list_no
+            self._list_ids[list_no] = np.concatenate([self._list_ids[list_no], ids[members]])
+            self._list_vectors[list_no] = np.concatenate([self._list_vectors[list_no], vectors[members]])
+        for movie_id, list_no in zip(ids.tolist(), assignments.tolist()):
+            self._list_of[movie_id] = list_no
+
+    def search(self, query_embedding, k, nprobe=None, min_score=None):
+        """
+        Return (movie_ids, similarities) of the approximately k most similar
+        movies, best first
+        """
+        query = np.asarray(query_embedding, dtype=np.float32).ravel()
+        norm = np.linalg.norm(query)
+        if norm == 0 or len(self) == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        query = query / norm
+
+        nprobe = min(nprobe or self.nprobe, self.n_lists)
+        centroid_scores = self.centroids @ query
+        if nprobe < self.n_lists:
+            probed = np.argpartition(-centroid_scores, nprobe - 1)[:nprobe]
+        else:
+            probed = np.arange(self.n_lists)
+
+        ids = np.concatenate([self._list_ids[list_no] for list_no in probed])
+        if len(ids) == 0:
+            return ids, np.empty(0, dtype=np.float32)
+        similarities = np.concatenate([self._list_vectors[list_no] for list_no in probed]) @ query
+
+        if min_score is not None:
+            keep = np.flatnonzero(similarities >= min_score)
+            ids, similarities = ids[keep], similarities[keep]
+        k = min(int(k), len(ids))
+        if k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        if k < len(ids):
+            candidates = np.argpartition(-similarities, k - 1)[:k]
+        else:
+            candidates = np.arange(len(ids))
+        order = candidates[np.argsort(-similarities[candidates], kind='stable')]
+        return ids[order], similarities[order]
+
+    def save(self, path, **metadata):
+        """
+        Write the index to `path` (.npz). The file is written next to the
+        target and renamed into place, so readers never see a partial file.
+        """
+        sizes = np.array([len(list_ids) for list_ids in self._list_ids], dtype=np.int64)
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.ann-', suffix='.npz')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(
+                    f,
+                    centroids=self.centroids,
+                    nprobe=np.array(self.nprobe),
+                    list_sizes=sizes,
+                    ids=np.concatenate(self._list_ids),
+                    vectors=np.concatenate(self._list_vectors),
+                    **{f'meta_{key}': np.array(value) for key, value in metadata.items()},
+                )
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    @classmethod
+    def load(cls, path):
+        """Return (index, metadata) read from a file written by save()"""
+        with np.load(path) as data:
+            index = cls(data['centroids'], nprobe=int(data['nprobe']))
+            offsets = np.concatenate([[0], np.cumsum(data['list_sizes'])])
+            ids, vectors = data['ids'], data['vectors']
+            for list_no in range(index.n_lists):
+                start, end = offsets[list_no], offsets[list_no + 1]
+                index._list_ids[list_no] = ids[start:end]
+                index._list_vectors[list_no] = vectors[start:end]
+                for movie_id in ids[start:end].tolist():
+                    index._list_of[movie_id] = list_no
+            metadata = {key[5:]: data[key].item() for key in data.files if key.startswith('meta_')}
+        return index, metadata
+
+
+class AnnEngine:
+    """
+    Serves queries from the index file written by `build_ann_index`, reloading
+    it when the file is replaced. Exposes the same top_k/version/len interface
+    as the in-memory EmbeddingIndex so the views can use either.
+
+    Queries scan the number of lists saved in the file unless
+    RECOMMENDATIONS_ANN_NPROBE (or `nprobe`) overrides it. The file records
+    stored_embeddings_version() at build time; like the memory-mapped export,
+    it is only available() while that still matches the database.
+    """
+
+    def __init__(self, path=None, nprobe=None, stored_version=None):
+        self.path = path or settings.RECOMMENDATIONS_ANN_PATH
+        self.nprobe = nprobe or settings.RECOMMENDATIONS_ANN_NPROBE
+        self.stored_version = stored_version if stored_version is not None else embedding_index.stored_version
+        self._lock = threading.Lock()
+        self._index = None
+        self._metadata = {}
+        self._stamp = None
+        # (file stamp, whether it matched the database) of the last check,
+        # so only changes are logged
+        self._last_match = None
+
+    def available(self):
+        """Whether the index file exists and was built from the embeddings stored now"""
+        if not self.path or not os.path.exists(self.path):
+            return False
+        _, metadata, stamp = self._current()
+        matches = metadata.get('db_version') == json.dumps(serialize_version(self.stored_version.get()))
+        if self._last_match != (stamp, matches):
+            if not matches:
+                logger.warning(f"ANN index {self.path} is out of date; run build_ann_index again")
+            self._last_match = (stamp, matches)
+        return matches
+
+    def _current(self):
+        stat = os.stat(self.path)
+        stamp = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+        if stamp != self._stamp:
+            with self._lock:
+                if stamp != self._stamp:
+                    self._index, self._metadata = IVFIndex.load(self.path)
+                    self._stamp = stamp
+                    logger.info(f"Loaded ANN index with {len(self._index)} movies from {self.path}")
+        return self._index, self._metadata, self._stamp
+
+    def __len__(self):
+        return len(self._current()[0])
+
+    @property
+    def version(self):
+        index, _, stamp = self._current()
+        return ('ann', stamp, self.nprobe or index.nprobe)
+
+    def top_k(self, query_embedding, k, min_score=None):
+        index = self._current()[0]
+        return index.search(query_embedding, k, nprobe=self.nprobe, min_score=min_score)
+
+
+ann_engine = AnnEngine()
@@ -0,0 +1,182 @@
+"""
+Two-tier cache in front of the OpenAI embeddings endpoint for user prompts.
+
+Repeated prompts like "World War II movie" are served from:
+
+1. an in-process LRU (bounded, TTL-evicting) for the hottest prompts, then
+2. the shared PromptEmbedding table, so every gunicorn worker benefits from
+   embeddings computed by the others.
+
+Only on a miss in both tiers is the API called. Entries are keyed by the
+normalized prompt text and the embedding model name.
+"""
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+
+import numpy as np
+from django.conf import settings
+from django.db import IntegrityError
+from django.db.models import F
+from django.utils import timezone
+
+from .models import PromptEmbedding
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_prompt(prompt):
+    """Case- and whitespace-insensitive form of a prompt used for cache keys"""
+    return ' '.join(prompt.lower().split())
+
+
+def cache_key(prompt, model):
+    return hashlib.sha256(f'{model}\n{normalize_prompt(prompt)}'.encode('utf-8')).hexdigest()
+
+
+class PromptEmbeddingCache:
+    """
+    In-process LRU backed by the shared PromptEmbedding table
+    """
+
+    def __init__(self, max_entries=None, ttl=None, shared_max_entries=None):
+        if max_entries is None:
+            max_entries = settings.RECOMMENDATIONS_PROMPT_CACHE_SIZE
+        if ttl is None:
+            ttl = settings.RECOMMENDATIONS_PROMPT_CACHE_TTL
+        if shared_max_entries is None:
+            shared_max_entries = settings.RECOMMENDATIONS_PROMPT_CACHE_SHARED_SIZE
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.shared_max_entries = shared_max_entries
+        self._entries = OrderedDict()  # key -> (embedding, expires_at)
+        self._lock = threading.Lock()
+        self._stats = {'local_hits': 0, 'shared_hits': 0, 'misses': 0}
+        self._inserts_since_prune = 0
+
+    def _count(self, name):
+        # Requests are served from several threads; += on a dict item is not atomic
+        with self._lock:
+            self._stats[name] += 1
+
+    # -- in-process tier -------------------------------------------------
+
+    def _get_local(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            embedding, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return embedding
+
+    def _set_local(self, key, embedding):
+        with self._lock:
+            self._entries[key] = (embedding, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    # -- shared tier -----------------------------------------------------
+
+    def _get_shared(self, key):
+        row = PromptEmbedding.objects.filter(key=key).values_list('embedding', 'created_at').first()
+        if row is None:
+            return None
+        embedding, created_at = row
+        if created_at < timezone.now() - timedelta(seconds=self.ttl):
+            PromptEmbedding.objects.filter(key=key).delete()
+            return None
+        PromptEmbedding.objects.filter(key=key).update(hits=F('hits') + 1)
+        return embedding
+
+    def _set_shared(self, key, prompt, model, embedding):
+        try:
+            PromptEmbedding.objects.update_or_create(
+                key=key,
+                defaults={
+                    'model': model,
+                    'prompt': normalize_prompt(prompt),
+                    'embedding': embedding,
+                    'created_at': timezone.now(),
+                },
+            )
+        except IntegrityError:
+            # Another worker stored the same prompt at the same moment
+            return
+
+        with self._lock:
+            self._inserts_since_prune += 1
+            due = self._inserts_since_prune >= 100
+            if due:
+                self._inserts_since_prune = 0
+        if due:
+            self.prune()
+
+    def prune(self):
+        """Delete expired rows and the oldest rows beyond the shared size bound"""
+        PromptEmbedding.objects.filter(created_at__lt=timezone.now() - timedelta(seconds=self.ttl)).delete()
+        stale_ids = list(
+            PromptEmbedding.objects.order_by('-created_at').values_list('id', flat=True)[self.shared_max_entries:]
+        )
+        if stale_ids:
+            PromptEmbedding.objects.filter(id__in=stale_ids).delete()
+
+    # -- public API ------------------------------------------------------
+
+    def get_or_compute(self, prompt, model, compute):
+        """
+        Return the cached embedding for (prompt, model), calling compute() and
+        storing its result in both tiers on a miss
+        """
+        key = cache_key(prompt, model)
+
+        embedding = self._get_local(key)
+        if embedding is not None:
+            self._count('local_hits')
+            return embedding
+
+        try:
+            embedding = self._get_shared(key)
+        except Exception as e:
+            # The shared tier is an optimization; never fail a request over it
+            logger.warning(f"Prompt embedding cache lookup failed: {str(e)}")
+            embedding = None
+        if embedding is not None:
+            self._count('shared_hits')
+            self._set_local(key, embedding)
+            return embedding
+
+        self._count('misses')
+        embedding = np.asarray(compute(), dtype=np.float32)
+        self._set_local(key, embedding)
+        try:
+            self._set_shared(key, prompt, model, embedding)
+        except Exception as e:
+            logger.warning(f"Could not store prompt embedding in the shared cache: {str(e)}")
+        return embedding
+
+    def stats(self):
+        """Hit/miss counters for this process, plus the resulting hit rate"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['local_entries'] = len(self._entries)
+        lookups = stats['local_hits'] + stats['shared_hits'] + stats['misses']
+        stats['hit_rate'] = (stats['local_hits'] + stats['shared_hits']) / lookups if lookups else 0.0
+        return stats
+
+    def clear(self):
+        """Empty the in-process tier and reset the counters"""
+        with self._lock:
+            self._entries.clear()
+            self._stats = {'local_hits': 0, 'shared_hits': 0, 'misses': 0}
+
+
+# Shared by every request handled by this process
+prompt_embedding_cache = PromptEmbeddingCache()
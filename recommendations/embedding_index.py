@@ -0,0 +1,295 @@
+"""
+Process-wide in-memory index over the precomputed movie embeddings.
+
+Instead of loading every Movie row and comparing vectors one by one in Python,
+the index keeps all stored embeddings as a single L2-normalized float32 matrix
+(one row per movie) plus the matching array of movie ids. Scoring a prompt is
+then a single matrix-vector product.
+
+The index is built lazily on first use and rebuilt automatically whenever the
+stored embeddings change (detected through the number of embedded movies and
+the latest `embedding_updated_at`). That check is an aggregate over the movie
+table, so it runs at most once every RECOMMENDATIONS_INDEX_CHECK_INTERVAL
+seconds per process, shared by every index (see StoredVersion).
+"""
+import json
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+from django.conf import settings
+from django.db.models import Count, Max
+
+from movie.models import Movie
+
+logger = logging.getLogger(__name__)
+
+
+def stored_embeddings_version():
+    """
+    Cheap aggregate over the stored embeddings that changes whenever they
+    change: (number of embedded movies, latest embedding_updated_at, max id)
+    """
+    stats = Movie.objects.exclude(embedding__isnull=True).aggregate(
+        count=Count('id'),
+        latest=Max('embedding_updated_at'),
+        max_id=Max('id'),
+    )
+    return (stats['count'], stats['latest'], stats['max_id'])
+
+
+def serialize_version(version):
+    """stored_embeddings_version() as a JSON-compatible list"""
+    count, latest, max_id = version
+    return [count, latest.isoformat() if latest else None, max_id]
+
+
+class StoredVersion:
+    """
+    stored_embeddings_version(), read from the database at most once every
+    `check_interval` seconds (0 = on every call)
+    """
+
+    def __init__(self, check_interval=None):
+        if check_interval is None:
+            check_interval = settings.RECOMMENDATIONS_INDEX_CHECK_INTERVAL
+        self.check_interval = check_interval
+        # (monotonic time, version) of the last read
+        self._checked = None
+
+    def get(self):
+        checked = self._checked
+        now = time.monotonic()
+        if checked is not None and now - checked[0] < self.check_interval:
+            return checked[1]
+        version = stored_embeddings_version()
+        self._checked = (now, version)
+        return version
+
+    def invalidate(self):
+        """Make the next get() read the database"""
+        self._checked = None
+
+
+def normalize_rows(matrix):
+    """L2-normalize each row of a 2D float32 matrix in place and return it"""
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    # Zero vectors stay zero instead of turning into NaNs
+    norms[norms == 0] = 1.0
+    matrix /= norms
+    return matrix
+
+
+class EmbeddingIndex:
+    """
+    Lazily built, self-invalidating cosine-similarity index over Movie.embedding
+    """
+
+    def __init__(self, check_interval=None, stored_version=None):
+        # Seconds between staleness checks against the database (0 = every
+        # query). Indexes given the same StoredVersion share its checks.
+        if stored_version is None:
+            stored_version = StoredVersion(check_interval)
+        self.stored_version = stored_version
+        self.check_interval = stored_version.check_interval
+        self._lock = threading.Lock()
+        # (matrix, ids, version) swapped as one object so readers never see
+        # a matrix paired with the ids of a different build
+        self._state = None
+        self._checked_at = 0.0
+
+    def __len__(self):
+        return len(self._ensure_fresh()[1])
+
+    @staticmethod
+    def _movies_with_embeddings():
+        return Movie.objects.exclude(embedding__isnull=True)
+
+    def _current_version(self):
+        return self.stored_version.get()
+
+    def _build(self):
+        """Load every stored embedding into one normalized matrix"""
+        start = time.perf_counter()
+        ids = []
+        vectors = []
+        dimensions = None
+
+        rows = self._movies_with_embeddings().values_list('id', 'embedding')
+        for movie_id, embedding in rows.iterator(chunk_size=2000):
+            if embedding is None or len(embedding) == 0:
+                continue
+            if dimensions is None:
+                dimensions = len(embedding)
+            elif len(embedding) != dimensions:
+                logger.warning(f"Skipping movie {movie_id}: embedding has {len(embedding)} dimensions, expected {dimensions}")
+                continue
+            ids.append(movie_id)
+            vectors.append(embedding)
+
+        if vectors:
+            # Stored vectors are read-only views over the row bytes; stacking
+            # them is the only copy made
+            matrix = normalize_rows(np.vstack(vectors).astype(np.float32, copy=False))
+        else:
+            matrix = np.empty((0, 0), dtype=np.float32)
+
+        logger.info(f"Built embedding index with {len(ids)} movies in {time.perf_counter() - start:.3f}s")
+        return matrix, np.asarray(ids, dtype=np.int64)
+
+    def _ensure_fresh(self):
+        """Return the current (matrix, ids, version), rebuilding it if stale"""
+        state = self._state
+        now = time.monotonic()
+        if state is not None and now - self._checked_at < self.check_interval:
+            return state
+
+        version = self._current_version()
+        if state is not None and version == state[2]:
+            self._checked_at = now
+            return state
+
+        with self._lock:
+            # Another thread may have rebuilt the index while we were waiting
+            state = self._state
+            if state is None or version != state[2]:
+                matrix, ids = self._build()
+                state = (matrix, ids, version)
+                self._state = state
+            self._checked_at = now
+        return state
+
+    @property
+    def version(self):
+        """Opaque stamp that changes whenever the index is rebuilt from new data"""
+        return self._ensure_fresh()[2]
+
+    def invalidate(self):
+        """Drop the in-memory matrix so the next query rebuilds it"""
+        with self._lock:
+            self._state = None
+        self.stored_version.invalidate()
+
+    def scores(self, query_embedding):
+        """
+        Return (movie_ids, cosine_similarities) for every indexed movie
+        """
+        matrix, ids, _ = self._ensure_fresh()
+        if len(ids) == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+        query = np.asarray(query_embedding, dtype=np.float32).ravel()
+        if query.shape[0] != matrix.shape[1]:
+            raise ValueError(f"Query embedding has {query.shape[0]} dimensions, index has {matrix.shape[1]}")
+        norm = np.linalg.norm(query)
+        if norm == 0:
+            return ids, np.zeros(len(ids), dtype=np.float32)
+        return ids, matrix @ (query / norm)
+
+    def best_match(self, query_embedding):
+        """
+        Return (movie_id, similarity) of the most similar movie, or None if
+        no movie has an embedding yet
+        """
+        ids, similarities = self.scores(query_embedding)
+        if len(ids) == 0:
+            return None
+        best = int(np.argmax(similarities))
+        return int(ids[best]), float(similarities[best])
+
+    def top_k(self, query_embedding, k, min_score=None):
+        """
+        Return (movie_ids, similarities) of the k most similar movies, best
+        first, optionally dropping anything below min_score.
+
+        Uses argpartition so only the k winners are sorted instead of the
+        whole catalog.
+        """
+        ids, similarities = self.scores(query_embedding)
+        if min_score is not None:
+            keep = np.flatnonzero(similarities >= min_score)
+            ids, similarities = ids[keep], similarities[keep]
+
+        k = min(int(k), len(ids))
+        if k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        if k < len(ids):
+            candidates = np.argpartition(-similarities, k - 1)[:k]
+        else:
+            candidates = np.arange(len(ids))
+        order = candidates[np.argsort(-similarities[candidates], kind='stable')]
+        return ids[order], similarities[order]
+
+
+MANIFEST_NAME = 'manifest.json'
+
+
+def read_manifest(directory):
+    """Return the manifest written by `export_embeddings`, or None if there is none"""
+    try:
+        with open(os.path.join(directory, MANIFEST_NAME), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+class MemmapEmbeddingIndex(EmbeddingIndex):
+    """
+    EmbeddingIndex backed by the normalized matrix exported to disk by
+    `manage.py export_embeddings`.
+
+    The matrix is opened with np.load(mmap_mode='r'), so every gunicorn worker
+    maps the same file and shares the OS page cache instead of each holding a
+    private copy. Re-exports swap the manifest atomically; the index follows
+    the manifest and remaps the new files on the next query.
+
+    The manifest records stored_embeddings_version() at export time. Until
+    the export is redone, any later change to the stored embeddings makes
+    available() false (noticed within one check interval), so the exact
+    in-memory index is used instead of stale data.
+    """
+
+    def __init__(self, directory=None, check_interval=None, stored_version=None):
+        super().__init__(check_interval=check_interval, stored_version=stored_version)
+        self.directory = directory or settings.RECOMMENDATIONS_EMBEDDINGS_DIR
+        # (export version, whether it matched the database) of the last check,
+        # so only changes are logged
+        self._last_match = None
+
+    def available(self):
+        """Whether an export exists and was made from the embeddings stored now"""
+        if not self.directory:
+            return False
+        manifest = read_manifest(self.directory)
+        if manifest is None:
+            return False
+
+        matches = manifest.get('db_version') == serialize_version(self.stored_version.get())
+        if self._last_match != (manifest['version'], matches):
+            if matches:
+                logger.info(f"Using exported embeddings {manifest['version']}")
+            else:
+                logger.warning(f"Exported embeddings {manifest['version']} are out of date; run export_embeddings again")
+            self._last_match = (manifest['version'], matches)
+        return matches
+
+    def _current_version(self):
+        manifest = read_manifest(self.directory)
+        return manifest['version'] if manifest else None
+
+    def _build(self):
+        manifest = read_manifest(self.directory)
+        if manifest is None:
+            return np.empty((0, 0), dtype=np.float32), np.empty(0, dtype=np.int64)
+        matrix = np.load(os.path.join(self.directory, manifest['matrix']), mmap_mode='r')
+        ids = np.load(os.path.join(self.directory, manifest['ids']))
+        logger.info(f"Mapped exported embeddings {manifest['version']} ({len(ids)} movies)")
+        return matrix, ids
+
+
+# Shared by every request handled by this process
+stored_version = StoredVersion()
+embedding_index = EmbeddingIndex(stored_version=stored_version)
+memmap_embedding_index = MemmapEmbeddingIndex(stored_version=stored_version)
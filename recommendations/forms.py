@@ -12,4 +12,19 @@ class RecommendationForm(forms.Form):
                 'id': 'prompt-input',
             }
         )
-    ) 
\ No newline at end of file
+    )
+    top_k = forms.IntegerField(
+        min_value=1,
+        max_value=50,
+        required=False,
+        initial=1,
+        label="Results per page",
+        widget=forms.NumberInput(attrs={'class': 'form-control'})
+    )
+    min_score = forms.FloatField(
+        min_value=-1.0,
+        max_value=1.0,
+        required=False,
+        label="Minimum similarity",
+        widget=forms.NumberInput(attrs={'class': 'form-control', 'step': '0.05'})
+    ) 
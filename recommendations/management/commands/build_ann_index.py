@@ -0,0 +1,90 @@
+import json
+import time
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from movie.models import Movie
+from recommendations.ann import IVFIndex
+from recommendations.embedding_index import serialize_version, stored_embeddings_version
+
+
+class Command(BaseCommand):
+    help = "Build (or incrementally update) the approximate nearest-neighbour index over stored movie embeddings"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', type=str, default=settings.RECOMMENDATIONS_ANN_PATH,
+                            help='Where to write the index file (.npz)')
+        parser.add_argument('--lists', type=int, default=None,
+                            help='Number of IVF lists (k-means centroids); defaults to sqrt(number of movies)')
+        parser.add_argument('--nprobe', type=int, default=None,
+                            help='Default number of lists scanned per query (higher = better recall, slower); '
+                                 'defaults to 8, or to the current value with --update')
+        parser.add_argument('--iterations', type=int, default=20,
+                            help='Maximum k-means iterations')
+        parser.add_argument('--sample-size', type=int, default=None,
+                            help='Number of embeddings used to train the centroids (default: 64 per list)')
+        parser.add_argument('--update', action='store_true',
+                            help='Add movies embedded since the last build to the existing index instead of retraining')
+
+    def load_embeddings(self, movies):
+        ids = []
+        vectors = []
+        for movie_id, embedding in movies.values_list('id', 'embedding').iterator(chunk_size=2000):
+            if embedding is not None and len(embedding):
+                ids.append(movie_id)
+                vectors.append(embedding)
+        if not vectors:
+            return np.empty(0, dtype=np.int64), None
+        return np.asarray(ids, dtype=np.int64), np.vstack(vectors)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        started_at = timezone.now()
+        start = time.perf_counter()
+        # Taken before reading any row: embeddings written during the build
+        # change the version, so the index is never mistaken for current
+        db_version = json.dumps(serialize_version(stored_embeddings_version()))
+        movies = Movie.objects.exclude(embedding__isnull=True).order_by('id')
+
+        if options['update']:
+            try:
+                index, metadata = IVFIndex.load(path)
+            except FileNotFoundError:
+                self.stderr.write(self.style.ERROR(f"No index found at {path}; run without --update first"))
+                return
+            built_at = parse_datetime(metadata.get('built_at', ''))
+            if built_at is not None:
+                movies = movies.filter(embedding_updated_at__gte=built_at)
+            ids, vectors = self.load_embeddings(movies)
+
+            # Movies deleted (or stripped of their embedding) since the last build
+            live_ids = set(Movie.objects.exclude(embedding__isnull=True).values_list('id', flat=True))
+            removed = [movie_id for movie_id in index.ids() if movie_id not in live_ids]
+            index.remove(removed)
+            if len(ids):
+                index.add(ids, vectors)
+            if options['nprobe']:
+                index.nprobe = options['nprobe']
+            self.stdout.write(f"Added or replaced {len(ids)} movies, removed {len(removed)}")
+        else:
+            ids, vectors = self.load_embeddings(movies)
+            if not len(ids):
+                self.stderr.write(self.style.ERROR("No movies have embeddings. Run 'python manage.py compute_embeddings' first."))
+                return
+            self.stdout.write(f"Training IVF index on {len(ids)} embeddings...")
+            index = IVFIndex.train(
+                vectors,
+                n_lists=options['lists'],
+                iterations=options['iterations'],
+                sample_size=options['sample_size'],
+                nprobe=options['nprobe'] or 8,
+            )
+            index.add(ids, vectors)
+
+        index.save(path, built_at=started_at.isoformat(), db_version=db_version)
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(
+            f"Saved ANN index with {len(index)} movies in {index.n_lists} lists to {path} ({elapsed:.1f}s)"
+        ))
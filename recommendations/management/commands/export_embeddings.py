@@ -0,0 +1,123 @@
+import json
+import os
+import tempfile
+import time
+import uuid
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from movie.models import Movie
+from recommendations.embedding_index import (
+    MANIFEST_NAME, normalize_rows, read_manifest, serialize_version, stored_embeddings_version,
+)
+
+
+class Command(BaseCommand):
+    help = "Export all movie embeddings to a memory-mappable .npy matrix shared by every worker"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--directory', type=str, default=settings.RECOMMENDATIONS_EMBEDDINGS_DIR,
+                            help='Directory holding the exported matrix, id map and manifest')
+        parser.add_argument('--chunk-size', type=int, default=2000,
+                            help='Number of movies read from the database at a time')
+        parser.add_argument('--keep', type=int, default=2,
+                            help='Number of exports to keep on disk (older ones are deleted)')
+
+    def write_manifest(self, directory, manifest):
+        """Atomically replace the manifest so readers see either the old or the new export"""
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.manifest-', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(manifest, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, os.path.join(directory, MANIFEST_NAME))
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def cleanup(self, directory, keep_versions):
+        """Delete files of exports that are no longer referenced"""
+        for name in os.listdir(directory):
+            if not name.endswith('.npy'):
+                continue
+            version = name.split('-', 1)[-1][:-len('.npy')]
+            if version not in keep_versions:
+                os.remove(os.path.join(directory, name))
+
+    def handle(self, *args, **options):
+        directory = options['directory']
+        os.makedirs(directory, exist_ok=True)
+        start = time.perf_counter()
+        # Taken before reading any row: embeddings written during the export
+        # change the version, so the export is never mistaken for current
+        db_version = serialize_version(stored_embeddings_version())
+
+        movies = Movie.objects.exclude(embedding__isnull=True)
+        ids = list(movies.order_by('id').values_list('id', flat=True))
+        first = movies.order_by('id').values_list('embedding', flat=True).first()
+        if not ids or first is None:
+            self.stderr.write(self.style.ERROR("No movies have embeddings. Run 'python manage.py compute_embeddings' first."))
+            return
+        dimensions = len(first)
+
+        version = f"{timezone.now().strftime('%Y%m%d%H%M%S')}_{uuid.uuid4().hex[:8]}"
+        matrix_name = f'embeddings-{version}.npy'
+        ids_name = f'ids-{version}.npy'
+        matrix_path = os.path.join(directory, matrix_name)
+
+        # Stream rows straight into the .npy file instead of building the matrix in memory
+        matrix = np.lib.format.open_memmap(matrix_path, mode='w+', dtype=np.float32, shape=(len(ids), dimensions))
+        exported_ids = []
+        for offset in range(0, len(ids), options['chunk_size']):
+            chunk = ids[offset:offset + options['chunk_size']]
+            vectors = dict(Movie.objects.filter(id__in=chunk).values_list('id', 'embedding'))
+            block_ids = [
+                movie_id for movie_id in chunk
+                # Skip movies deleted meanwhile, or stored with a different dimension
+                if vectors.get(movie_id) is not None and len(vectors[movie_id]) == dimensions
+            ]
+            if not block_ids:
+                continue
+            block = normalize_rows(np.vstack([vectors[movie_id] for movie_id in block_ids]).astype(np.float32))
+            matrix[len(exported_ids):len(exported_ids) + len(block_ids)] = block
+            exported_ids.extend(block_ids)
+
+        count = len(exported_ids)
+        matrix.flush()
+        del matrix
+
+        if count < len(ids):
+            # Some rows were skipped; rewrite the file without the unused tail
+            trimmed = np.load(matrix_path, mmap_mode='r')[:count]
+            tmp_path = matrix_path + '.tmp.npy'
+            np.save(tmp_path, trimmed)
+            del trimmed
+            os.replace(tmp_path, matrix_path)
+
+        np.save(os.path.join(directory, ids_name), np.asarray(exported_ids, dtype=np.int64))
+
+        previous = read_manifest(directory)
+        self.write_manifest(directory, {
+            'version': version,
+            'matrix': matrix_name,
+            'ids': ids_name,
+            'count': count,
+            'dimensions': dimensions,
+            'db_version': db_version,
+            'exported_at': timezone.now().isoformat(),
+        })
+
+        # Keep the previous export around so workers that read the old manifest
+        # a moment ago can still open its files
+        keep_versions = {version}
+        if previous and options['keep'] > 1:
+            keep_versions.add(previous['version'])
+        self.cleanup(directory, keep_versions)
+
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(
+            f"Exported {count} embeddings ({dimensions} dimensions) to {matrix_path} in {elapsed:.1f}s"
+        ))
@@ -0,0 +1,19 @@
+# Generated by Django 5.2 on 2026-10-18 07:34
+
+import movie.fields
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recommendations', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='promptembedding',
+            name='embedding',
+            field=movie.fields.VectorField(),
+        ),
+    ]
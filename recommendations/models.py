@@ -1,3 +1,20 @@
 from django.db import models
 
-# Create your models here.
+from movie.fields import VectorField
+
+
+class PromptEmbedding(models.Model):
+    """
+    Shared tier of the prompt-embedding cache, so every worker process can
+    reuse embeddings that any other worker already paid for.
+    """
+    # sha256 of the embedding model name and the normalized prompt
+    key = models.CharField(max_length=64, unique=True)
+    model = models.CharField(max_length=100)
+    prompt = models.TextField()
+    embedding = VectorField()
+    hits = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return f'{self.prompt} ({self.model})'
@@ -1,3 +1,359 @@
-from django.test import TestCase
+import io
+import os
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+
+from movie.models import Movie
+
+from . import views
+from .models import PromptEmbedding
+from .ann import AnnEngine, IVFIndex
+from .embedding_cache import PromptEmbeddingCache
+from .embedding_index import EmbeddingIndex, MemmapEmbeddingIndex, StoredVersion, embedding_index, normalize_rows
+
+
+def clustered_vectors(rng, centers, count):
+    """Points scattered around random cluster centers, like embeddings of related movies"""
+    return (centers[rng.integers(0, len(centers), count)] + 0.5 * rng.standard_normal((count, centers.shape[1]))).astype(np.float32)
+
+
+class IVFIndexTests(SimpleTestCase):
+    K = 10
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        rng = np.random.default_rng(1)
+        centers = rng.standard_normal((40, 32))
+        cls.vectors = clustered_vectors(rng, centers, 2000)
+        cls.ids = np.arange(1, len(cls.vectors) + 1) * 3
+        cls.queries = clustered_vectors(rng, centers, 50)
+        cls.index = IVFIndex.train(cls.vectors)
+        cls.index.add(cls.ids, cls.vectors)
+
+    def exact_top_k(self, query, ids=None, vectors=None):
+        ids = self.ids if ids is None else ids
+        vectors = self.vectors if vectors is None else vectors
+        similarities = normalize_rows(vectors) @ (query / np.linalg.norm(query))
+        return ids[np.argsort(-similarities, kind='stable')[:self.K]].tolist()
+
+    def recall(self, index, nprobe):
+        hits = 0
+        for query in self.queries:
+            found, _ = index.search(query, self.K, nprobe=nprobe)
+            hits += len(set(found.tolist()) & set(self.exact_top_k(query)))
+        return hits / (len(self.queries) * self.K)
+
+    def test_recall_against_exact_search(self):
+        self.assertEqual(len(self.index), len(self.ids))
+        self.assertGreaterEqual(self.recall(self.index, nprobe=1), 0.8)
+        self.assertGreaterEqual(self.recall(self.index, nprobe=8), 0.95)
+        # Probing every list is a brute-force search
+        self.assertEqual(self.recall(self.index, nprobe=self.index.n_lists), 1.0)
+
+    def test_results_are_sorted_and_thresholded(self):
+        found, similarities = self.index.search(self.queries[0], self.K, nprobe=self.index.n_lists)
+        self.assertEqual(found.tolist(), self.exact_top_k(self.queries[0]))
+        self.assertTrue(np.all(np.diff(similarities) <= 0))
+        threshold = float(similarities[3])
+        found, similarities = self.index.search(self.queries[0], self.K, nprobe=self.index.n_lists, min_score=threshold)
+        self.assertEqual(len(found), 4)
+        self.assertTrue(np.all(similarities >= threshold))
+
+    def test_incremental_updates_and_save_load(self):
+        index = IVFIndex(self.index.centroids, nprobe=self.index.nprobe)
+        index.add(self.ids[:1000], self.vectors[:1000])
+        index.add(self.ids[1000:], self.vectors[1000:])
+        # Replaced vectors move with their id; removed ids are never returned
+        index.add(self.ids[:1], self.vectors[1:2])
+        index.remove(self.ids[1:2].tolist())
+        self.assertEqual(len(index), len(self.ids) - 1)
+        self.assertNotIn(self.ids[1], index)
+        self.assertIn(self.ids[0], index)
+        self.assertCountEqual(index.ids(), np.delete(self.ids, 1).tolist())
+
+        ids = np.delete(self.ids, 1)
+        vectors = np.delete(self.vectors, 1, axis=0)
+        vectors[0] = self.vectors[1]
+        query = self.vectors[1]
+        found, _ = index.search(query, self.K, nprobe=index.n_lists)
+        self.assertEqual(found.tolist(), self.exact_top_k(query, ids, vectors))
+        self.assertEqual(found[0], self.ids[0])
+
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, 'index.npz')
+            index.save(path, built_at='2024-01-01T00:00:00')
+            loaded, metadata = IVFIndex.load(path)
+        self.assertEqual(metadata, {'built_at': '2024-01-01T00:00:00'})
+        self.assertEqual(len(loaded), len(index))
+        for query in self.queries[:5]:
+            self.assertEqual(loaded.search(query, self.K)[0].tolist(), index.search(query, self.K)[0].tolist())
+
+
+class MemmapEmbeddingIndexTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        rng = np.random.default_rng(2)
+        cls.movies = [
+            Movie.objects.create(
+                title=f'Movie {i}', description='d', image='',
+                embedding=rng.standard_normal(8).astype(np.float32), embedding_updated_at=timezone.now(),
+            )
+            for i in range(5)
+        ]
+
+    def setUp(self):
+        folder = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        self.directory = folder.name
+        self.index = MemmapEmbeddingIndex(self.directory, check_interval=0)
+        patcher = mock.patch.object(views, 'memmap_embedding_index', self.index)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def export(self):
+        call_command('export_embeddings', '--directory', self.directory, stdout=io.StringIO())
+
+    def test_export_is_used_only_while_it_matches_the_database(self):
+        self.assertFalse(self.index.available())
+        self.export()
+        self.assertTrue(self.index.available())
+        self.assertIs(views.get_search_index(), self.index)
+        query = self.movies[2].embedding
+        self.assertEqual(self.index.top_k(query, 3)[0].tolist(), embedding_index.top_k(query, 3)[0].tolist())
+
+        # A re-embedded movie makes the export stale
+        Movie.objects.filter(pk=self.movies[0].pk).update(
+            embedding=np.ones(8, dtype=np.float32), embedding_updated_at=timezone.now() + timedelta(seconds=1),
+        )
+        with self.assertLogs('recommendations.embedding_index', 'WARNING'):
+            self.assertFalse(self.index.available())
+        self.assertIs(views.get_search_index(), embedding_index)
+
+        self.export()
+        self.assertIs(views.get_search_index(), self.index)
+        # So does a new movie, even with an older timestamp
+        Movie.objects.create(
+            title='New', description='d', image='', embedding=np.ones(8, dtype=np.float32),
+            embedding_updated_at=timezone.now() - timedelta(days=1),
+        )
+        with self.assertLogs('recommendations.embedding_index', 'WARNING'):
+            self.assertIs(views.get_search_index(), embedding_index)
+
+    def test_database_is_checked_once_per_interval(self):
+        index = MemmapEmbeddingIndex(self.directory, check_interval=60)
+        self.export()
+        self.assertTrue(index.available())
+        Movie.objects.filter(pk=self.movies[0].pk).update(embedding_updated_at=timezone.now() + timedelta(seconds=1))
+        with self.assertNumQueries(0):
+            self.assertTrue(index.available())
+            index.top_k(self.movies[0].embedding, 2)
+
+        now = time.monotonic()
+        with mock.patch('recommendations.embedding_index.time.monotonic', return_value=now + 61):
+            with self.assertLogs('recommendations.embedding_index', 'WARNING'):
+                self.assertFalse(index.available())
+
+
+class EmbeddingIndexTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        rng = np.random.default_rng(3)
+        cls.movies = [
+            Movie.objects.create(
+                title=f'Movie {i}', description='d', image='',
+                embedding=rng.standard_normal(8).astype(np.float32), embedding_updated_at=timezone.now(),
+            )
+            for i in range(5)
+        ]
+
+    def test_stored_embeddings_are_checked_once_per_interval(self):
+        index = EmbeddingIndex(check_interval=60)
+        query = self.movies[1].embedding
+        self.assertEqual(index.top_k(query, 1)[0].tolist(), [self.movies[1].pk])
+        version = index.version
+
+        # A recommend request only looks at the database once the interval is over
+        with mock.patch.object(views, 'get_embedding', return_value=query), self.assertNumQueries(0):
+            self.assertEqual(len(index), 5)
+            ranking = views.rank_movies(None, 'prompt', index, index.version)
+        self.assertEqual(ranking[0][0], self.movies[1].pk)
+
+        Movie.objects.filter(pk=self.movies[0].pk).update(embedding=query, embedding_updated_at=timezone.now())
+        self.assertEqual(index.version, version)
+        now = time.monotonic()
+        with mock.patch('recommendations.embedding_index.time.monotonic', return_value=now + 61):
+            self.assertNotEqual(index.version, version)
+            self.assertCountEqual(index.top_k(query, 2)[0].tolist(), [self.movies[0].pk, self.movies[1].pk])
+
+
+class AnnEngineTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        rng = np.random.default_rng(4)
+        cls.movies = [
+            Movie.objects.create(
+                title=f'Movie {i}', description='d', image='',
+                embedding=rng.standard_normal(8).astype(np.float32), embedding_updated_at=timezone.now(),
+            )
+            for i in range(20)
+        ]
+
+    def setUp(self):
+        folder = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        self.path = os.path.join(folder.name, 'index.npz')
+
+    def build(self, *args):
+        call_command('build_ann_index', '--path', self.path, *args, stdout=io.StringIO())
+
+    def test_searches_with_the_saved_nprobe_unless_overridden(self):
+        self.build('--lists', '4', '--nprobe', '2')
+        engine = AnnEngine(self.path, stored_version=StoredVersion(0))
+        self.assertEqual(engine.version[2], 2)
+        with mock.patch.object(IVFIndex, 'search', autospec=True, return_value=([], [])) as search:
+            engine.top_k(self.movies[0].embedding, 3)
+        self.assertIsNone(search.call_args.kwargs['nprobe'])
+        self.assertEqual(search.call_args.args[0].nprobe, 2)
+
+        self.build('--update')
+        self.assertEqual(engine.version[2], 2)
+        self.assertEqual(AnnEngine(self.path, nprobe=4).version[2], 4)
+
+    @override_settings(RECOMMENDATIONS_ANN_ENABLED=True)
+    def test_index_is_used_only_while_it_matches_the_database(self):
+        engine = AnnEngine(self.path, stored_version=StoredVersion(0))
+        self.assertFalse(engine.available())
+        self.build('--lists', '4')
+        self.assertTrue(engine.available())
+        with mock.patch.object(views, 'ann_engine', engine):
+            self.assertIs(views.get_search_index(), engine)
+
+            deleted_id = self.movies[0].pk
+            Movie.objects.filter(pk=deleted_id).delete()
+            with self.assertLogs('recommendations.ann', 'WARNING'):
+                self.assertFalse(engine.available())
+            self.assertIsNot(views.get_search_index(), engine)
+
+            self.build('--update')
+            self.assertIs(views.get_search_index(), engine)
+            self.assertNotIn(deleted_id, engine._current()[0])
+
+
+class PromptEmbeddingCacheTests(TestCase):
+    def setUp(self):
+        self.cache = PromptEmbeddingCache(max_entries=2, ttl=60, shared_max_entries=100)
+        self.computed = []
+
+    def get(self, prompt, cache=None):
+        def compute():
+            self.computed.append(prompt)
+            return [float(len(self.computed)), 0.0]
+        return (cache or self.cache).get_or_compute(prompt, 'model', compute)
+
+    def test_local_then_shared_then_api(self):
+        first = self.get('World War II  movie')
+        self.assertEqual(self.get('world war ii movie').tolist(), first.tolist())
+        # Another process finds it in the shared table
+        other = PromptEmbeddingCache(max_entries=2, ttl=60)
+        self.assertEqual(self.get('World War II movie', other).tolist(), first.tolist())
+        self.assertEqual(self.computed, ['World War II  movie'])
+        self.assertEqual(PromptEmbedding.objects.get().hits, 1)
+        self.assertEqual(self.cache.stats()['local_hits'], 1)
+        self.assertEqual((other.stats()['shared_hits'], other.stats()['misses']), (1, 0))
+        self.assertEqual(self.cache.stats()['hit_rate'], 0.5)
+
+    def test_least_recently_used_entries_are_evicted(self):
+        self.get('a')
+        self.get('b')
+        self.get('a')
+        self.get('c')
+        self.assertEqual(self.cache.stats()['local_entries'], 2)
+        PromptEmbedding.objects.all().delete()
+        self.get('a')
+        self.get('c')
+        self.assertEqual(self.computed, ['a', 'b', 'c'])
+        self.get('b')
+        self.assertEqual(self.computed, ['a', 'b', 'c', 'b'])
+
+    def test_expired_entries_are_recomputed(self):
+        self.get('a')
+        now = time.monotonic()
+        with mock.patch('recommendations.embedding_cache.time.monotonic', return_value=now + 61):
+            # Gone locally, still fresh in the shared table
+            self.get('a')
+            self.assertEqual(self.computed, ['a'])
+            self.assertEqual(self.cache.stats()['shared_hits'], 1)
+            self.cache.clear()
+            PromptEmbedding.objects.update(created_at=timezone.now() - timedelta(seconds=61))
+            self.get('a')
+        self.assertEqual(self.computed, ['a', 'a'])
+        self.assertEqual(PromptEmbedding.objects.count(), 1)
+
+    def test_counters_are_exact_under_concurrency(self):
+        self.get('a')
+        threads = [threading.Thread(target=lambda: [self.get('a') for _ in range(500)]) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.cache.stats()['local_hits'], 4000)
+
+
+@override_settings(RECOMMENDATIONS_ANN_ENABLED=False)
+class RecommendViewTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        rng = np.random.default_rng(6)
+        cls.movies = [
+            Movie.objects.create(
+                title=f'Movie {i}', description='d', image='',
+                embedding=rng.standard_normal(8).astype(np.float32), embedding_updated_at=timezone.now(),
+            )
+            for i in range(5)
+        ]
+
+    def setUp(self):
+        cache.clear()
+        patchers = [
+            mock.patch.dict(os.environ, {'openai_apikey': 'sk-test'}),
+            mock.patch.object(views.memmap_embedding_index, 'available', return_value=False),
+            mock.patch.object(views, 'embedding_index', EmbeddingIndex(check_interval=0)),
+            mock.patch.object(views, 'get_embedding', return_value=self.movies[3].embedding),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_invalid_parameters_are_reported_and_not_searched(self):
+        for data in [{'prompt': 'war', 'top_k': 'abc'}, {'prompt': 'war', 'min_score': '2'}, {'prompt': '  '}]:
+            with self.subTest(data=data):
+                response = self.client.post('/recommendations/', data)
+                self.assertEqual(response.status_code, 200)
+                self.assertTrue(response.context['form'].errors)
+                self.assertContains(response, 'alert-warning')
+                self.assertIsNone(response.context['recommended_movie'])
+        views.get_embedding.assert_not_called()
+
+    def test_pages_are_only_served_from_a_cached_ranking(self):
+        # A link to a search nobody submitted doesn't call the API
+        response = self.client.get('/recommendations/', {'prompt': 'war', 'top_k': 2, 'page': 2})
+        self.assertContains(response, 'Submit the search again')
+        views.get_embedding.assert_not_called()
+
+        response = self.client.post('/recommendations/', {'prompt': 'war', 'top_k': 2})
+        self.assertEqual(response.context['recommended_movie'], self.movies[3])
+        self.assertEqual(views.get_embedding.call_count, 1)
+        response = self.client.get('/recommendations/', {'prompt': 'war', 'top_k': 2, 'page': 2})
+        self.assertEqual(response.context['page_obj'].number, 2)
+        self.assertEqual(len(response.context['recommendations']), 2)
+        self.assertEqual(views.get_embedding.call_count, 1)
@@ -3,9 +3,18 @@ import os
 import numpy as np
 from openai import OpenAI
 from dotenv import load_dotenv
+from movie.embeddings import EMBEDDING_MODEL
 from movie.models import Movie
+from movie.search import search_movies
 from .forms import RecommendationForm
+from .ann import ann_engine
+from .embedding_index import embedding_index, memmap_embedding_index
+from .embedding_cache import normalize_prompt, prompt_embedding_cache
+import hashlib
 import logging
+from django.conf import settings
+from django.core.cache import cache
+from django.core.paginator import Paginator
 from django.http import HttpResponse
 from django.db.models import F
 from django.utils import timezone
@@ -14,14 +23,17 @@ from datetime import timedelta
 # Set up logger
 logger = logging.getLogger(__name__)
 
-def get_embedding(client, text):
-    """Get OpenAI embedding for a text"""
-    try:
-        response = client.embeddings.create(input=[text], model="text-embedding-3-small")
-        return np.array(response.data[0].embedding, dtype=np.float32)
-    except Exception as e:
-        logger.error(f"Error getting embedding: {str(e)}")
-        raise
+def get_embedding(client, text, model=EMBEDDING_MODEL):
+    """Get OpenAI embedding for a text, served from the prompt cache when possible"""
+    def fetch():
+        try:
+            response = client.embeddings.create(input=[text], model=model)
+            return np.array(response.data[0].embedding, dtype=np.float32)
+        except Exception as e:
+            logger.error(f"Error getting embedding: {str(e)}")
+            raise
+    
+    return prompt_embedding_cache.get_or_compute(text, model, fetch)
 
 def cosine_similarity(a, b):
     """Calculate cosine similarity between two vectors"""
@@ -41,8 +53,8 @@ def test_recommend(request):
         
         if form.is_valid():
             prompt = form.cleaned_data['prompt']
-            # Instead of using OpenAI, just find a movie with the prompt in title or description
-            movies = Movie.objects.filter(title__icontains=prompt) | Movie.objects.filter(description__icontains=prompt)
+            # Instead of using OpenAI, take the best full-text match for any word of the prompt
+            movies = search_movies(prompt, match_any=True)
             
             if movies.exists():
                 recommended_movie = movies.first()
@@ -59,109 +71,147 @@ def test_recommend(request):
     
     return render(request, 'recommendations/recommend.html', context)
 
+def get_search_index():
+    """
+    The approximate (IVF) index when it is enabled and was built from the
+    stored embeddings, then
+    the exact index over the memory-mapped export when one exists and matches
+    the stored embeddings, otherwise the exact index built in this process's
+    memory
+    """
+    if settings.RECOMMENDATIONS_ANN_ENABLED and ann_engine.available():
+        return ann_engine
+    if memmap_embedding_index.available():
+        return memmap_embedding_index
+    return embedding_index
+
+def rank_movies(client, prompt, search_index, version, min_score=None, cached_only=False):
+    """
+    Rank the movies of `search_index` (whose current version is `version`)
+    against a prompt and return [(movie_id, score), ...], best first. The
+    ranking is cached so later pages for the same prompt are served by
+    slicing it instead of embedding and scanning again. With cached_only,
+    returns None instead of computing a ranking that is not cached.
+    """
+    cache_key = 'recommendations:ranking:' + hashlib.sha256(
+        repr((normalize_prompt(prompt), min_score, version)).encode('utf-8')
+    ).hexdigest()
+    ranking = cache.get(cache_key)
+    
+    if ranking is None and not cached_only:
+        prompt_embedding = get_embedding(client, prompt)
+        ids, scores = search_index.top_k(prompt_embedding, settings.RECOMMENDATIONS_MAX_RESULTS, min_score)
+        ranking = list(zip(ids.tolist(), scores.tolist()))
+        cache.set(cache_key, ranking, settings.RECOMMENDATIONS_RANKING_TTL)
+    
+    return ranking
+
 def recommend_movie(request):
     """
     View that recommends movies based on a similarity search with 
-    the provided prompt - using precomputed embeddings for performance
+    the provided prompt - using precomputed embeddings for performance.
+    
+    Returns the top `top_k` matches per page, optionally only those scoring at
+    least `min_score`. Searches are submitted with POST; later pages are
+    requested with GET so they can be linked, and only served from the cached
+    ranking, so a crafted link never triggers a paid embedding call.
     """
     recommended_movie = None
     similarity_score = None
     error_message = None
+    recommendations = []
+    page_obj = None
     
-    if request.method == 'POST':
-        prompt = request.POST.get('prompt', '')
+    data = request.POST if request.method == 'POST' else request.GET
+    form = RecommendationForm(data or None)
+    
+    # Invalid parameters are reported next to the form and nothing is searched
+    if (request.method == 'POST' or 'prompt' in request.GET) and form.is_valid():
+        prompt = form.cleaned_data['prompt']
+        top_k = form.cleaned_data['top_k'] or 1
+        min_score = form.cleaned_data['min_score']
         
-        if prompt:
-            # Try to find movies using OpenAI embeddings
-            try:
-                # Attempt to load OpenAI API key from .env files
-                env_loaded_from_file = False
-                for path in ['openAI.env', '../openAI.env', './openAI.env']:
-                    if os.path.exists(path):
-                        load_dotenv(path)
-                        env_loaded_from_file = True
-                        logger.info(f"Loaded environment variables from: {path}")
-                        break
-                
-                api_key_value = os.environ.get('openai_apikey')
+        # Try to find movies using OpenAI embeddings
+        try:
+            # Attempt to load OpenAI API key from .env files
+            env_loaded_from_file = False
+            for path in ['openAI.env', '../openAI.env', './openAI.env']:
+                if os.path.exists(path):
+                    load_dotenv(path)
+                    env_loaded_from_file = True
+                    logger.info(f"Loaded environment variables from: {path}")
+                    break
+            
+            api_key_value = os.environ.get('openai_apikey')
+            # Resolved once per request: each lookup may check the stored embeddings
+            search_index = get_search_index() if api_key_value else None
 
-                if not api_key_value:
-                    logger.warning("OpenAI API key ('openai_apikey') not found. Falling back to text search.")
-                    # Fall back to text search if OpenAI is not available
-                    movies = Movie.objects.filter(title__icontains=prompt) | Movie.objects.filter(description__icontains=prompt)
-                    
-                    if movies.exists():
-                        recommended_movie = movies.first()
-                        similarity_score = 0.75  # Approximate score
-                    else:
-                        error_message = f"No movies found matching: '{prompt}' (API key missing)."
+            if not api_key_value:
+                logger.warning("OpenAI API key ('openai_apikey') not found. Falling back to text search.")
+                # Fall back to text search if OpenAI is not available
+                movies = search_movies(prompt, match_any=True)
+                
+                if movies.exists():
+                    recommended_movie = movies.first()
+                    similarity_score = 0.75  # Approximate score
                 else:
-                    # Use OpenAI embeddings
-                    client = OpenAI(api_key=api_key_value)
-                    
-                    # Get embedding for the prompt
-                    prompt_embedding = get_embedding(client, prompt)
+                    error_message = f"No movies found matching: '{prompt}' (API key missing)."
+            elif len(search_index) == 0:
+                # No precomputed embeddings available, fall back to text search
+                movies = search_movies(prompt, match_any=True)
+                
+                if movies.exists():
+                    recommended_movie = movies.first()
+                    similarity_score = 0.7  # Approximate score
+                    error_message = "Using text search (no embeddings available). Run 'python manage.py compute_embeddings' to improve results."
+                else:
+                    error_message = f"No movies found matching: '{prompt}'"
+            else:
+                # Use OpenAI embeddings scored against the in-memory index
+                client = OpenAI(api_key=api_key_value)
+                ranking = rank_movies(
+                    client, prompt, search_index, search_index.version, min_score,
+                    cached_only=request.method != 'POST',
+                )
+                
+                if ranking is None:
+                    error_message = "These results have expired. Submit the search again."
+                else:
+                    paginator = Paginator(ranking, top_k)
+                    page_obj = paginator.get_page(data.get('page'))
                     
-                    # Get movies with precomputed embeddings
-                    movies_with_embeddings = Movie.objects.exclude(embedding__isnull=True)
+                    # Movies may have been deleted since the index was built
+                    movies_by_id = Movie.objects.in_bulk([movie_id for movie_id, _ in page_obj])
+                    recommendations = [
+                        (movies_by_id[movie_id], score)
+                        for movie_id, score in page_obj
+                        if movie_id in movies_by_id
+                    ]
                     
-                    if not movies_with_embeddings.exists():
-                        # No precomputed embeddings available, fall back to text search
-                        movies = Movie.objects.filter(title__icontains=prompt) | Movie.objects.filter(description__icontains=prompt)
+                    if recommendations:
+                        recommended_movie, similarity_score = recommendations[0]
+                    elif min_score is not None:
+                        error_message = f"No movies scored at least {min_score} for: '{prompt}'"
+                    else:
+                        # Try text search as fallback
+                        movies = search_movies(prompt, match_any=True)
                         
                         if movies.exists():
                             recommended_movie = movies.first()
                             similarity_score = 0.7  # Approximate score
-                            error_message = "Using text search (no embeddings available). Run 'python manage.py compute_embeddings' to improve results."
                         else:
                             error_message = f"No movies found matching: '{prompt}'"
-                    else:
-                        # Calculate similarity for each movie using precomputed embeddings
-                        best_match = None
-                        best_similarity = -1
-                        
-                        # Convert prompt embedding to list for comparison with stored JSON
-                        prompt_embedding_list = prompt_embedding.tolist()
-                        
-                        for movie in movies_with_embeddings:
-                            if not movie.embedding:
-                                continue
-                                
-                            try:
-                                # Convert stored embedding from JSON back to numpy array
-                                movie_embedding = np.array(movie.embedding, dtype=np.float32)
-                                similarity = cosine_similarity(prompt_embedding, movie_embedding)
-                                
-                                if similarity > best_similarity:
-                                    best_similarity = similarity
-                                    best_match = movie
-                            except Exception as e:
-                                logger.error(f"Error processing movie {movie.title}: {str(e)}")
-                                continue
-                        
-                        if best_match:
-                            recommended_movie = best_match
-                            similarity_score = best_similarity
-                        else:
-                            # Try text search as fallback
-                            movies = Movie.objects.filter(title__icontains=prompt) | Movie.objects.filter(description__icontains=prompt)
-                            
-                            if movies.exists():
-                                recommended_movie = movies.first()
-                                similarity_score = 0.7  # Approximate score
-                            else:
-                                error_message = f"No movies found matching: '{prompt}'"
-            
-            except Exception as e:
-                error_message = f"Error retrieving recommendation: {str(e)}"
-                logger.error(f"Error recommending movie: {str(e)}")
-        else:
-            error_message = "Please enter a search term."
+        
+        except Exception as e:
+            error_message = f"Error retrieving recommendation: {str(e)}"
+            logger.error(f"Error recommending movie: {str(e)}")
     
     context = {
-        'form': RecommendationForm(),
+        'form': form,
         'recommended_movie': recommended_movie,
         'similarity_score': similarity_score,
+        'recommendations': recommendations,
+        'page_obj': page_obj,
         'error_message': error_message,
     }
     
@@ -175,8 +225,8 @@ def direct_recommend(request, prompt):
     similarity_score = None
     error_message = None
     
-    # Use simple text search for now
-    movies = Movie.objects.filter(title__icontains=prompt) | Movie.objects.filter(description__icontains=prompt)
+    # Use full-text search for now (best match for any word of the prompt)
+    movies = search_movies(prompt, match_any=True)
     
     if movies.exists():
         recommended_movie = movies.first()